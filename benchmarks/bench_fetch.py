@@ -0,0 +1,455 @@
+"""Benchmark the fetch and import paths end to end, without network access or a MongoDB server.
+
+Fetches are made from a local fake GitHub API, which serves paginated lists with rate limit headers
+after a configurable latency.  Imports read synthetic cURL dumps in the layout used by `FileFetcher`.
+Data is stored in MongoDB if `--store mongo` is given, or otherwise in an in-memory store.
+
+Results are written as JSON, and may be compared against a previous run with `--baseline`.
+"""
+import base64
+import datetime
+import http.server
+import json
+import logging
+import os
+import pathlib
+import platform
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import typing
+import urllib.parse
+import zlib
+
+# Requests to the fake API are not paced, since its rate limit is never exhausted
+os.environ.setdefault('RATE_LIMIT_PACING', 'False')
+os.environ.setdefault('GITHUB_AUTH_TOKEN', 'benchmark')
+
+import click  # noqa: E402
+import pymongo  # noqa: E402
+import pymongo.monitoring  # noqa: E402
+
+from github_analysis import __main__ as gha  # noqa: E402
+from github_analysis import connectors, db, fetch  # noqa: E402
+from memory_store import MemoryClient  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+# Database used, and dropped, by `--store mongo`
+BENCH_DATABASE = 'github_bench'
+
+LIST_TYPES = {
+    'events': 'events',
+    'issues': 'issues',
+    'comments': 'issues/comments',
+    'commits': 'commits',
+}
+
+
+def make_id(*parts: typing.Any) -> int:
+    """Make a stable ID for a synthetic record."""
+    return zlib.crc32(repr(parts).encode())
+
+
+def make_user(login: str) -> typing.Dict[str, typing.Any]:
+    user_id = make_id('user', login)
+    api = f'https://api.github.com/users/{login}'
+
+    return {
+        'login': login,
+        'id': user_id,
+        'node_id': f'U_{user_id}',
+        'avatar_url': f'https://avatars.githubusercontent.com/u/{user_id}?v=4',
+        'url': api,
+        'html_url': f'https://github.com/{login}',
+        'followers_url': f'{api}/followers',
+        'repos_url': f'{api}/repos',
+        'events_url': f'{api}/events{{/privacy}}',
+        'type': 'User',
+        'site_admin': False,
+    }
+
+
+def make_repo(repo_name: str) -> typing.Dict[str, typing.Any]:
+    owner, name = repo_name.split('/')
+    repo_id = make_id('repo', repo_name)
+    api = f'https://api.github.com/repos/{repo_name}'
+
+    return {
+        'id': repo_id,
+        'node_id': f'R_{repo_id}',
+        'name': name,
+        'full_name': repo_name,
+        'owner': make_user(owner),
+        'description': 'Synthetic repository for benchmarking ' * 4,
+        'url': api,
+        'html_url': f'https://github.com/{repo_name}',
+        'issues_url': f'{api}/issues{{/number}}',
+        'commits_url': f'{api}/commits{{/sha}}',
+        'stargazers_count': repo_id % 1000,
+        'language': 'Python',
+        'created_at': '2016-02-16T10:00:00Z',
+        'updated_at': '2021-03-11T00:00:00Z',
+    }
+
+
+def make_readme(repo_name: str) -> typing.Dict[str, typing.Any]:
+    content = f'# {repo_name}\n\n' + 'Synthetic README content for benchmarking.\n' * 50
+
+    return {
+        'name': 'README.md',
+        'path': 'README.md',
+        'sha': f'{make_id("readme", repo_name):040x}',
+        'size': len(content),
+        'encoding': 'base64',
+        'content': base64.b64encode(content.encode()).decode(),
+    }
+
+
+def make_item(fetch_type: str, repo_name: str, index: int) -> typing.Dict[str, typing.Any]:
+    """Make a single record in a list of events, issues, comments or commits."""
+    owner = repo_name.split('/')[0]
+    item_id = make_id(fetch_type, repo_name, index)
+    timestamp = (datetime.datetime(2021, 1, 1) + datetime.timedelta(hours=index)).isoformat() + 'Z'
+
+    item = {
+        'id': item_id,
+        'node_id': f'{fetch_type[0].upper()}_{item_id}',
+        'url': f'https://api.github.com/repos/{repo_name}/{LIST_TYPES[fetch_type]}/{item_id}',
+        'user': make_user(owner),
+        'created_at': timestamp,
+        'updated_at': timestamp,
+    }
+
+    if fetch_type == 'commits':
+        item['sha'] = f'{item_id:040x}'
+        item['commit'] = {
+            'author': {'name': owner, 'email': f'{owner}@example.com', 'date': timestamp},
+            'message': 'Synthetic commit message ' * 5,
+        }
+        item['author'] = item.pop('user')
+
+    elif fetch_type in {'issues', 'comments'}:
+        item['body'] = 'Synthetic issue text for benchmarking. ' * 20
+
+    else:
+        item['type'] = 'PushEvent'
+        item['payload'] = {'size': 1, 'ref': 'refs/heads/main'}
+
+    return item
+
+
+class FakeGitHubHandler(http.server.BaseHTTPRequestHandler):
+    """Serve synthetic GitHub API responses, with pagination and rate limit headers."""
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, so Nagle's algorithm would delay keep-alive responses
+    disable_nagle_algorithm = True
+
+    latency = 0.0
+    pages = 3
+    per_page = 30
+    rate_limit = 10**6
+    reset = int(time.time()) + 3600
+
+    pages_served = 0
+    lock = threading.Lock()
+
+    routes = [
+        (re.compile(r'^/repos/([^/]+/[^/]+)$'), lambda repo_name, page: make_repo(repo_name)),
+        (re.compile(r'^/users/([^/]+)$'), lambda owner, page: make_user(owner)),
+        (re.compile(r'^/repos/([^/]+/[^/]+)/readme$'), lambda repo_name, page: make_readme(repo_name)),
+    ] + [
+        (re.compile(rf'^/repos/([^/]+/[^/]+)/{path}$'), fetch_type)
+        for fetch_type, path in LIST_TYPES.items()
+    ]  # yapf: disable
+
+    def do_GET(self):
+        time.sleep(self.latency)
+
+        url = urllib.parse.urlsplit(self.path)
+        page = int(urllib.parse.parse_qs(url.query).get('page', ['1'])[0])
+
+        for pattern, route in self.routes:
+            match = pattern.match(url.path)
+            if match:
+                break
+
+        else:
+            self.send_error(404)
+            return
+
+        headers = {'Content-Type': 'application/json; charset=utf-8'}
+
+        if isinstance(route, str):
+            content = [make_item(route, match.group(1), (page - 1) * self.per_page + i) for i in range(self.per_page)]
+
+            if page < self.pages:
+                query = urllib.parse.parse_qs(url.query)
+                query['page'] = [str(page + 1)]
+                next_url = f'http://{self.headers["Host"]}{url.path}?{urllib.parse.urlencode(query, doseq=True)}'
+                headers['Link'] = f'<{next_url}>; rel="next"'
+
+        else:
+            content = route(match.group(1), page)
+
+        with self.lock:
+            FakeGitHubHandler.pages_served += 1
+            headers['X-RateLimit-Remaining'] = str(self.rate_limit - FakeGitHubHandler.pages_served)
+
+        headers['X-RateLimit-Reset'] = str(self.reset)
+
+        body = json.dumps(content).encode()
+        self.send_response(200)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def write_curl_dumps(root: pathlib.Path, repos: typing.Iterable[str], pages: int, per_page: int) -> int:
+    """Write synthetic cURL dumps in the layout read by `FileFetcher`.
+
+    :return: Number of pages written
+    """
+    def block(content: typing.Any) -> str:
+        return 'HTTP/1.1 200 OK\r\nContent-Type: application/json; charset=utf-8\r\n\r\n' + json.dumps(
+            content, indent=2
+        ) + '\n'
+
+    count = 0
+    for repo_name in repos:
+        single = {
+            'repos': make_repo(repo_name),
+            'users': make_user(repo_name.split('/')[0]),
+            'readmes': make_readme(repo_name),
+        }
+
+        for fetch_type, path in fetch.FileFetcher.fetcher_paths.items():
+            path = root.joinpath(path.format(owner=repo_name.split('/')[0], repo=repo_name.split('/')[1]))
+            path.parent.mkdir(parents=True, exist_ok=True)
+
+            if fetch_type in single:
+                blocks = [block(single[fetch_type])]
+
+            else:
+                blocks = [
+                    block([make_item(fetch_type, repo_name, page * per_page + i) for i in range(per_page)])
+                    for page in range(pages)
+                ]
+
+            path.write_text(''.join(blocks))
+            count += len(blocks)
+
+    return count
+
+
+class CommandCounter(pymongo.monitoring.CommandListener):
+    """Count commands sent to MongoDB."""
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        with self._lock:
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def make_store(store: str, counter: CommandCounter) -> None:
+    """Connect the database module to a fresh store which counts operations."""
+    if store == 'memory':
+        db.use_client(MemoryClient(counter))
+
+    else:
+        # The database is dropped, so must not be the one used by `gha`
+        if db.database_name == BENCH_DATABASE:
+            raise click.UsageError(f'DATABASE_NAME is {BENCH_DATABASE}, which would be dropped by the benchmark')
+
+        client = pymongo.MongoClient(db.database_url, event_listeners=[counter])
+        client.drop_database(BENCH_DATABASE)
+        db.database_name = BENCH_DATABASE
+        db.use_client(client)
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process and any worker processes, in MB."""
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    )
+    # Reported in KB on Linux, but bytes on macOS
+    return peak / (1024**2 if sys.platform == 'darwin' else 1024)
+
+
+def run_scenario(
+    name: str, repos: typing.List[str], pages: int, run: typing.Callable[[], None], store: str
+) -> typing.Dict[str, typing.Any]:
+    counter = CommandCounter()
+    make_store(store, counter)
+
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+
+    result = {
+        'scenario': name,
+        'repos': len(repos),
+        'pages': pages,
+        'seconds': round(elapsed, 3),
+        'repos_per_sec': round(len(repos) / elapsed, 2),
+        'pages_per_sec': round(pages / elapsed, 2),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'db_ops_per_repo': round(counter.count / len(repos), 2),
+    }
+    logger.warning('%s', json.dumps(result))
+
+    return result
+
+
+def git_revision() -> typing.Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, check=True, text=True
+        ).stdout.strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: typing.List[typing.Dict[str, typing.Any]], baseline_path: str, tolerance: float) -> bool:
+    """Check the results against a baseline, reporting scenarios which have slowed down.
+
+    :return: Whether all scenarios are within the tolerance of the baseline
+    """
+    with open(baseline_path) as fp:
+        baseline = {result['scenario']: result for result in json.load(fp)['results']}
+
+    ok = True
+    for result in results:
+        previous = baseline.get(result['scenario'])
+        if previous is None:
+            continue
+
+        change = result['repos_per_sec'] / previous['repos_per_sec'] - 1
+        if change < -tolerance:
+            logger.error(
+                'Regression in %s: %.2f repos/sec vs %.2f in baseline (%+.0f%%)', result['scenario'],
+                result['repos_per_sec'], previous['repos_per_sec'], 100 * change
+            )
+            ok = False
+
+    return ok
+
+
+@click.command()
+@click.option('--repos', 'n_repos', default=50, type=click.IntRange(min=1))
+@click.option('--pages', default=3, type=click.IntRange(min=1))
+@click.option('--per-page', default=30, type=click.IntRange(min=1))
+@click.option('--latency', default=0.01, type=click.FloatRange(min=0))
+@click.option('--concurrency', default=4, type=click.IntRange(min=1))
+@click.option('--workers', default=2, type=click.IntRange(min=0))
+@click.option('--store', default='memory', type=click.Choice(['memory', 'mongo']))
+@click.option('--only', 'scenarios', multiple=True, type=click.Choice(['fetch', 'import']))
+@click.option('--output', default='benchmark.json', type=click.Path(dir_okay=False))
+@click.option('--baseline', required=False, type=click.Path(exists=True, dir_okay=False))
+@click.option('--tolerance', default=0.2, type=click.FloatRange(min=0))
+def main(
+    n_repos: int,
+    pages: int,
+    per_page: int,
+    latency: float,
+    concurrency: int,
+    workers: int,
+    store: str,
+    scenarios: typing.Sequence[str],
+    output: str,
+    baseline: typing.Optional[str],
+    tolerance: float
+):
+    logging.basicConfig(level=logging.WARNING)
+    scenarios = scenarios or ['fetch', 'import']
+    repos = [f'bench{i % 10}/repo{i}' for i in range(n_repos)]
+    results = []
+
+    single_types = len(fetch.GitHubFetcher.fetcher_paths) - len(LIST_TYPES)
+    pages_per_repo = single_types + len(LIST_TYPES) * pages
+
+    if 'fetch' in scenarios:
+        FakeGitHubHandler.latency = latency
+        FakeGitHubHandler.pages = pages
+        FakeGitHubHandler.per_page = per_page
+
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FakeGitHubHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        connectors.github_api_url = f'http://127.0.0.1:{server.server_port}/'
+
+        try:
+            results.append(
+                run_scenario(
+                    'fetch',
+                    repos,
+                    len(repos) * pages_per_repo,
+                    lambda: gha.fetch_for_repos(
+                        repos, fetch.GitHubFetcher(conditional=False), concurrency=concurrency
+                    ),
+                    store
+                )
+            )
+
+        finally:
+            server.shutdown()
+
+    if 'import' in scenarios:
+        with tempfile.TemporaryDirectory() as import_root:
+            n_pages = write_curl_dumps(pathlib.Path(import_root), repos, pages, per_page)
+
+            results.append(
+                run_scenario(
+                    'import',
+                    repos,
+                    n_pages,
+                    lambda: gha.fetch_for_repos(
+                        repos, fetch.FileFetcher(import_root), concurrency=concurrency, workers=workers
+                    ),
+                    store
+                )
+            )
+
+    report = {
+        'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'parameters': {
+            'repos': n_repos,
+            'pages': pages,
+            'per_page': per_page,
+            'latency': latency,
+            'concurrency': concurrency,
+            'workers': workers,
+            'store': store,
+        },
+        'results': results,
+    }
+
+    with open(output, 'w') as fp:
+        json.dump(report, fp, indent=2)
+
+    if baseline is not None and not compare(results, baseline, tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+"""Minimal in-memory stand-in for a MongoDB client, for benchmarking the fetch path without a server.
+
+Only the operations used when fetching and importing are supported.  Equality queries on indexed
+fields use a hash index, so the cost of storing data does not grow with the size of the collection
+and the benchmark measures the fetch path rather than the store.
+"""
+import collections
+import copy
+import datetime
+import itertools
+import operator as op
+import threading
+import typing
+
+import pymongo
+
+Document = typing.Dict[str, typing.Any]
+
+_MISSING = object()
+
+COMPARISONS = {
+    '$gt': op.gt,
+    '$gte': op.ge,
+    '$lt': op.lt,
+    '$lte': op.le,
+}
+
+
+def get_field(doc: Document, path: str) -> typing.Any:
+    for key in path.split('.'):
+        if not isinstance(doc, dict) or key not in doc:
+            return _MISSING
+        doc = doc[key]
+
+    return doc
+
+
+def set_field(doc: Document, path: str, value: typing.Any) -> None:
+    *parents, key = path.split('.')
+    for parent in parents:
+        doc = doc.setdefault(parent, {})
+
+    doc[key] = value
+
+
+def sort_key(path: str) -> typing.Callable[[Document], typing.Tuple]:
+    """Key to sort documents by a field, with those missing it first, as in MongoDB."""
+    def key(doc: Document) -> typing.Tuple:
+        value = get_field(doc, path)
+        return (0, None) if value is _MISSING else (1, value)
+
+    return key
+
+
+def matches(doc: Document, query: typing.Mapping[str, typing.Any]) -> bool:
+    for path, condition in query.items():
+        value = get_field(doc, path)
+
+        if isinstance(condition, dict) and any(key.startswith('$') for key in condition):
+            for operator, operand in condition.items():
+                if operator == '$exists':
+                    if (value is not _MISSING) != bool(operand):
+                        return False
+
+                elif operator == '$in':
+                    if value not in operand:
+                        return False
+
+                elif operator in COMPARISONS:
+                    if value is _MISSING or not COMPARISONS[operator](value, operand):
+                        return False
+
+                else:
+                    raise NotImplementedError(f'Query operator {operator} is not supported')
+
+        elif value != condition:
+            return False
+
+    return True
+
+
+def apply_update(doc: Document, update: typing.Mapping[str, typing.Any], inserting: bool) -> None:
+    for operator, fields in update.items():
+        for path, value in fields.items():
+            if operator == '$set' or (operator == '$setOnInsert' and inserting):
+                set_field(doc, path, copy.deepcopy(value))
+
+            elif operator == '$currentDate':
+                set_field(doc, path, datetime.datetime.utcnow())
+
+            elif operator == '$inc':
+                current = get_field(doc, path)
+                set_field(doc, path, (0 if current is _MISSING else current) + value)
+
+            elif operator == '$addToSet':
+                current = get_field(doc, path)
+                current = [] if current is _MISSING else current
+                if value not in current:
+                    current.append(value)
+                set_field(doc, path, current)
+
+            elif operator != '$setOnInsert':
+                raise NotImplementedError(f'Update operator {operator} is not supported')
+
+
+class Result:
+    def __init__(self, matched: int = 0, upserted: int = 0):
+        self.matched_count = matched
+        self.modified_count = matched
+        self.upserted_count = upserted
+
+
+class MemoryCollection:
+    def __init__(self, database: 'MemoryDatabase', name: str):
+        self.name = name
+        self.full_name = f'{database.name}.{name}'
+        self._counter = database.counter
+
+        self._lock = threading.RLock()
+        self._ids = itertools.count()
+        self._docs: typing.Dict[int, Document] = {}
+        # Field name -> value -> IDs of documents with that value
+        self._indexes: typing.Dict[str, typing.DefaultDict[typing.Any, typing.Set[int]]] = {}
+
+    def create_index(self, keys, **kwargs) -> str:
+        field = keys if isinstance(keys, str) else keys[0][0]
+
+        with self._lock:
+            if field not in self._indexes:
+                index = collections.defaultdict(set)
+                for doc_id, doc in self._docs.items():
+                    index[self._index_key(get_field(doc, field))].add(doc_id)
+                self._indexes[field] = index
+
+        return field
+
+    @staticmethod
+    def _index_key(value: typing.Any) -> typing.Any:
+        try:
+            hash(value)
+            return value
+
+        except TypeError:
+            return repr(value)
+
+    def _candidates(self, query: typing.Mapping[str, typing.Any]) -> typing.Iterable[int]:
+        for field, condition in query.items():
+            if field in self._indexes and not isinstance(condition, dict):
+                return list(self._indexes[field].get(self._index_key(condition), ()))
+
+        return list(self._docs)
+
+    def _find_ids(self, query: typing.Mapping[str, typing.Any]) -> typing.Iterator[int]:
+        for doc_id in self._candidates(query):
+            if matches(self._docs[doc_id], query):
+                yield doc_id
+
+    def _store(self, doc_id: int, doc: Document) -> None:
+        old = self._docs.get(doc_id)
+
+        for field, index in self._indexes.items():
+            if old is not None:
+                index[self._index_key(get_field(old, field))].discard(doc_id)
+            index[self._index_key(get_field(doc, field))].add(doc_id)
+
+        self._docs[doc_id] = doc
+
+    def _replace(self, query, replacement, upsert: bool) -> Result:
+        doc_id = next(self._find_ids(query), None)
+        if doc_id is None:
+            if not upsert:
+                return Result()
+
+            doc_id = next(self._ids)
+            self._store(doc_id, copy.deepcopy(replacement))
+            return Result(upserted=1)
+
+        self._store(doc_id, copy.deepcopy(replacement))
+        return Result(matched=1)
+
+    def _update(self, query, update, upsert: bool, many: bool = False) -> Result:
+        doc_ids = list(self._find_ids(query))
+        if not many:
+            doc_ids = doc_ids[:1]
+
+        if not doc_ids:
+            if not upsert:
+                return Result()
+
+            doc = {key: value for key, value in query.items() if not isinstance(value, dict)}
+            apply_update(doc, update, inserting=True)
+            self._store(next(self._ids), doc)
+            return Result(upserted=1)
+
+        for doc_id in doc_ids:
+            doc = copy.deepcopy(self._docs[doc_id])
+            apply_update(doc, update, inserting=False)
+            self._store(doc_id, doc)
+
+        return Result(matched=len(doc_ids))
+
+    def replace_one(self, query, replacement, upsert: bool = False) -> Result:
+        self._counter.started(None)
+        with self._lock:
+            return self._replace(query, replacement, upsert)
+
+    def update_one(self, query, update, upsert: bool = False) -> Result:
+        self._counter.started(None)
+        with self._lock:
+            return self._update(query, update, upsert)
+
+    def update_many(self, query, update, upsert: bool = False) -> Result:
+        self._counter.started(None)
+        with self._lock:
+            return self._update(query, update, upsert, many=True)
+
+    def bulk_write(self, requests, ordered: bool = True) -> Result:
+        self._counter.started(None)
+        total = Result()
+
+        with self._lock:
+            for request in requests:
+                if isinstance(request, pymongo.ReplaceOne):
+                    result = self._replace(request._filter, request._doc, request._upsert)
+
+                elif isinstance(request, (pymongo.UpdateOne, pymongo.UpdateMany)):
+                    result = self._update(
+                        request._filter, request._doc, request._upsert, many=isinstance(request, pymongo.UpdateMany)
+                    )
+
+                else:
+                    raise NotImplementedError(f'Bulk operation {type(request).__name__} is not supported')
+
+                total.matched_count += result.matched_count
+                total.modified_count += result.modified_count
+                total.upserted_count += result.upserted_count
+
+        return total
+
+    def find(self, query=None, projection=None, sort=None) -> typing.Iterator[Document]:
+        self._counter.started(None)
+        with self._lock:
+            docs = [copy.deepcopy(self._docs[doc_id]) for doc_id in self._find_ids(query or {})]
+
+        # Sort by the last key first, so earlier keys take precedence
+        for path, direction in reversed(sort or []):
+            docs.sort(key=sort_key(path), reverse=direction == pymongo.DESCENDING)
+
+        if projection:
+            included = [field for field, include in projection.items() if include and field != '_id']
+            if included:
+                docs = [{field: doc[field] for field in included if field in doc} for doc in docs]
+
+        return iter(docs)
+
+    def find_one(self, query=None, projection=None, sort=None) -> typing.Optional[Document]:
+        return next(self.find(query, projection, sort), None)
+
+    def count_documents(self, query, limit: int = 0) -> int:
+        self._counter.started(None)
+        with self._lock:
+            count = sum(1 for _ in self._find_ids(query))
+
+        return min(count, limit) if limit else count
+
+
+class MemoryDatabase:
+    def __init__(self, name: str, counter):
+        self.name = name
+        self.counter = counter
+        self._collections: typing.Dict[str, MemoryCollection] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = MemoryCollection(self, name)
+
+            return self._collections[name]
+
+
+class MemoryClient:
+    """In-memory client which counts operations using a command listener."""
+    def __init__(self, counter):
+        self._counter = counter
+        self._databases: typing.Dict[str, MemoryDatabase] = {}
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        if name not in self._databases:
+            self._databases[name] = MemoryDatabase(name, self._counter)
+
+        return self._databases[name]
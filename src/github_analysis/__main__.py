@@ -1,13 +1,22 @@
+import collections
+import concurrent.futures
+import contextlib
+import functools
 import itertools
 import logging
 import pathlib
+import threading
 import typing
 
 import click
 from decouple import config
+import pymongo
 
-from github_analysis import db, fetch
-from github_analysis.connectors import ResponseNotFoundError
+from github_analysis import aggregate, connectors, db, export, fetch, jobs, metrics, projection, resolve, sinks
+from github_analysis.cache import ResponseCache
+from github_analysis.connectors import (
+    ConnectorResponseType, ResponseError, ResponseNotFoundError, ResponseNotModified
+)
 
 logger = logging.getLogger(__name__)
 
@@ -15,72 +24,443 @@ PathLike = typing.Union[str, pathlib.Path]
 
 
 @click.group()
-def cli():
+@click.option('--metrics-port', required=False, type=click.IntRange(min=0))
+@click.option('--metrics-file', required=False, type=click.Path(dir_okay=False))
+@click.option('--metrics-interval', default=60.0, type=click.FloatRange(min=1))
+@click.option('--profile', 'profile_dir', required=False, type=click.Path(dir_okay=True, file_okay=False))
+@click.pass_context
+def cli(
+    ctx: click.Context,
+    metrics_port: typing.Optional[int] = None,
+    metrics_file: typing.Optional[PathLike] = None,
+    metrics_interval: float = 60.0,
+    profile_dir: typing.Optional[PathLike] = None
+):
     logging.basicConfig(level=config('LOG_LEVEL', default='INFO'))
 
+    if metrics_port is not None:
+        server = metrics.serve(metrics_port)
+        ctx.call_on_close(server.shutdown)
+
+    if metrics_file is not None:
+        ctx.call_on_close(metrics.SummaryWriter(metrics_file, metrics_interval).close)
+
+    if profile_dir is not None:
+        ctx.call_on_close(metrics.enable_profiling(profile_dir).close)
+
+
+def fetch_one(
+    fetcher: fetch.FetcherFunc,
+    repo: str,
+    incremental: bool = False,
+    pages: typing.Optional[typing.Iterable[ConnectorResponseType]] = None
+) -> None:
+    """Apply a fetcher to a single repo, ignoring errors which only affect this repo."""
+    try:
+        fetcher(repo, incremental=incremental, stream=True, pages=pages)
+
+    except (fetch.CouldNotStoreData, fetch.DataExists, ResponseError, ResponseNotFoundError, ResponseNotModified):
+        pass
+
+
+def worker_pages(future: concurrent.futures.Future) -> typing.Iterator[ConnectorResponseType]:
+    """Pages loaded by a worker process - any error in the worker is raised when they are iterated."""
+    yield from future.result()
+
+
+def fetch_with_workers(
+    repos: typing.Collection[str],
+    fetcher_factory: fetch.Fetcher,
+    fetch_type: str,
+    pool: concurrent.futures.ProcessPoolExecutor,
+    executor: concurrent.futures.ThreadPoolExecutor,
+    workers: int,
+    write_buffer: typing.Optional[db.WriteBuffer] = None
+) -> None:
+    """Apply a fetcher to each repo, loading the data in worker processes and storing it in threads.
+
+    The number of repos loaded but not yet stored is bounded, so memory use does not grow if the
+    database cannot keep up with the workers.
+    """
+    fetcher = fetcher_factory.make(fetch_type, write_buffer)
+    load = functools.partial(fetcher_factory.load, fetch_type)
+
+    window = 2 * workers
+    loading = collections.deque()
+    storing = collections.deque()
+
+    def store_next() -> None:
+        repo, future = loading.popleft()
+        storing.append(executor.submit(fetch_one, fetcher, repo, pages=worker_pages(future)))
+
+        while len(storing) > window:
+            storing.popleft().result()
+
+    for repo in repos:
+        loading.append((repo, pool.submit(load, repo)))
+
+        if len(loading) > window:
+            store_next()
+
+    while loading:
+        store_next()
+
+    for future in storing:
+        future.result()
+
 
 def fetch_for_repos(
     repos: typing.Collection[str],
     fetcher_factory: fetch.Fetcher,
     only: typing.Optional[str] = None,
-    skip_existing: bool = False
+    skip_existing: bool = False,
+    concurrency: int = 1,
+    incremental: bool = False,
+    workers: int = 0
 ) -> None:
     """Apply each fetcher to each repo.
 
     Run a fetcher on all repos before moving on to the next fetcher.
+    Repos are fetched by a pool of worker threads, which share a single rate limit budget.
 
     :param repos: List of repositories to fetch
     :param fetcher_factory: Factory for fetchers to run
     :param only: Run only this fetcher
     :param skip_existing: Skip fetches where data already exists
+    :param concurrency: Number of repos to fetch - or store, if using worker processes - at once
+    :param incremental: Fetch only records updated since the last successful fetch, where supported
+    :param workers: Number of worker processes to load and transform data - for CPU-bound connectors
     """
-    if only:
-        fetchers = [fetcher_factory.make(only)]
+    fetch_types = [only] if only else list(fetcher_factory.fetcher_paths)
+    repos = list(repos)
 
-    else:
-        fetchers = fetcher_factory.make_all()
+    with contextlib.ExitStack() as stack:
+        # Entered first so it is closed last - after all threads have finished adding writes to it
+        write_buffer = stack.enter_context(db.WriteBuffer())
+        executor = stack.enter_context(concurrent.futures.ThreadPoolExecutor(max_workers=concurrency))
 
-    for fetcher in fetchers:
-        for repo in repos:
-            try:
-                fetcher(repo, skip_existing)
+        pool = None
+        if workers > 0:
+            pool = stack.enter_context(concurrent.futures.ProcessPoolExecutor(max_workers=workers))
 
-            except (fetch.CouldNotStoreData, fetch.DataExists, ResponseNotFoundError):
-                pass
+        for fetch_type in fetch_types:
+            # Resolved for each content type, since fetching repos records those which are missing or renamed -
+            # these records are buffered, so must be written first
+            write_buffer.drain()
+            resolved = fetcher_factory.resolve_repos(repos)
+            pending = resolved
 
+            if skip_existing:
+                # Check for existing data once up front, rather than once per repo
+                existing = fetcher_factory.fetched_repos(fetch_type)
+                pending = [repo for repo in resolved if repo not in existing]
 
-def label_repo_set(repos: typing.Iterable[str], set_name: str):
-    """Label a repo as belonging to the set."""
-    logger.info('Labelling collection: status')
-    collection = db.collection('status', indexes=['sets'])
-    repos = list(repos)
+                logger.info(
+                    'Fetcher %s skipping %d repos with existing data, %d queued', fetch_type,
+                    len(resolved) - len(pending), len(pending)
+                )
 
-    # Add set name to array of sets in status collection
-    collection.update_one(
-        {
-            '_repo_name': {
-                '$in': repos,
-            },
-        }, {'$addToSet': {
-            'sets': set_name,
-        }}, upsert=True
-    )
+            with metrics.profile_memory(fetch_type):
+                if pool is not None:
+                    fetch_with_workers(pending, fetcher_factory, fetch_type, pool, executor, workers, write_buffer)
+
+                else:
+                    fetch_repo = functools.partial(
+                        fetch_one,
+                        fetcher_factory.make(fetch_type, write_buffer, repos=pending),
+                        incremental=incremental
+                    )
+
+                    # Consume the results so that any unexpected exception is raised here
+                    for _ in executor.map(fetch_repo, pending):
+                        pass
+
+            changes = {
+                change: metrics.document_changes.value(collection=fetch_type, change=change)
+                for change in ('inserted', 'changed', 'unchanged')
+            }
+            if any(changes.values()):
+                logger.info('Fetcher %s documents: %s', fetch_type, changes)
+
+            log_projection_savings(fetch_type)
+
+        log_projection_savings('embedded_users')
+
+    for api, usage in connectors.token_usage().items():
+        logger.info('Token usage for %s API: %s', api, usage)
+
+
+def log_projection_savings(collection_name: str) -> None:
+    """Log the size of the records stored in a collection by this run, before and after projection."""
+    original = metrics.projection_bytes.value(collection=collection_name, stage='original')
+    projected = metrics.projection_bytes.value(collection=collection_name, stage='projected')
+
+    if original:
+        logger.info(
+            'Projection of %s reduced records from %.1f MB to %.1f MB (%.0f%% saved)', collection_name,
+            original / 1024**2, projected / 1024**2, 100 * (1 - projected / original)
+        )
+
+    elif projected:
+        logger.info('Projection stored %.1f MB of records in %s', projected / 1024**2, collection_name)
+
+
+def label_collection(
+    collection_name: str, repos: typing.Sequence[str], set_name: str, chunk_size: int, upsert: bool = False
+) -> None:
+    """Label all records for repos in a collection as belonging to the set, in chunks of repos.
+
+    :param collection_name: Name of collection to label
+    :param repos: Repos to label
+    :param set_name: Name of set
+    :param chunk_size: Number of repos to label in each query
+    :param upsert: Create a record for each repo if it does not already exist
+    """
+    collection = db.collection(collection_name, indexes=['sets', ('_repo_name', 'sets')])
 
-    # Add set name to array of sets in all other collections
-    for collection_name in {
+    for start in range(0, len(repos), chunk_size):
+        chunk = repos[start:start + chunk_size]
+
+        if upsert:
+            collection.bulk_write([
+                pymongo.UpdateOne({'_repo_name': repo}, {'$addToSet': {
+                    'sets': set_name,
+                }}, upsert=True) for repo in chunk
+            ], ordered=False)  # yapf: disable
+
+        else:
+            # Records already in the set are excluded using the compound index
+            collection.update_many({
+                '_repo_name': {
+                    '$in': chunk,
+                },
+                'sets': {
+                    '$ne': set_name,
+                },
+            }, {'$addToSet': {
+                'sets': set_name,
+            }})
+
+        logger.info('Labelled collection %s: %d / %d repos', collection_name, start + len(chunk), len(repos))
+
+
+def label_repo_set(repos: typing.Iterable[str], set_name: str, chunk_size: int = 1000):
+    """Label a repo as belonging to the set.
+
+    Collections are labelled in parallel.
+    """
+    repos = list(repos)
+
+    collection_names = {
         *fetch.GitHubFetcher.fetcher_paths.keys(),
         *fetch.FileFetcher.fetcher_paths.keys(),
-    }:
-        logger.info('Labelling collection: %s', collection_name)
-        collection = db.collection(collection_name, indexes=['sets'])
+        *aggregate.SUMMARY_COLLECTIONS,
+    }
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(collection_names) + 1) as executor:
+        # Add set name to array of sets in status collection - creating status records if necessary
+        futures = [executor.submit(label_collection, 'status', repos, set_name, chunk_size, upsert=True)]
+
+        # Add set name to array of sets in all other collections
+        futures.extend(
+            executor.submit(label_collection, collection_name, repos, set_name, chunk_size)
+            for collection_name in collection_names
+        )
+
+        for future in futures:
+            future.result()
+
+
+def init_db() -> None:
+    """Create the indexes used by all commands on all collections."""
+    fetcher_classes = [fetch.GitHubFetcher, fetch.FileFetcher]
+    fetch_types = {fetch_type for fetcher_class in fetcher_classes for fetch_type in fetcher_class.fetcher_paths}
+    set_indexes = ['sets', ('_repo_name', 'sets')]
+
+    for fetch_type in fetch_types:
+        logger.info('Creating indexes for collection: %s', fetch_type)
+        db.collection(fetch_type, indexes=[fetch.Fetcher.fetcher_key_name.get(fetch_type, 'node_id'), *set_indexes])
+
+    dedup_indexes = [f'{fetch_type}.key' for fetch_type in fetch.GitHubFetcher.fetcher_dedup_key]
+
+    logger.info('Creating indexes for collection: status')
+    timestamp_indexes = [f'{source}.timestamp' for source in aggregate.SOURCES]
+    db.collection(
+        'status',
+        indexes=[*fetch_types, *dedup_indexes, *timestamp_indexes, *set_indexes, f'{resolve.STATUS_FIELD}.checked']
+    )
+
+    logger.info('Creating indexes for collection: embedded_users')
+    db.collection('embedded_users', indexes=[fetch.Fetcher.fetcher_key_name['embedded_users']])
+
+    for collection_name in aggregate.SUMMARY_COLLECTIONS:
+        logger.info('Creating indexes for collection: %s', collection_name)
+        db.collection(collection_name, indexes=['month', *set_indexes])
+
+    logger.info('Creating indexes for collection: etags')
+    db.collection('etags', indexes=['url'])
+
+    logger.info('Creating indexes for collection: jobs')
+    db.collection('jobs', indexes=jobs.JobQueue.indexes)
+
+
+def run_job(fetcher: fetch.FetcherFunc, repo: str, skip_existing: bool = False, incremental: bool = False) -> str:
+    """Apply a fetcher to a single repo from the job queue.
+
+    :return: Outcome of the job, if it completed
+    :raises Exception: If the job failed and may succeed if retried
+    """
+    try:
+        fetcher(repo, skip_existing, incremental=incremental, stream=True)
+        return 'fetched'
+
+    except fetch.DataExists:
+        return 'exists'
+
+    except ResponseNotModified:
+        return 'not_modified'
+
+    except ResponseNotFoundError:
+        return 'not_found'
+
+
+def run_worker(
+    fetcher_factory: fetch.Fetcher,
+    job_queue: jobs.JobQueue,
+    only: typing.Optional[typing.Collection[str]] = None,
+    *,
+    concurrency: int = 1,
+    skip_existing: bool = False,
+    incremental: bool = False,
+    lease_seconds: float = 300.0,
+    poll_interval: float = 10.0,
+    exit_when_empty: bool = False,
+    stop: typing.Optional[threading.Event] = None
+) -> None:
+    """Run jobs from the queue until it is empty or the worker is stopped.
+
+    Writes are not buffered, so a job is only marked as done once its data has been stored.
+
+    :param fetcher_factory: Factory for fetchers to run
+    :param job_queue: Queue to take jobs from
+    :param only: Run only jobs for these fetchers
+    :param concurrency: Number of jobs to run at once
+    :param skip_existing: Skip fetches where data already exists
+    :param incremental: Fetch only records updated since the last successful fetch, where supported
+    :param lease_seconds: Time a job is leased for - renewed while it runs
+    :param poll_interval: Time to wait before checking again for jobs when the queue is empty
+    :param exit_when_empty: Exit once there are no jobs available, rather than waiting for more
+    :param stop: Event to stop the worker once its current jobs have finished
+    """
+    worker_id = jobs.make_worker_id()
+    stop = threading.Event() if stop is None else stop
+    finished = threading.Event()
+
+    active = set()
+    active_lock = threading.Lock()
+
+    fetchers = {}
+    fetchers_lock = threading.Lock()
+
+    def get_fetcher(fetch_type: str) -> fetch.FetcherFunc:
+        with fetchers_lock:
+            if fetch_type not in fetchers:
+                fetchers[fetch_type] = fetcher_factory.make(fetch_type)
+
+            return fetchers[fetch_type]
+
+    def heartbeat() -> None:
+        while not finished.wait(lease_seconds / 3):
+            with active_lock:
+                job_ids = list(active)
 
-        collection.update_many({
-            '_repo_name': {
-                '$in': repos,
-            },
-        }, {'$addToSet': {
-            'sets': set_name,
-        }})
+            for job_id in job_ids:
+                if not job_queue.heartbeat(job_id, worker_id, lease_seconds):
+                    logger.warning('Lost lease on job %s', job_id)
+
+            reaped = job_queue.reap()
+            if reaped:
+                logger.warning('Marked %d abandoned jobs as dead', reaped)
+
+    def run_jobs() -> None:
+        while not stop.is_set():
+            job = job_queue.lease(worker_id, lease_seconds, only)
+
+            if job is None:
+                if exit_when_empty:
+                    return
+
+                stop.wait(poll_interval)
+                continue
+
+            with active_lock:
+                active.add(job['_id'])
+
+            try:
+                outcome = run_job(get_fetcher(job['fetcher']), job['_repo_name'], skip_existing, incremental)
+
+            except Exception as exc:
+                job_queue.fail(job, worker_id, f'{type(exc).__name__}: {exc}')
+
+            else:
+                job_queue.complete(job['_id'], worker_id, outcome)
+
+            finally:
+                with active_lock:
+                    active.discard(job['_id'])
+
+    logger.info('Starting worker %s', worker_id)
+    heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+    heartbeat_thread.start()
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            runners = [executor.submit(run_jobs) for _ in range(concurrency)]
+
+            try:
+                for runner in concurrent.futures.as_completed(runners):
+                    runner.result()
+
+            except KeyboardInterrupt:
+                logger.warning('Stopping worker %s after current jobs', worker_id)
+
+            finally:
+                stop.set()
+
+    finally:
+        finished.set()
+        heartbeat_thread.join()
+
+    logger.info('Worker %s finished - jobs: %s', worker_id, job_queue.counts())
+
+
+def open_response_cache(cache_dir: typing.Optional[PathLike] = None) -> ResponseCache:
+    """Open the on-disk HTTP response cache, configured by `HTTP_CACHE_DIR` and `HTTP_CACHE_MAX_BYTES`.
+
+    :param cache_dir: Directory of the cache, if not the configured one
+    """
+    if cache_dir is None:
+        cache_dir = config('HTTP_CACHE_DIR', default='http_cache')
+
+    # Zero means no limit
+    max_bytes = config('HTTP_CACHE_MAX_BYTES', default=0, cast=int) or None
+
+    return ResponseCache(cache_dir, max_bytes=max_bytes)
+
+
+def open_store(
+    output: typing.Optional[PathLike], output_format: str = 'jsonl', set_name: str = 'default'
+) -> typing.ContextManager[typing.Optional[sinks.ShardStore]]:
+    """Open a store to write records to as files, or do nothing if records are to be stored in MongoDB.
+
+    :param output: Directory to write shards to - if None, records are stored in MongoDB
+    :param output_format: Format of shards - 'jsonl' or 'parquet'
+    :param set_name: Name of the set of repos, used to partition shards
+    """
+    if output is None:
+        return contextlib.nullcontext()
+
+    return sinks.ShardStore(output, set_name, output_format)
 
 
 def clean_repo_list(repos: typing.Iterable[str], repo_file: typing.Optional[click.File]) -> typing.List[str]:
@@ -92,18 +472,26 @@ def clean_repo_list(repos: typing.Iterable[str], repo_file: typing.Optional[clic
     return [repo for repo in repos if not repo.startswith('#')]
 
 
+@cli.command(name='init-db')
+def init_db_():
+    """Create database indexes ahead of running other commands."""
+    init_db()
+
+
 @cli.command()
 @click.option('-r', '--repo', 'repos', required=False, multiple=True)  # yapf: disable
 @click.option('-f', '--file', 'repo_file', required=False, type=click.File('r'))  # yapf: disable
 @click.option('--set-name', required=True)  # yapf: disable
+@click.option('--chunk-size', default=1000, type=click.IntRange(min=1))
 def name_set(
     repos: typing.Iterable[str],
     repo_file: typing.Optional[click.File],
     set_name: str,
+    chunk_size: int = 1000
 ):
     """Tag repos as belonging to a named set."""
     repos = clean_repo_list(repos, repo_file)
-    label_repo_set(repos, set_name)
+    label_repo_set(repos, set_name, chunk_size=chunk_size)
 
 
 @cli.command(name='fetch')
@@ -111,16 +499,56 @@ def name_set(
 @click.option('-f', '--file', 'repo_file', required=False, type=click.File('r'))  # yapf: disable
 @click.option('--only', required=False, type=click.Choice(fetch.GitHubFetcher.fetcher_paths.keys()))
 @click.option('--skip-existing', default=False, is_flag=True)
+@click.option('--concurrency', default=1, type=click.IntRange(min=1))
+@click.option('--conditional/--no-conditional', default=True)
+@click.option('--incremental', default=False, is_flag=True)
+@click.option('--graphql', default=False, is_flag=True)
+@click.option('--graphql-batch-size', default=50, type=click.IntRange(min=1, max=100))
+@click.option('--record', default=False, is_flag=True)
+@click.option('--cache-dir', required=False, type=click.Path(dir_okay=True, file_okay=False))
+@click.option('--output', required=False, type=click.Path(dir_okay=True, file_okay=False))
+@click.option('--output-format', default='jsonl', type=click.Choice(sinks.FORMATS))
+@click.option('--set-name', default='default')
+@click.option('--projection', 'projection_mode', default='none', type=click.Choice(projection.MODES))
 def fetch_(
     repos: typing.Iterable[str],
     repo_file: typing.Optional[click.File],
     only: typing.Optional[str] = None,
-    skip_existing: bool = False
+    skip_existing: bool = False,
+    concurrency: int = 1,
+    conditional: bool = True,
+    incremental: bool = False,
+    graphql: bool = False,
+    graphql_batch_size: int = 50,
+    record: bool = False,
+    cache_dir: typing.Optional[PathLike] = None,
+    output: typing.Optional[PathLike] = None,
+    output_format: str = 'jsonl',
+    set_name: str = 'default',
+    projection_mode: str = 'none'
 ):
     repos = clean_repo_list(repos, repo_file)
 
-    fetcher_factory = fetch.GitHubFetcher()
-    fetch_for_repos(repos, fetcher_factory, only, skip_existing=skip_existing)
+    with contextlib.ExitStack() as stack:
+        recorder = stack.enter_context(open_response_cache(cache_dir)) if record else None
+        store = stack.enter_context(open_store(output, output_format, set_name))
+
+        fetcher_factory = fetch.GitHubFetcher(
+            conditional=conditional,
+            graphql=graphql,
+            graphql_batch_size=graphql_batch_size,
+            recorder=recorder,
+            store=store,
+            projection=projection_mode
+        )
+        fetch_for_repos(
+            repos,
+            fetcher_factory,
+            only,
+            skip_existing=skip_existing,
+            concurrency=concurrency,
+            incremental=incremental
+        )
 
 
 @cli.command()
@@ -129,17 +557,176 @@ def fetch_(
 @click.option('--import-root', required=True, type=click.Path(dir_okay=True, file_okay=False))
 @click.option('--only', required=False, type=click.Choice(fetch.FileFetcher.fetcher_paths.keys()))
 @click.option('--skip-existing', default=False, is_flag=True)
+@click.option('--concurrency', default=1, type=click.IntRange(min=1))
+@click.option('--workers', default=0, type=click.IntRange(min=0))
+@click.option('--output', required=False, type=click.Path(dir_okay=True, file_okay=False))
+@click.option('--output-format', default='jsonl', type=click.Choice(sinks.FORMATS))
+@click.option('--set-name', default='default')
+@click.option('--projection', 'projection_mode', default='none', type=click.Choice(projection.MODES))
 def import_existing(
     repos: typing.Iterable[str],
     repo_file: typing.Optional[click.File],
     import_root: PathLike,
     only: typing.Optional[str] = None,
-    skip_existing: bool = False
+    skip_existing: bool = False,
+    concurrency: int = 1,
+    workers: int = 0,
+    output: typing.Optional[PathLike] = None,
+    output_format: str = 'jsonl',
+    set_name: str = 'default',
+    projection_mode: str = 'none'
 ):
     repos = clean_repo_list(repos, repo_file)
 
-    fetcher_factory = fetch.FileFetcher(import_root)
-    fetch_for_repos(repos, fetcher_factory, only, skip_existing=skip_existing)
+    with open_store(output, output_format, set_name) as store:
+        fetcher_factory = fetch.FileFetcher(import_root, store=store, projection=projection_mode)
+        fetch_for_repos(
+            repos, fetcher_factory, only, skip_existing=skip_existing, concurrency=concurrency, workers=workers
+        )
+
+
+@cli.command()
+@click.option('-r', '--repo', 'repos', required=False, multiple=True)  # yapf: disable
+@click.option('-f', '--file', 'repo_file', required=False, type=click.File('r'))  # yapf: disable
+@click.option('--cache-dir', required=False, type=click.Path(dir_okay=True, file_okay=False))
+@click.option('--only', required=False, type=click.Choice(fetch.ReplayFetcher.fetcher_paths.keys()))
+@click.option('--skip-existing', default=False, is_flag=True)
+@click.option('--concurrency', default=1, type=click.IntRange(min=1))
+@click.option('--output', required=False, type=click.Path(dir_okay=True, file_okay=False))
+@click.option('--output-format', default='jsonl', type=click.Choice(sinks.FORMATS))
+@click.option('--set-name', default='default')
+@click.option('--projection', 'projection_mode', default='none', type=click.Choice(projection.MODES))
+def replay(
+    repos: typing.Iterable[str],
+    repo_file: typing.Optional[click.File],
+    cache_dir: typing.Optional[PathLike] = None,
+    only: typing.Optional[str] = None,
+    skip_existing: bool = False,
+    concurrency: int = 1,
+    output: typing.Optional[PathLike] = None,
+    output_format: str = 'jsonl',
+    set_name: str = 'default',
+    projection_mode: str = 'none'
+):
+    """Store responses recorded by `fetch --record`, without using the network."""
+    repos = clean_repo_list(repos, repo_file)
+
+    with open_response_cache(cache_dir) as cache, open_store(output, output_format, set_name) as store:
+        fetcher_factory = fetch.ReplayFetcher(cache.root, cache=cache, store=store, projection=projection_mode)
+        fetch_for_repos(repos, fetcher_factory, only, skip_existing=skip_existing, concurrency=concurrency)
+
+
+@cli.command(name='aggregate')
+@click.option('--full', default=False, is_flag=True)
+@click.option('--chunk-size', default=100, type=click.IntRange(min=1))
+def aggregate_(full: bool = False, chunk_size: int = 100):
+    """Update summary collections for repos fetched since the last aggregation."""
+    aggregate.aggregate(full=full, chunk_size=chunk_size)
+
+
+@cli.command()
+@click.option('-r', '--repo', 'repos', required=False, multiple=True)  # yapf: disable
+@click.option('-f', '--file', 'repo_file', required=False, type=click.File('r'))  # yapf: disable
+def check_repos(repos: typing.Iterable[str], repo_file: typing.Optional[click.File]):
+    """Report repos in a list which have been found to be missing or renamed, as tab separated values."""
+    repos = clean_repo_list(repos, repo_file)
+    entries = resolve.lookup(repos)
+
+    for repo in repos:
+        entry = entries.get(repo)
+
+        if entry is not None:
+            click.echo('\t'.join([repo, entry['state'], entry.get('full_name', ''), entry['checked'].isoformat()]))
+
+    logger.info('Found %d missing or renamed repos out of %d', len(entries), len(repos))
+
+
+@cli.command(name='export')
+@click.argument('collection_name')
+@click.option('-r', '--repo', 'repos', required=False, multiple=True)  # yapf: disable
+@click.option('-f', '--file', 'repo_file', required=False, type=click.File('r'))  # yapf: disable
+@click.option('--set-name', required=False)
+@click.option('--output', required=True, type=click.Path(dir_okay=True, file_okay=False))
+@click.option('--output-format', default='jsonl', type=click.Choice(sinks.FORMATS))
+@click.option('--chunk-size', default=100, type=click.IntRange(min=1))
+@click.option('--workers', default=4, type=click.IntRange(min=1))
+def export_(
+    collection_name: str,
+    repos: typing.Iterable[str],
+    repo_file: typing.Optional[click.File],
+    output: PathLike,
+    set_name: typing.Optional[str] = None,
+    output_format: str = 'jsonl',
+    chunk_size: int = 100,
+    workers: int = 4
+):
+    """Export a collection to files, for a list and/or set of repos - run again to resume an export."""
+    repos = clean_repo_list(repos, repo_file)
+
+    export.export_collection(
+        collection_name,
+        output,
+        repos=repos or None,
+        set_name=set_name,
+        output_format=output_format,
+        chunk_size=chunk_size,
+        workers=workers
+    )
+
+
+@cli.command()
+@click.option('-r', '--repo', 'repos', required=False, multiple=True)  # yapf: disable
+@click.option('-f', '--file', 'repo_file', required=False, type=click.File('r'))  # yapf: disable
+@click.option('--only', required=False, type=click.Choice(fetch.GitHubFetcher.fetcher_paths.keys()))
+@click.option('--requeue', default=False, is_flag=True)
+def enqueue(
+    repos: typing.Iterable[str],
+    repo_file: typing.Optional[click.File],
+    only: typing.Optional[str] = None,
+    requeue: bool = False
+):
+    """Add fetch jobs for repos to the queue run by `gha worker`."""
+    repos = clean_repo_list(repos, repo_file)
+    fetch_types = [only] if only else list(fetch.GitHubFetcher.fetcher_paths)
+
+    job_queue = jobs.JobQueue(db.collection('jobs', indexes=jobs.JobQueue.indexes))
+    added = job_queue.enqueue(repos, fetch_types, requeue=requeue)
+
+    logger.info('Queued %d jobs - jobs: %s', added, job_queue.counts())
+
+
+@cli.command()
+@click.option('--only', required=False, multiple=True, type=click.Choice(fetch.GitHubFetcher.fetcher_paths.keys()))
+@click.option('--skip-existing', default=False, is_flag=True)
+@click.option('--concurrency', default=1, type=click.IntRange(min=1))
+@click.option('--conditional/--no-conditional', default=True)
+@click.option('--incremental', default=False, is_flag=True)
+@click.option('--lease-seconds', default=300, type=click.IntRange(min=10))
+@click.option('--max-attempts', default=3, type=click.IntRange(min=1))
+@click.option('--exit-when-empty', default=False, is_flag=True)
+def worker(
+    only: typing.Sequence[str] = (),
+    skip_existing: bool = False,
+    concurrency: int = 1,
+    conditional: bool = True,
+    incremental: bool = False,
+    lease_seconds: int = 300,
+    max_attempts: int = 3,
+    exit_when_empty: bool = False
+):
+    """Run fetch jobs from the queue - any number of workers may run at once."""
+    job_queue = jobs.JobQueue(db.collection('jobs', indexes=jobs.JobQueue.indexes), max_attempts=max_attempts)
+
+    run_worker(
+        fetch.GitHubFetcher(conditional=conditional),
+        job_queue,
+        only,
+        concurrency=concurrency,
+        skip_existing=skip_existing,
+        incremental=incremental,
+        lease_seconds=lease_seconds,
+        exit_when_empty=exit_when_empty
+    )
 
 
 if __name__ == '__main__':
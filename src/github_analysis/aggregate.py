@@ -0,0 +1,214 @@
+import collections
+import datetime
+import logging
+import typing
+
+import bson
+import pymongo
+
+from github_analysis import db
+
+logger = logging.getLogger(__name__)
+
+SummaryType = typing.Dict[str, typing.Any]
+
+# Summary of activity in each repo in each month, and over the whole history of each repo
+SUMMARY_MONTHLY = 'summary_monthly'
+SUMMARY_REPOS = 'summary_repos'
+SUMMARY_COLLECTIONS = (SUMMARY_MONTHLY, SUMMARY_REPOS)
+
+# Collection in which the status timestamp up to which summaries are current is stored
+STATE_COLLECTION = 'aggregation'
+STATE_ID = 'summaries'
+
+# Collections summarised, with the field giving the time of each record as an ISO 8601 string
+SOURCES = {
+    'commits': '$commit.author.date',
+    'issues': '$created_at',
+    'comments': '$created_at',
+    'events': '$created_at',
+}
+
+# Login of the GitHub user who authored a commit - or their ID if users were projected out, or their email
+# if the commit was not matched to a GitHub user
+COMMIT_AUTHOR = {'$ifNull': ['$author.login', {'$ifNull': ['$author', '$commit.author.email']}]}
+
+
+def touched_repos(
+    since: typing.Optional[bson.Timestamp] = None
+) -> typing.Tuple[typing.Dict[str, typing.List[str]], typing.Optional[bson.Timestamp]]:
+    """Find the repos with data fetched for any summarised collection since a status timestamp.
+
+    :param since: Status timestamp - if None, find all repos with data
+    :return: Sets each repo belongs to, and the latest status timestamp found
+    """
+    timestamp_fields = [f'{source}.timestamp' for source in SOURCES]
+    status_collection = db.collection('status', indexes=timestamp_fields)
+
+    if since is None:
+        query = {'$or': [{field: {'$exists': True}} for field in timestamp_fields]}
+
+    else:
+        query = {'$or': [{field: {'$gt': since}} for field in timestamp_fields]}
+
+    repos = {}
+    latest = since
+
+    projection = {'_id': False, '_repo_name': True, 'sets': True, **{field: True for field in timestamp_fields}}
+    for status in status_collection.find(query, projection=projection):
+        repos[status['_repo_name']] = status.get('sets', [])
+
+        for source in SOURCES:
+            timestamp = status.get(source, {}).get('timestamp')
+            if timestamp is not None and (latest is None or timestamp > latest):
+                latest = timestamp
+
+    return repos, latest
+
+
+def summarise(
+    repos: typing.Sequence[str], sets: typing.Mapping[str, typing.List[str]]
+) -> typing.Tuple[typing.List[SummaryType], typing.List[SummaryType]]:
+    """Summarise the activity in a group of repos, using an aggregation pipeline on each collection.
+
+    :param repos: Repos to summarise
+    :param sets: Sets each repo belongs to
+    :return: Summaries of each repo in each month it was active, and of each repo
+    """
+    empty = {source: 0 for source in SOURCES}
+    monthly: typing.Dict[typing.Tuple[str, str], SummaryType] = {}
+    summaries = {
+        repo: {
+            '_id': repo,
+            '_repo_name': repo,
+            'sets': sets.get(repo, []),
+            **empty,
+            'pull_requests': 0,
+            'first_activity': None,
+            'last_activity': None,
+        }
+        for repo in repos
+    }  # yapf: disable
+    contributors = collections.defaultdict(set)
+
+    for source, date_field in SOURCES.items():
+        group = {
+            '_id': {
+                'repo': '$_repo_name',
+                'month': {'$substrBytes': [{'$ifNull': [date_field, '']}, 0, 7]},
+            },
+            'count': {'$sum': 1},
+            'first': {'$min': date_field},
+            'last': {'$max': date_field},
+        }  # yapf: disable
+
+        if source == 'commits':
+            group['contributors'] = {'$addToSet': COMMIT_AUTHOR}
+
+        elif source == 'issues':
+            # The issues endpoint includes pull requests, which have a `pull_request` field
+            group['pull_requests'] = {'$sum': {'$cond': [{'$ifNull': ['$pull_request', False]}, 1, 0]}}
+
+        pipeline = [{'$match': {'_repo_name': {'$in': list(repos)}}}, {'$group': group}]
+
+        for row in db.collection(source).aggregate(pipeline, allowDiskUse=True):
+            repo, month = row['_id']['repo'], row['_id']['month']
+            pull_requests = row.get('pull_requests', 0)
+
+            summary = summaries[repo]
+            summary[source] += row['count'] - pull_requests
+            summary['pull_requests'] += pull_requests
+
+            bounds = (('first_activity', row['first'], min), ('last_activity', row['last'], max))
+            for field, value, better in bounds:
+                if value is not None:
+                    summary[field] = value if summary[field] is None else better(summary[field], value)
+
+            if not month:
+                # Records without a time are counted in the totals only
+                continue
+
+            month_summary = monthly.setdefault((repo, month), {
+                '_id': f'{repo}:{month}',
+                '_repo_name': repo,
+                'sets': sets.get(repo, []),
+                'month': month,
+                **empty,
+                'pull_requests': 0,
+                'contributors': 0,
+            })  # yapf: disable
+            month_summary[source] += row['count'] - pull_requests
+            month_summary['pull_requests'] += pull_requests
+
+            if 'contributors' in row:
+                authors = {author for author in row['contributors'] if author is not None}
+                month_summary['contributors'] = len(authors)
+                contributors[repo].update(authors)
+
+    now = datetime.datetime.utcnow()
+    for repo, summary in summaries.items():
+        summary['contributors'] = len(contributors[repo])
+        summary['updated'] = now
+
+    return list(monthly.values()), list(summaries.values())
+
+
+def store_summaries(
+    collection_name: str, repos: typing.Sequence[str], summaries: typing.List[SummaryType]
+) -> None:
+    """Replace the summaries for a group of repos, removing any which no longer exist."""
+    collection = db.collection(collection_name, indexes=['sets', 'month'])
+
+    requests = [pymongo.ReplaceOne({'_id': summary['_id']}, summary, upsert=True) for summary in summaries]
+    requests.append(
+        pymongo.DeleteMany({
+            '_repo_name': {
+                '$in': list(repos),
+            },
+            '_id': {
+                '$nin': [summary['_id'] for summary in summaries],
+            },
+        })
+    )  # yapf: disable
+
+    collection.bulk_write(requests, ordered=False)
+
+
+def aggregate(full: bool = False, chunk_size: int = 100) -> int:
+    """Update the summary collections for repos fetched since the last aggregation.
+
+    Repos are found using the timestamps written to the `status` collection by each fetcher, and the latest
+    timestamp is stored once all summaries have been updated, so an interrupted aggregation is repeated.
+
+    :param full: Summarise all repos, not just those fetched since the last aggregation
+    :param chunk_size: Number of repos to summarise in each query
+    :return: Number of repos summarised
+    """
+    state_collection = db.collection(STATE_COLLECTION)
+
+    since = None
+    if not full:
+        since = (state_collection.find_one({'_id': STATE_ID}) or {}).get('timestamp')
+
+    sets, latest = touched_repos(since)
+    repos = sorted(sets)
+    logger.info('Summarising %d repos fetched since %s', len(repos), since.as_datetime() if since else 'the start')
+
+    for start in range(0, len(repos), chunk_size):
+        chunk = repos[start:start + chunk_size]
+        monthly, summaries = summarise(chunk, sets)
+
+        store_summaries(SUMMARY_MONTHLY, chunk, monthly)
+        store_summaries(SUMMARY_REPOS, chunk, summaries)
+
+        logger.info('Summarised %d / %d repos', start + len(chunk), len(repos))
+
+    if latest is not None:
+        state_collection.update_one({'_id': STATE_ID}, {
+            '$set': {
+                'timestamp': latest,
+                'updated': datetime.datetime.utcnow(),
+            }
+        }, upsert=True)  # yapf: disable
+
+    return len(repos)
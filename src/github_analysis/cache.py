@@ -0,0 +1,268 @@
+import collections
+import gzip
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import tempfile
+import threading
+import typing
+
+logger = logging.getLogger(__name__)
+
+PathLike = typing.Union[str, pathlib.Path]
+
+# Response headers needed to replay a response - pagination and validators
+RECORDED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Link')
+
+
+def _write_atomic(path: pathlib.Path, content: bytes) -> None:
+    """Write a file so that readers never see it partially written."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(content)
+
+        os.replace(tmp_path, path)
+
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class ResponseCache:
+    """Content-addressed on-disk cache of raw HTTP responses.
+
+    Response bodies are stored gzip compressed under the SHA-256 of their content, so identical
+    responses are stored once.  An index maps each URL to its body and headers, and is held in
+    memory so a miss doesn't touch the filesystem.  When the stored bodies exceed the maximum size,
+    the least recently used responses are evicted.
+
+    Changes to the index are appended to a journal, which is replayed on top of the last snapshot
+    of the index when the cache is opened.  The snapshot is only rewritten when the cache is closed,
+    or once the journal has grown larger than the index, so the cost of recording each response does
+    not grow with the size of the cache.
+
+    :param root: Directory to store the cache in
+    :param max_bytes: Maximum total size of the compressed bodies - unlimited if None
+    :param flush_every: Number of changes after which the journal is written to disk
+    """
+    index_name = 'index.json'
+    journal_name = 'journal.jsonl'
+
+    def __init__(self, root: PathLike, max_bytes: typing.Optional[int] = None, flush_every: int = 100):
+        self.root = pathlib.Path(root)
+        self.max_bytes = max_bytes
+        self.flush_every = flush_every
+
+        self._lock = threading.RLock()
+
+        # Ordered from least to most recently used
+        self._index: typing.MutableMapping[str, typing.Dict[str, typing.Any]] = collections.OrderedDict()
+        self._refs: typing.Counter[str] = collections.Counter()
+        self._sizes: typing.Dict[str, int] = {}
+        self._size = 0
+
+        # Changes not yet written to the journal, and the number of changes in it
+        self._unflushed: typing.List[str] = []
+        self._journal_length = 0
+
+        try:
+            with open(self.root.joinpath(self.index_name)) as fp:
+                for url, entry in json.load(fp).items():
+                    self._set_entry(url, entry)
+
+        except FileNotFoundError:
+            pass
+
+        # Bodies are only deleted once the whole journal is replayed, since a later change may use them again
+        released = set()
+
+        try:
+            with open(self.root.joinpath(self.journal_name)) as fp:
+                for line in fp:
+                    try:
+                        change = json.loads(line)
+
+                    except ValueError:
+                        # The last change may have been partially written
+                        break
+
+                    released.add(self._set_entry(change['url'], change.get('entry')))
+                    self._journal_length += 1
+
+        except FileNotFoundError:
+            pass
+
+        for digest in released - set(self._sizes):
+            self._delete_body(digest)
+
+    @property
+    def size(self) -> int:
+        """Total size of the compressed bodies in the cache."""
+        return self._size
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, url: str) -> bool:
+        return url in self._index
+
+    def _blob_path(self, digest: str) -> pathlib.Path:
+        return self.root.joinpath('objects', digest[:2], f'{digest}.gz')
+
+    def _set_entry(self, url: str, entry: typing.Optional[typing.Dict[str, typing.Any]]) -> typing.Optional[str]:
+        """Add, replace or remove (if entry is None) a URL in the index, without deleting any bodies.
+
+        :return: Digest of the previous body of the URL, if no URL has the same content any more
+        """
+        if entry is not None:
+            # Reference the new body before releasing the old one, in case they are the same
+            if entry['digest'] not in self._sizes:
+                self._size += entry['size']
+
+            self._refs[entry['digest']] += 1
+            self._sizes[entry['digest']] = entry['size']
+
+        previous = self._index.pop(url, None)
+        if entry is not None:
+            self._index[url] = entry
+
+        if previous is None:
+            return None
+
+        digest = previous['digest']
+        self._refs[digest] -= 1
+
+        if self._refs[digest] > 0:
+            return None
+
+        del self._refs[digest]
+        self._size -= self._sizes.pop(digest)
+        return digest
+
+    def _delete_body(self, digest: typing.Optional[str]) -> None:
+        if digest is None:
+            return
+
+        try:
+            self._blob_path(digest).unlink()
+
+        except FileNotFoundError:
+            pass
+
+    def _add_entry(self, url: str, entry: typing.Dict[str, typing.Any]) -> None:
+        """Add or replace a URL in the index, deleting its previous body if no other URL has the same content."""
+        self._delete_body(self._set_entry(url, entry))
+
+    def _remove_entry(self, url: str) -> None:
+        """Remove a URL from the index, deleting its body if no other URL has the same content."""
+        self._delete_body(self._set_entry(url, None))
+
+    def get(self, url: str) -> typing.Optional[typing.Tuple[bytes, typing.Dict[str, str]]]:
+        """Get the body and headers of a cached response, or None if it is not cached."""
+        with self._lock:
+            entry = self._index.get(url)
+            if entry is None:
+                return None
+
+            self._index.move_to_end(url)
+
+        try:
+            with gzip.open(self._blob_path(entry['digest'])) as fp:
+                return fp.read(), dict(entry['headers'])
+
+        except FileNotFoundError:
+            logger.warning('Response cache body missing for %s', url)
+
+            with self._lock:
+                self._remove_entry(url)
+                self._log_change(url, None)
+
+            return None
+
+    def put(self, url: str, content: bytes, headers: typing.Mapping[str, str]) -> None:
+        """Store a response, evicting the least recently used responses if the cache is too large.
+
+        :param url: URL the response was received from
+        :param content: Decoded body of the response
+        :param headers: Response headers - only those needed to replay the response are kept
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        compressed = None if digest in self._sizes else gzip.compress(content)
+
+        with self._lock:
+            # Check again in case the body was evicted meanwhile
+            if digest not in self._sizes:
+                compressed = compressed or gzip.compress(content)
+                _write_atomic(self._blob_path(digest), compressed)
+
+            entry = {
+                'digest': digest,
+                'size': self._sizes.get(digest, len(compressed or b'')),
+                'headers': {key: headers[key] for key in RECORDED_HEADERS if key in headers},
+            }
+
+            self._add_entry(url, entry)
+            self._log_change(url, entry)
+            self._evict()
+
+            if len(self._unflushed) >= self.flush_every:
+                self.flush()
+
+    def _evict(self) -> None:
+        if self.max_bytes is None:
+            return
+
+        while self._size > self.max_bytes and self._index:
+            url = next(iter(self._index))
+
+            logger.debug('Evicting %s from response cache', url)
+            self._remove_entry(url)
+            self._log_change(url, None)
+
+    def _log_change(self, url: str, entry: typing.Optional[typing.Dict[str, typing.Any]]) -> None:
+        """Record a change to the index, to be appended to the journal - an entry of None removes the URL."""
+        self._unflushed.append(json.dumps({'url': url, 'entry': entry}) + '\n')
+
+    def flush(self) -> None:
+        """Append changes to the index to the journal, compacting it into a new snapshot if it has grown too large."""
+        with self._lock:
+            if self._journal_length + len(self._unflushed) > max(len(self._index), self.flush_every):
+                self.compact()
+                return
+
+            if self._unflushed:
+                self.root.mkdir(parents=True, exist_ok=True)
+
+                with open(self.root.joinpath(self.journal_name), 'a') as fp:
+                    fp.write(''.join(self._unflushed))
+
+                self._journal_length += len(self._unflushed)
+                self._unflushed = []
+
+    def compact(self) -> None:
+        """Write a snapshot of the whole index to disk, replacing the journal."""
+        with self._lock:
+            _write_atomic(self.root.joinpath(self.index_name), json.dumps(self._index).encode())
+
+            try:
+                self.root.joinpath(self.journal_name).unlink()
+
+            except FileNotFoundError:
+                pass
+
+            self._unflushed = []
+            self._journal_length = 0
+
+    def close(self) -> None:
+        self.compact()
+
+    def __enter__(self) -> 'ResponseCache':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
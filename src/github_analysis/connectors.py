@@ -1,12 +1,26 @@
 import abc
+import base64
+from concurrent.futures import Future
 import datetime
 import json
 import logging
+import email.utils
+import mmap
+import random
+import re
+import threading
 import time
 import typing
+import urllib.parse
+import weakref
 
-from decouple import config
+from decouple import config, Csv
+import pymongo
 import requests
+from requests.adapters import HTTPAdapter
+
+from github_analysis import metrics
+from github_analysis.cache import ResponseCache
 
 logger = logging.getLogger(__name__)
 
@@ -30,26 +44,496 @@ ConnectorResponseType = typing.Union[
 
 
 class ResponseNotFoundError(ValueError):
-    pass
+    """The data source has no data for a request.
+
+    :param status_code: HTTP status of the response, if there was one
+    """
+    def __init__(self, *args, status_code: typing.Optional[int] = None):
+        super().__init__(*args)
+        self.status_code = status_code
+
+
+class ResponseError(Exception):
+    """The data source returned an error which does not relate to a specific record."""
+
+
+class ResponseNotModified(Exception):
+    """Conditional requests showed that nothing has changed since the content was last fetched."""
 
 
 def wait_until(end_datetime: datetime.datetime) -> None:
-    """Wait until a given time.
+    """Wait until a given time."""
+    delta = (end_datetime - datetime.datetime.now()).total_seconds()
+
+    # In case end_datetime was in past to begin with
+    metrics.sleep(delta, 'rate_limit_reset')
+
 
-    This code was taken with modification from https://stackoverflow.com/posts/54774814/revisions
-    under the CC BY-SA 4.0 license.
+class RateLimitBudget:
+    """Rate limit budget shared between all connectors which draw on the same API quota.
+
+    Each request reserves one unit of the budget before it is sent, so concurrent workers do not all
+    discover that the quota has run out by making a failing request.  When the budget is exhausted,
+    every worker waits until the reset time reported by the API.
+
+    If paced, requests are spread evenly over the time until the reset, rather than using the whole
+    budget at once and then waiting.
+
+    :param paced: Spread requests over the rate limit window - by default set by `RATE_LIMIT_PACING`
+    :param name: Name of the budget in metrics
     """
-    while True:
-        delta = (end_datetime - datetime.datetime.now()).total_seconds()
+    def __init__(self, paced: typing.Optional[bool] = None, name: str = 'default'):
+        self.paced = config('RATE_LIMIT_PACING', default=True, cast=bool) if paced is None else paced
+        self.name = name
+
+        self._lock = threading.Lock()
+        self._remaining: typing.Optional[int] = None
+        self._reset: typing.Optional[datetime.datetime] = None
+        # Monotonic time at which the next paced request may be sent
+        self._next_slot = 0.0
+
+    @property
+    def remaining(self) -> typing.Optional[int]:
+        return self._remaining
+
+    @property
+    def reset_time(self) -> typing.Optional[datetime.datetime]:
+        return self._reset
 
-        if delta < 0:
-            return  # In case end_datetime was in past to begin with
+    def reserve(self) -> typing.Optional[float]:
+        """Reserve budget for a single request if there is any left, without waiting.
 
-        time.sleep(max(delta / 2, 0.1))
+        :return: Delay in seconds before the request should be sent, or None if the budget is exhausted
+        """
+        with self._lock:
+            now = datetime.datetime.now()
+
+            if self._reset is not None and self._reset <= now:
+                # Quota has been refreshed but we won't know by how much until the next response
+                self._remaining = None
+                self._reset = None
+                self._next_slot = 0.0
+
+            if self._remaining is None:
+                return 0.0
+
+            if self._remaining <= 0:
+                return None
+
+            delay = 0.0
+            if self.paced:
+                # Spread the remaining budget evenly over the time left in the window after this request
+                clock = time.monotonic()
+                delay = max(self._next_slot - clock, 0.0)
+
+                time_left = (self._reset - now).total_seconds() - delay
+                self._next_slot = clock + delay + max(time_left, 0.0) / self._remaining
+
+            self._remaining -= 1
+            return delay
+
+    def acquire(self) -> None:
+        """Reserve budget for a single request, waiting for its turn or for the rate limit to reset if necessary."""
+        while True:
+            delay = self.reserve()
+
+            if delay is not None:
+                metrics.sleep(delay, 'pacing')
+                return
 
-        if delta <= 0.1:
+            reset_time = self._reset
+            if reset_time is not None:
+                logger.warning('Rate limit budget exhausted - waiting until %s', reset_time)
+                wait_until(reset_time)
+
+    def update(self, headers: typing.Mapping[str, str], not_modified: bool = False) -> None:
+        """Update the budget from the rate limit headers of a response.
+
+        :param headers: Headers of the response
+        :param not_modified: The response was a 304, which does not count against the rate limit - the budget
+            reserved for it is returned, and its pacing slot freed for the next request
+        """
+        try:
+            remaining = int(headers['x-ratelimit-remaining'])
+            reset_time = datetime.datetime.fromtimestamp(int(headers['x-ratelimit-reset']))
+
+        except (KeyError, ValueError):
             return
 
+        with self._lock:
+            if self._reset is None or reset_time > self._reset or self._remaining is None:
+                if self._reset is not None and reset_time > self._reset:
+                    # Pacing starts afresh in a new window
+                    self._next_slot = 0.0
+
+                self._remaining = remaining
+                self._reset = reset_time
+
+            elif not_modified:
+                # Never more than the API reports, which does not yet count requests still in flight
+                self._remaining = min(self._remaining + 1, remaining)
+                self._next_slot = min(self._next_slot, time.monotonic())
+
+            else:
+                # Responses may arrive out of order - within a window the lowest value is the most recent
+                self._remaining = min(self._remaining, remaining)
+
+            metrics.rate_limit_remaining.set(self._remaining, budget=self.name)
+
+
+class TokenPool:
+    """Pool of API tokens, each with its own rate limit budget.
+
+    Each request is made using the token with the most budget remaining.  A token is only set aside
+    once its budget is exhausted, and requests only wait for a reset when every token is exhausted.
+
+    :param tokens: API tokens to use
+    :param paced: Spread requests using each token over its rate limit window
+    :param name: Name of the pool in metrics
+    """
+    def __init__(self, tokens: typing.Sequence[str], paced: typing.Optional[bool] = None, name: str = 'tokens'):
+        if not tokens:
+            raise ValueError('Token pool requires at least one token')
+
+        self._lock = threading.Lock()
+        self._budgets = {token: RateLimitBudget(paced, name=f'{name}...{token[-4:]}') for token in tokens}
+        self._requests = {token: 0 for token in tokens}
+
+    def __len__(self) -> int:
+        return len(self._budgets)
+
+    def acquire(self) -> str:
+        """Reserve budget for a single request, returning the token to use for it."""
+        while True:
+            with self._lock:
+                # Tokens with an unknown budget are tried first, to find out what their budget is
+                by_remaining = sorted(
+                    self._budgets.items(),
+                    key=lambda item: float('inf') if item[1].remaining is None else item[1].remaining,
+                    reverse=True
+                )
+
+                for token, budget in by_remaining:
+                    delay = budget.reserve()
+
+                    if delay is not None:
+                        self._requests[token] += 1
+                        break
+
+                else:
+                    token = None
+                    reset_time = min(
+                        (budget.reset_time for budget in self._budgets.values() if budget.reset_time is not None),
+                        default=None
+                    )
+
+            if token is not None:
+                # Wait for this request's turn outside the lock, so other requests can be paced meanwhile
+                metrics.sleep(delay, 'pacing')
+                return token
+
+            if reset_time is not None:
+                logger.warning(
+                    'Rate limit budget exhausted for all %d tokens - waiting until %s', len(self), reset_time
+                )
+                wait_until(reset_time)
+
+    def update(self, token: str, headers: typing.Mapping[str, str], not_modified: bool = False) -> None:
+        """Update the budget for a token from the rate limit headers of a response - see `RateLimitBudget.update`."""
+        self._budgets[token].update(headers, not_modified)
+
+    def usage(self) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+        """Get the number of requests made and budget remaining for each token, identified by its last characters."""
+        with self._lock:
+            return {
+                f'...{token[-4:]}': {
+                    'requests': self._requests[token],
+                    'remaining': budget.remaining,
+                    'reset': budget.reset_time,
+                }
+                for token, budget in self._budgets.items()
+            }  # yapf: disable
+
+
+_token_pools: typing.Dict[str, TokenPool] = {}
+_token_pools_lock = threading.Lock()
+
+
+def get_token_pool(api: str = 'rest') -> TokenPool:
+    """Get the pool of GitHub tokens for an API, creating it if necessary.
+
+    Tokens are read from `GITHUB_AUTH_TOKENS` as a comma separated list, or `GITHUB_AUTH_TOKEN`.
+    Each API has a separate pool, since they have separate quotas.
+
+    :param api: Name of the API - 'rest' or 'graphql'
+    """
+    with _token_pools_lock:
+        if api not in _token_pools:
+            tokens = config('GITHUB_AUTH_TOKENS', default='', cast=Csv())
+            if not tokens:
+                tokens = [config('GITHUB_AUTH_TOKEN')]
+
+            _token_pools[api] = TokenPool(tokens, name=api)
+
+    return _token_pools[api]
+
+
+def token_usage() -> typing.Dict[str, typing.Dict[str, typing.Dict[str, typing.Any]]]:
+    """Get usage of each token for each API which has been used."""
+    with _token_pools_lock:
+        return {api: pool.usage() for api, pool in _token_pools.items()}
+
+
+# Budget shared by all RequestsConnectors unless they are given their own
+default_rate_limit = RateLimitBudget(name='rest')
+
+# The GraphQL API has a separate quota from the REST API
+graphql_rate_limit = RateLimitBudget(name='graphql')
+
+github_api_url = config('GITHUB_API_URL', default='https://api.github.com/').rstrip('/') + '/'
+
+
+class ConnectionStats:
+    """Counters for the HTTP traffic of a connector."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections_reused = 0
+        self.bytes_received = 0
+        self.bytes_decoded = 0
+
+    def record(self, *, reused: bool, bytes_received: int, bytes_decoded: int) -> None:
+        with self._lock:
+            self.requests += 1
+            self.connections_reused += int(reused)
+            self.bytes_received += bytes_received
+            self.bytes_decoded += bytes_decoded
+
+    def as_dict(self) -> typing.Dict[str, int]:
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'connections_reused': self.connections_reused,
+                'bytes_received': self.bytes_received,
+                'bytes_decoded': self.bytes_decoded,
+            }
+
+
+def make_session(pool_size: int = 10) -> requests.Session:
+    """Build an HTTP session with a pool of keep-alive connections.
+
+    Requests are not retried by the session - connection errors and error responses are retried by
+    `request_with_retries`, which also tracks the rate limit and honours Retry-After.
+
+    :param pool_size: Maximum number of connections kept open to each host
+    """
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+
+    return session
+
+
+_session: typing.Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+# Connections which have already been used for a request - any further request on one of these is a reuse
+_seen_connections = weakref.WeakSet()
+_seen_connections_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Get the HTTP session shared by all connectors in this process, creating it if necessary."""
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            _session = make_session(pool_size=config('HTTP_POOL_SIZE', default=10, cast=int))
+
+    return _session
+
+
+def _connection_reused(response: requests.Response) -> bool:
+    """Check whether a response was received over a connection which had been used before.
+
+    Must be called before the response content is read, since the connection is then released to the pool.
+    """
+    connection = getattr(response.raw, 'connection', None)
+    if connection is None:
+        return False
+
+    with _seen_connections_lock:
+        reused = connection in _seen_connections
+        _seen_connections.add(connection)
+
+    return reused
+
+
+# GitHub recommends waiting at least a minute after hitting a secondary rate limit
+SECONDARY_RATE_LIMIT_WAIT = 60.0
+MAX_BACKOFF = 300.0
+
+
+def backoff_delay(attempt: int, backoff_factor: float, minimum: float = 0.0) -> float:
+    """Get an exponentially increasing delay before a retry, with jitter so that workers don't retry in step.
+
+    :param attempt: Number of attempts already retried
+    :param backoff_factor: Delay before the first retry in seconds
+    :param minimum: Minimum delay in seconds
+    """
+    delay = min(max(backoff_factor * 2**attempt, minimum), MAX_BACKOFF)
+    return random.uniform(delay / 2, delay)
+
+
+def _parse_retry_after(value: typing.Optional[str]) -> typing.Optional[float]:
+    """Parse a Retry-After header, which may be a number of seconds or an HTTP date."""
+    if value is None:
+        return None
+
+    try:
+        return max(float(value), 0.0)
+
+    except ValueError:
+        pass
+
+    try:
+        retry_time = email.utils.parsedate_to_datetime(value)
+
+    except (TypeError, ValueError):
+        return None
+
+    return max((retry_time - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0.0)
+
+
+def is_rate_limited(response: requests.Response) -> bool:
+    """Check whether a response failed because the primary rate limit was exhausted."""
+    return not response.ok and response.headers.get('x-ratelimit-remaining') == '0'
+
+
+def retry_delay(response: requests.Response, attempt: int, backoff_factor: float) -> typing.Optional[float]:
+    """Get the time to wait before retrying a failed request, or None if it should not be retried.
+
+    Server errors and secondary rate limits are retried, honouring any Retry-After header, or otherwise
+    backing off exponentially.  Other client errors, such as a missing repo, are not.
+
+    :param response: Failed response
+    :param attempt: Number of attempts already retried
+    :param backoff_factor: Delay before the first retry in seconds
+    """
+    retry_after = _parse_retry_after(response.headers.get('Retry-After'))
+
+    if response.status_code in {403, 429}:
+        message = response.text.lower()
+        secondary = (
+            retry_after is not None or response.status_code == 429 or 'secondary rate limit' in message
+            or 'abuse' in message
+        )
+        if not secondary:
+            return None
+
+        if retry_after is not None:
+            return retry_after + random.uniform(0, 1)
+
+        return backoff_delay(attempt, backoff_factor, minimum=SECONDARY_RATE_LIMIT_WAIT)
+
+    if response.status_code >= 500:
+        if retry_after is not None:
+            return retry_after + random.uniform(0, 1)
+
+        return backoff_delay(attempt, backoff_factor)
+
+    return None
+
+
+def request_with_retries(
+    send: typing.Callable[[typing.Mapping[str, str]], requests.Response],
+    *,
+    rate_limit: RateLimitBudget,
+    token_pool: typing.Optional[TokenPool] = None,
+    auth_scheme: str = 'token',
+    max_retries: int = 3,
+    backoff_factor: float = 0.5,
+    description: str = 'Request'
+) -> requests.Response:
+    """Make a request when the rate limit allows, retrying after transient failures.
+
+    :param send: Function to send the request, given any extra headers to use
+    :param rate_limit: Rate limit budget to draw on, if there is no token pool
+    :param token_pool: Pool of tokens to authorize the request
+    :param auth_scheme: Authorization scheme to use with a token from the pool
+    :param max_retries: Number of times to retry after a transient failure or exhausted rate limit
+    :param backoff_factor: Delay before the first retry in seconds
+    :param description: Description of the request for logging
+    :return: Response, which may be a failure which should not be retried
+    :raises ResponseError: If the request still failed after retrying
+    """
+    attempt = 0
+
+    while True:
+        if token_pool is None:
+            rate_limit.acquire()
+            auth_headers = {}
+
+        else:
+            token = token_pool.acquire()
+            auth_headers = {'Authorization': f'{auth_scheme} {token}'}
+
+        try:
+            r = send(auth_headers)
+
+        except requests.RequestException as exc:
+            failure = str(exc)
+            delay = backoff_delay(attempt, backoff_factor)
+
+        else:
+            if token_pool is None:
+                rate_limit.update(r.headers, r.status_code == 304)
+
+            else:
+                token_pool.update(token, r.headers, r.status_code == 304)
+
+            logger.info('Rate limit remaining: %s', r.headers.get('x-ratelimit-remaining'))
+
+            if r.ok:
+                return r
+
+            if is_rate_limited(r):
+                # The budget has been updated from this response, so the retry also waits for the reset - the
+                # backoff stops a reset time which has already passed from retrying at once, again and again
+                failure = 'primary rate limit exhausted'
+                delay = backoff_delay(attempt, backoff_factor)
+
+            else:
+                delay = retry_delay(r, attempt, backoff_factor)
+                if delay is None:
+                    return r
+
+                failure = f'status {r.status_code}'
+
+        if attempt >= max_retries:
+            raise ResponseError(f'{description} failed after {attempt + 1} attempts with {failure}')
+
+        attempt += 1
+        logger.warning('%s failed with %s - retry %d in %.1fs', description, failure, attempt, delay)
+        metrics.sleep(delay, 'retry')
+
+
+def join_pages(pages: typing.Iterable[ConnectorResponseType]) -> typing.Optional[ConnectorResponseType]:
+    """Join the pages of a response back into a single response."""
+    content = None
+
+    for page in pages:
+        if content is None:
+            content = page
+
+        elif isinstance(content, list):
+            content.extend(page)
+
+    return content
+
 
 class BaseConnector(abc.ABC):
     @abc.abstractmethod
@@ -69,6 +553,17 @@ class BaseConnector(abc.ABC):
         response: ConnectorResponseType = self._get(**kwargs)
         return self._annotate_response(response, '_repo_name', f'{kwargs["owner"]}/{kwargs["repo"]}')
 
+    def iter_pages(self, **kwargs) -> typing.Iterator[ConnectorResponseType]:
+        """Get the JSON representation of a record from a data source, one page at a time.
+
+        Keyword arguments populate the location pattern given when the
+        connector was initialised.
+        """
+        repo_name = f'{kwargs["owner"]}/{kwargs["repo"]}'
+
+        for page in self._iter_pages(**kwargs):
+            yield self._annotate_response(page, '_repo_name', repo_name)
+
     @abc.abstractmethod
     def _get(self, **kwargs) -> ConnectorResponseType:
         """Get the JSON representation of a record from a data source.
@@ -78,6 +573,22 @@ class BaseConnector(abc.ABC):
         """
         raise NotImplementedError
 
+    def _iter_pages(self, **kwargs) -> typing.Iterator[ConnectorResponseType]:
+        """Get the JSON representation of a record from a data source, one page at a time.
+
+        Connectors which cannot split their responses return the whole response as a single page.
+        """
+        yield self._get(**kwargs)
+
+    def plan(self, repos: typing.Sequence[str]) -> None:
+        """Tell the connector which repos will be requested, in order, so it may fetch them in batches."""
+
+    def commit(self, **kwargs) -> None:
+        """Confirm that the response from the last `get` with these arguments has been stored."""
+
+    def rollback(self, **kwargs) -> None:
+        """Report that the response from the last `get` with these arguments could not be stored."""
+
     @classmethod
     def _annotate_response(cls, response: ConnectorResponseType, key: str, value: str) -> ConnectorResponseType:
         """Annotate the response (or responses if a list) with an additional field."""
@@ -108,6 +619,25 @@ class TryEachConnector(BaseConnector):
 
         raise ResponseNotFoundError
 
+    def _iter_pages(self, **kwargs) -> typing.Iterator[ConnectorResponseType]:
+        for connector in self._connectors:
+            try:
+                yield from connector.iter_pages(**kwargs)
+                return
+
+            except ResponseNotFoundError:
+                pass
+
+        raise ResponseNotFoundError
+
+    def commit(self, **kwargs) -> None:
+        for connector in self._connectors:
+            connector.commit(**kwargs)
+
+    def rollback(self, **kwargs) -> None:
+        for connector in self._connectors:
+            connector.rollback(**kwargs)
+
 
 class Connector(BaseConnector):
     def __init__(self, location_pattern: str, **kwargs):
@@ -115,108 +645,776 @@ class Connector(BaseConnector):
         self._kwargs = kwargs
 
 
-def join_curl_responses(response: str) -> ConnectorResponseType:
-    """Join JSON blocks from concatenated cURL responses."""
-    # cURL headers are separated from content by a blank line
-    # The content starts with a '[' line for list-type responses
-    responses = response.split('\n\n[')
+class MalformedResponseError(ResponseNotFoundError):
+    """A block of a saved cURL response could not be parsed.
+
+    :param location: File containing the response
+    :param offset: Byte offset of the start of the malformed block
+    """
+    def __init__(self, location: str, offset: int):
+        super().__init__(f'Malformed response block in {location} at byte {offset}')
+        self.location = location
+        self.offset = offset
+
+    def __reduce__(self):
+        # Allow the error to be returned from a worker process
+        return type(self), (self.location, self.offset)
+
+
+# cURL headers are separated from content by a blank line
+_CURL_HEADER_END = re.compile(rb'\r?\n\r?\n')
+
+# Each response in a concatenated file starts with an HTTP status line
+_CURL_BLOCK_START = re.compile(rb'^HTTP/', re.MULTILINE)
+
+
+def parse_json(content: typing.Union[bytes, str]) -> JSONType:
+    """Parse JSON content, recording the time taken and the bytes parsed."""
+    metrics.bytes_parsed.inc(len(content), fetcher=metrics.current_fetcher.get())
+
+    with metrics.time_stage('parse'):
+        return json.loads(content)
+
+
+def iter_curl_responses(
+    data: typing.Union[bytes, mmap.mmap], location: str = '<string>'
+) -> typing.Iterator[ConnectorResponseType]:
+    """Iterate over the JSON content of each block of concatenated cURL responses.
+
+    Only one block at a time is copied out of `data`, so this can be used on a memory-mapped file.
+    Blocks with an error status or no content are skipped.
+
+    :param data: Concatenated cURL responses including headers
+    :param location: Name of the source of the data for error messages
+    :raises MalformedResponseError: If a block does not contain valid JSON
+    """
+    match = _CURL_BLOCK_START.search(data)
+
+    while match is not None:
+        block_start = match.start()
+        header_end = _CURL_HEADER_END.search(data, block_start)
+
+        if header_end is None:
+            return
+
+        status_line = data[block_start:data.find(b'\n', block_start)]
+        match = _CURL_BLOCK_START.search(data, header_end.end())
+        body_end = len(data) if match is None else match.start()
+
+        try:
+            status = int(status_line.split()[1])
+
+        except (IndexError, ValueError):
+            status = 200
+
+        if status >= 400:
+            logger.debug('Skipping response block with status %d in %s at byte %d', status, location, block_start)
+            continue
 
-    # Discard the first bit - it's just the first cURL header
-    responses = responses[1:]
+        body = data[header_end.end():body_end]
+        if not body.strip():
+            continue
 
-    # Strip the trailing cURL header and close bracket from the end of each block
-    responses = [r.rsplit('\n]\nHTTP', maxsplit=1)[0] for r in responses]
+        try:
+            yield parse_json(body)
 
-    # Concatenate responses
-    responses = ','.join(responses)
+        except json.JSONDecodeError as exc:
+            raise MalformedResponseError(location, block_start) from exc
 
-    # Add opening bracket
-    responses = '[' + responses
 
-    return json.loads(responses)
+def join_curl_responses(response: str) -> ConnectorResponseType:
+    """Join JSON blocks from concatenated cURL responses."""
+    return join_pages(page for page in iter_curl_responses(response.encode()) if isinstance(page, list))
 
 
 class FileConnector(Connector):
-    """Connector to get JSON data from curl responses saved to file."""
-    def _get(self, **kwargs) -> ConnectorResponseType:
+    """Connector to get JSON data from curl responses saved to file.
+
+    Files are memory-mapped and parsed one response block at a time, so each block is returned as a page.
+    """
+    def _iter_pages(self, **kwargs) -> typing.Iterator[ConnectorResponseType]:
         location = self._location_pattern.format(**kwargs)
         logger.debug('Trying file connector')
 
         try:
-            with open(location) as fp:
-                response = fp.read()
-
+            with open(location, 'rb') as fp:
                 try:
-                    content: ConnectorResponseType = json.loads(response.split('\n\n', maxsplit=1)[1].strip())
+                    data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+                except ValueError as exc:
+                    # Empty files cannot be mapped
+                    logger.warning('Likely no content in file: %s', location)
+                    raise ResponseNotFoundError from exc
+
+                with data:
+                    found = False
 
-                except json.JSONDecodeError:
                     try:
-                        content: ConnectorResponseType = join_curl_responses(response)
+                        for page in iter_curl_responses(data, location):
+                            found = True
+                            yield page
 
-                    except json.JSONDecodeError as exc:
-                        logger.warning('Parsing file failed: %s', location)
-                        raise ResponseNotFoundError from exc
+                    except MalformedResponseError as exc:
+                        logger.warning('Parsing file failed: %s at byte %d', location, exc.offset)
+                        raise
 
-                except IndexError as exc:
+                if not found:
                     logger.warning('Likely no content in file: %s', location)
-                    raise ResponseNotFoundError from exc
+                    raise ResponseNotFoundError
 
                 logger.debug('Fetched data from file: %s', location)
-                return content
 
         except FileNotFoundError as exc:
             logger.debug('File connector failed')
             raise ResponseNotFoundError from exc
 
+    def _get(self, **kwargs) -> ConnectorResponseType:
+        return join_pages(self._iter_pages(**kwargs))
+
+
+class ValidatorCache:
+    """Cache of HTTP validators (ETag and Last-Modified) used to make conditional requests.
+
+    Validators are stored for every page of a paginated response, along with the link to the next page,
+    since a 304 response may not repeat the pagination links.  New validators are held back until the
+    content they refer to has been stored, so an interrupted fetch is never mistaken for an unchanged one.
+
+    :param collection: MongoDB collection in which to store validators
+    """
+    def __init__(self, collection):
+        self._collection = collection
+        self._lock = threading.Lock()
+        self._pending: typing.Dict[str, typing.List[typing.Dict[str, typing.Optional[str]]]] = {}
+
+    def get(self, url: str) -> typing.Optional[typing.Dict[str, typing.Optional[str]]]:
+        return self._collection.find_one({'url': url}, projection={'_id': False})
+
+    def add(self, location: str, url: str, response: requests.Response) -> None:
+        """Hold the validators from a response until the fetch of `location` is committed."""
+        etag = response.headers.get('etag')
+        last_modified = response.headers.get('last-modified')
+
+        if etag is None and last_modified is None:
+            return
+
+        with self._lock:
+            self._pending.setdefault(location, []).append({
+                'url': url,
+                'location': location,
+                'etag': etag,
+                'last_modified': last_modified,
+                'next': response.links.get('next', {}).get('url'),
+            })
+
+    def commit(self, location: str) -> None:
+        with self._lock:
+            entries = self._pending.pop(location, [])
+
+        if entries:
+            self._collection.bulk_write(
+                [pymongo.ReplaceOne({'url': entry['url']}, entry, upsert=True) for entry in entries],
+                ordered=False
+            )
+
+    def rollback(self, location: str) -> None:
+        with self._lock:
+            self._pending.pop(location, None)
+
+
+def format_location(location_pattern: str, params: typing.Optional[typing.Mapping[str, str]] = None, **kwargs) -> str:
+    """Populate a URL pattern, adding any extra query parameters."""
+    location = location_pattern.format(**kwargs)
+
+    if params:
+        location += ('&' if '?' in location else '?') + urllib.parse.urlencode(params)
+
+    return location
+
 
 class RequestsConnector(Connector):
-    """Connector to get JSON data from a URL using Requests."""
-    def _get_with_ratelimit(self, location: str, *, follow_pagination: bool = True) -> requests.Response:
-        r = requests.get(location, **self._kwargs)
+    """Connector to get JSON data from a URL using Requests.
 
-        try:
-            logger.info('Rate limit remaining: %s', r.headers.get('x-ratelimit-remaining'))
+    If a token pool is given, each request is authorized with a token from it and the rate limit is
+    tracked for each token, rather than using a single rate limit budget.  If a recorder is given,
+    each response received is stored in it, so it can be replayed later by a `ReplayConnector`.
+    """
+    # Query parameters which differ on every fetch, such as the time of the last one - validators for
+    # requests using them would never be used again, so they are neither stored nor sent
+    volatile_params = frozenset({'since'})
+
+    def __init__(
+        self,
+        location_pattern: str,
+        *,
+        rate_limit: typing.Optional[RateLimitBudget] = None,
+        token_pool: typing.Optional[TokenPool] = None,
+        session: typing.Optional[requests.Session] = None,
+        validator_cache: typing.Optional[ValidatorCache] = None,
+        recorder: typing.Optional[ResponseCache] = None,
+        max_retries: typing.Optional[int] = None,
+        backoff_factor: typing.Optional[float] = None,
+        **kwargs
+    ):
+        super().__init__(location_pattern, **kwargs)
+        self._recorder = recorder
+        self._rate_limit = default_rate_limit if rate_limit is None else rate_limit
+        self._token_pool = token_pool
+        self._max_retries = config('HTTP_MAX_RETRIES', default=3, cast=int) if max_retries is None else max_retries
+        self._backoff_factor = (
+            config('HTTP_BACKOFF_FACTOR', default=0.5, cast=float) if backoff_factor is None else backoff_factor
+        )
+        self._session = get_session() if session is None else session
+        self._validator_cache = validator_cache
+        self.stats = ConnectionStats()
+
+    def _request(self, location: str, headers: typing.Optional[typing.Mapping[str, str]] = None) -> requests.Response:
+        """Make a single request using the pooled session, recording connection statistics."""
+        reused = False
+
+        def check_reused(response: requests.Response, *args, **kwargs) -> None:
+            nonlocal reused
+            reused = _connection_reused(response)
+
+        kwargs = dict(self._kwargs)
+        if headers:
+            kwargs['headers'] = {**kwargs.get('headers', {}), **headers}
+
+        with metrics.time_stage('request'):
+            r = self._session.get(location, hooks={'response': check_reused}, **kwargs)
+
+        # Content has been read by now, so we know the size before and after decompression
+        self.stats.record(reused=reused, bytes_received=r.raw.tell(), bytes_decoded=len(r.content))
 
-        except KeyError:
-            pass
+        return r
+
+    def _get_with_ratelimit(
+        self,
+        location: str,
+        *,
+        follow_pagination: bool = True,
+        headers: typing.Optional[typing.Mapping[str, str]] = None
+    ) -> requests.Response:
+        r = request_with_retries(
+            lambda auth_headers: self._request(location, {**(headers or {}), **auth_headers}),
+            rate_limit=self._rate_limit,
+            token_pool=self._token_pool,
+            max_retries=self._max_retries,
+            backoff_factor=self._backoff_factor,
+            description=f'Request to {location}'
+        )
 
         if not r.ok:
-            if r.headers.get('x-ratelimit-remaining', -1) == '0':
-                reset_time = datetime.datetime.fromtimestamp(int(r.headers['x-ratelimit-reset']))
+            logger.debug('Requests connector failed with status %d', r.status_code)
+            raise ResponseNotFoundError(status_code=r.status_code)
 
-                logger.warning('Rate limited - waiting until %s', reset_time)
-                wait_until(reset_time)
+        return r
 
-                return self._get_with_ratelimit(location, follow_pagination=follow_pagination)
+    def _format_location(self, params: typing.Optional[typing.Mapping[str, str]] = None, **kwargs) -> str:
+        """Populate the location pattern, adding any extra query parameters."""
+        return format_location(self._location_pattern, params, **kwargs)
 
-            logger.debug('Requests connector failed')
-            raise ResponseNotFoundError
+    def _get_page(
+        self, location: str, url: str, conditional: bool = True
+    ) -> typing.Tuple[typing.Optional[ConnectorResponseType], typing.Optional[str]]:
+        """Get a single page of a response, using a conditional request if we have seen it before.
 
-        return r
+        :param location: URL of the first page, identifying the response as a whole
+        :param url: URL of this page
+        :param conditional: Use and store validators for this page, if there is a validator cache
+        :return: Content of the page, or None if not modified, and the URL of the next page
+        """
+        cached = {}
+        headers = {}
+        conditional = conditional and self._validator_cache is not None
 
-    def _get(self, *, follow_pagination: bool = True, **kwargs) -> ConnectorResponseType:
-        location = self._location_pattern.format(**kwargs)
+        # When recording, pages which have not been recorded are fetched in full
+        if conditional and (self._recorder is None or url in self._recorder):
+            cached = self._validator_cache.get(url) or {}
+
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+
+        r = self._get_with_ratelimit(url, headers=headers)
+
+        if r.status_code == 304:
+            logger.debug('Not modified: %s', url)
+            return None, r.links.get('next', {}).get('url', cached.get('next'))
+
+        if conditional:
+            self._validator_cache.add(location, url, r)
+
+        if self._recorder is not None:
+            self._recorder.put(url, r.content, r.headers)
+
+        return parse_json(r.content), r.links.get('next', {}).get('url')
+
+    def _iter_pages(
+        self,
+        *,
+        follow_pagination: bool = True,
+        params: typing.Optional[typing.Mapping[str, str]] = None,
+        **kwargs
+    ) -> typing.Iterator[ConnectorResponseType]:
+        location = self._format_location(params, **kwargs)
         logger.debug('Trying requests connector')
 
-        r = self._get_with_ratelimit(location, follow_pagination=follow_pagination)
-        content: ConnectorResponseType = r.json()
+        if self._validator_cache is not None:
+            # Discard validators from any previous fetch of this location which was never stored
+            self._validator_cache.rollback(location)
+
+        conditional = not self.volatile_params.intersection(params or {})
+
+        modified = False
+        content, next_url = self._get_page(location, location, conditional)
+
+        # Only pages which have changed are included in the response
+        if content is not None:
+            modified = True
+            yield content
 
-        if follow_pagination and isinstance(content, list):
-            while 'next' in r.links:
-                r = self._get_with_ratelimit(r.links['next']['url'], follow_pagination=follow_pagination)
+        if follow_pagination and (content is None or isinstance(content, list)):
+            while next_url is not None:
+                page, next_url = self._get_page(location, next_url, conditional)
 
-                content.extend(r.json())
+                if page is not None:
+                    modified = True
+                    yield page
+
+        if not modified:
+            logger.debug('Not modified since last fetch: %s', location)
+            raise ResponseNotModified
 
         logger.debug('Fetched data from URL: %s', location)
-        return content
+        logger.debug('Connection stats for %s: %s', location, self.stats.as_dict())
+
+    def _get(self, **kwargs) -> ConnectorResponseType:
+        return join_pages(self._iter_pages(**kwargs))
+
+    def commit(self, **kwargs) -> None:
+        if self._validator_cache is not None:
+            self._validator_cache.commit(self._format_location(**kwargs))
+
+    def rollback(self, **kwargs) -> None:
+        if self._validator_cache is not None:
+            self._validator_cache.rollback(self._format_location(**kwargs))
+
+
+class ReplayConnector(Connector):
+    """Connector to replay responses recorded by a `RequestsConnector`, without using the network.
+
+    :param location_pattern: URL pattern the responses were recorded from
+    :param cache: Cache the responses were recorded in
+    """
+    def __init__(self, location_pattern: str, cache: ResponseCache, **kwargs):
+        super().__init__(location_pattern, **kwargs)
+        self._cache = cache
+
+    def _iter_pages(
+        self,
+        *,
+        follow_pagination: bool = True,
+        params: typing.Optional[typing.Mapping[str, str]] = None,
+        **kwargs
+    ) -> typing.Iterator[ConnectorResponseType]:
+        url = format_location(self._location_pattern, params, **kwargs)
+
+        while url is not None:
+            cached = self._cache.get(url)
+            if cached is None:
+                logger.debug('Response not recorded: %s', url)
+                raise ResponseNotFoundError
+
+            content, headers = cached
+            page = parse_json(content)
+            yield page
+
+            if not (follow_pagination and isinstance(page, list)):
+                break
+
+            links = requests.utils.parse_header_links(headers.get('Link', ''))
+            url = next((link['url'] for link in links if link.get('rel') == 'next'), None)
+
+    def _get(self, **kwargs) -> ConnectorResponseType:
+        return join_pages(self._iter_pages(**kwargs))
 
 
 class GitHubConnector(RequestsConnector):
+    """Connector to get JSON data from the GitHub REST API, authorized using the pool of GitHub tokens."""
     def __init__(self, location_pattern: str, **kwargs):
-        location_pattern = 'https://api.github.com/' + location_pattern.lstrip('/')
+        location_pattern = github_api_url + location_pattern.lstrip('/')
 
-        headers = kwargs.get('headers', {})
-        headers.update({'Authorization': f'token {config("GITHUB_AUTH_TOKEN")}'})
-        kwargs['headers'] = headers
+        if 'Authorization' not in kwargs.get('headers', {}):
+            kwargs.setdefault('token_pool', get_token_pool('rest'))
 
         super().__init__(location_pattern, **kwargs)
+
+
+_GRAPHQL_FIELDS = {
+    'repos': """
+        id
+        databaseId
+        name
+        nameWithOwner
+        description
+        url
+        homepageUrl
+        createdAt
+        updatedAt
+        pushedAt
+        isFork
+        isArchived
+        isPrivate
+        stargazerCount
+        forkCount
+        diskUsage
+        primaryLanguage { name }
+        licenseInfo { spdxId name }
+        defaultBranchRef { name }
+        owner { login id }
+    """,
+    'users': """
+        owner {
+            __typename
+            login
+            id
+            url
+            avatarUrl
+            ... on User { databaseId name company websiteUrl location email bio createdAt }
+            ... on Organization { databaseId name websiteUrl location email description createdAt }
+        }
+    """,
+    'readmes': """
+        readme_md: object(expression: "HEAD:README.md") { ...ReadmeBlob }
+        readme_rst: object(expression: "HEAD:README.rst") { ...ReadmeBlob }
+        readme_txt: object(expression: "HEAD:README.txt") { ...ReadmeBlob }
+        readme: object(expression: "HEAD:README") { ...ReadmeBlob }
+    """,
+}  # yapf: disable
+
+_GRAPHQL_FRAGMENTS = {
+    'readmes': """
+        fragment ReadmeBlob on Blob { oid byteSize isBinary text }
+    """,
+}  # yapf: disable
+
+_README_NAMES = {
+    'readme_md': 'README.md',
+    'readme_rst': 'README.rst',
+    'readme_txt': 'README.txt',
+    'readme': 'README',
+}
+
+
+def _graphql_repo_to_rest(node: typing.Mapping[str, JSONType]) -> ConnectorSingleResponseType:
+    """Convert a GraphQL repository to the field names used by the REST API."""
+    return {
+        'node_id': node['id'],
+        'id': node['databaseId'],
+        'name': node['name'],
+        'full_name': node['nameWithOwner'],
+        'description': node['description'],
+        'html_url': node['url'],
+        'homepage': node['homepageUrl'],
+        'created_at': node['createdAt'],
+        'updated_at': node['updatedAt'],
+        'pushed_at': node['pushedAt'],
+        'fork': node['isFork'],
+        'archived': node['isArchived'],
+        'private': node['isPrivate'],
+        'stargazers_count': node['stargazerCount'],
+        'forks_count': node['forkCount'],
+        'size': node['diskUsage'],
+        'language': (node['primaryLanguage'] or {}).get('name'),
+        'license': node['licenseInfo'] and {
+            'spdx_id': node['licenseInfo']['spdxId'],
+            'name': node['licenseInfo']['name'],
+        },
+        'default_branch': (node['defaultBranchRef'] or {}).get('name'),
+        'owner': {
+            'login': node['owner']['login'],
+            'node_id': node['owner']['id'],
+        },
+    }
+
+
+def _graphql_user_to_rest(node: typing.Mapping[str, JSONType]) -> ConnectorSingleResponseType:
+    """Convert a GraphQL repository owner to the field names used by the REST API."""
+    owner = node['owner']
+
+    return {
+        'node_id': owner['id'],
+        'id': owner.get('databaseId'),
+        'login': owner['login'],
+        'type': owner['__typename'],
+        'html_url': owner['url'],
+        'avatar_url': owner['avatarUrl'],
+        'name': owner.get('name'),
+        'company': owner.get('company'),
+        'blog': owner.get('websiteUrl'),
+        'location': owner.get('location'),
+        'email': owner.get('email'),
+        'bio': owner.get('bio', owner.get('description')),
+        'created_at': owner.get('createdAt'),
+    }
+
+
+def _graphql_readme_to_rest(node: typing.Mapping[str, JSONType]) -> typing.Optional[ConnectorSingleResponseType]:
+    """Convert the first README found in a GraphQL repository to the fields used by the REST API."""
+    for alias, name in _README_NAMES.items():
+        blob = node.get(alias)
+
+        if blob is not None and not blob['isBinary'] and blob['text'] is not None:
+            return {
+                'name': name,
+                'path': name,
+                'sha': blob['oid'],
+                'size': blob['byteSize'],
+                'encoding': 'base64',
+                'content': base64.b64encode(blob['text'].encode('utf-8')).decode('ascii'),
+            }
+
+    return None
+
+
+_GRAPHQL_CONVERTERS = {
+    'repos': _graphql_repo_to_rest,
+    'users': _graphql_user_to_rest,
+    'readmes': _graphql_readme_to_rest,
+}
+
+
+class GitHubGraphQLConnector(BaseConnector):
+    """Connector to get repository metadata, owners or READMEs from the GitHub GraphQL API.
+
+    Many repositories are fetched in a single request, by aliasing a `repository` query for each.
+    Call `plan` with the repos which will be requested, in order, so each request can fetch the next
+    batch of them.  Results are converted to the field names used by the REST API, so they can be
+    stored in the same collections.
+
+    :param resource: Type of data to fetch - one of 'repos', 'users' or 'readmes'
+    :param batch_size: Maximum number of repositories in each request
+    :param url: GraphQL endpoint
+    :param rate_limit: Rate limit budget to draw on, if using an Authorization header
+    :param token_pool: Pool of tokens to authorize requests
+    :param session: HTTP session to use
+    :param headers: Additional headers - if no Authorization is given, the pool of GitHub tokens is used
+    """
+    resources = tuple(_GRAPHQL_FIELDS)
+
+    def __init__(
+        self,
+        resource: str,
+        *,
+        batch_size: int = 50,
+        url: typing.Optional[str] = None,
+        rate_limit: typing.Optional[RateLimitBudget] = None,
+        token_pool: typing.Optional[TokenPool] = None,
+        session: typing.Optional[requests.Session] = None,
+        headers: typing.Optional[typing.Mapping[str, str]] = None,
+        max_retries: typing.Optional[int] = None,
+        backoff_factor: typing.Optional[float] = None
+    ):
+        if resource not in _GRAPHQL_FIELDS:
+            raise ValueError(f'GraphQL connector cannot fetch {resource}')
+
+        self._resource = resource
+        self.batch_size = batch_size
+        self._url = github_api_url + 'graphql' if url is None else url
+        self._rate_limit = graphql_rate_limit if rate_limit is None else rate_limit
+        self._session = get_session() if session is None else session
+        self._max_retries = config('HTTP_MAX_RETRIES', default=3, cast=int) if max_retries is None else max_retries
+        self._backoff_factor = (
+            config('HTTP_BACKOFF_FACTOR', default=0.5, cast=float) if backoff_factor is None else backoff_factor
+        )
+        self.stats = ConnectionStats()
+
+        self._headers = dict(headers or {})
+        self._token_pool = token_pool
+        if self._token_pool is None and 'Authorization' not in self._headers:
+            self._token_pool = get_token_pool('graphql')
+
+        self._lock = threading.Lock()
+        self._plan: typing.List[str] = []
+        self._plan_index: typing.Dict[str, int] = {}
+        self._batches: typing.Dict[str, Future] = {}
+
+    def plan(self, repos: typing.Sequence[str]) -> None:
+        with self._lock:
+            self._plan = list(repos)
+            self._plan_index = {repo: i for i, repo in enumerate(self._plan)}
+
+    def _next_batch(self, repo_name: str) -> typing.List[str]:
+        """Get the next batch of planned repos, starting with this one, which are not already being fetched."""
+        start = self._plan_index.get(repo_name)
+        if start is None:
+            return [repo_name]
+
+        return [
+            repo for repo in self._plan[start:start + self.batch_size]
+            if repo == repo_name or repo not in self._batches
+        ]
+
+    def _evict(self, repo_name: str) -> None:
+        """Drop the results of fetched repos planned well before one being requested.
+
+        Repos are requested in roughly the planned order, so these have been skipped - e.g. linked to another
+        repo with the same owner - and would otherwise be kept for the whole run.  Any which are requested
+        after all are fetched again.
+        """
+        start = self._plan_index.get(repo_name)
+        if start is None:
+            return
+
+        stale = [
+            name for name, future in self._batches.items()
+            if future.done() and self._plan_index.get(name, start) < start - self.batch_size
+        ]  # yapf: disable
+
+        for name in stale:
+            del self._batches[name]
+
+    def _build_query(self, repos: typing.Sequence[str]) -> typing.Tuple[str, typing.Dict[str, str]]:
+        """Build a query aliasing a repository lookup for each repo, with the names passed as variables."""
+        params = []
+        selections = []
+        variables = {}
+
+        for i, repo_name in enumerate(repos):
+            owner, repo = repo_name.split('/')
+            variables[f'owner{i}'] = owner
+            variables[f'name{i}'] = repo
+
+            params.append(f'$owner{i}: String!, $name{i}: String!')
+            selections.append(
+                f'r{i}: repository(owner: $owner{i}, name: $name{i}) {{ {_GRAPHQL_FIELDS[self._resource]} }}'
+            )
+
+        query = 'query({}) {{ {} }} {}'.format(
+            ', '.join(params), '\n'.join(selections), _GRAPHQL_FRAGMENTS.get(self._resource, '')
+        )
+        return query, variables
+
+    def _post(self, query: str, variables: typing.Mapping[str, str]) -> typing.Dict[str, JSONType]:
+        """Send a GraphQL query, waiting and retrying if rate limited or after a transient failure."""
+        def send(auth_headers: typing.Mapping[str, str]) -> requests.Response:
+            reused = False
+
+            def check_reused(response: requests.Response, *args, **kwargs) -> None:
+                nonlocal reused
+                reused = _connection_reused(response)
+
+            with metrics.time_stage('request'):
+                r = self._session.post(
+                    self._url,
+                    json={'query': query, 'variables': variables},
+                    headers={**self._headers, **auth_headers},
+                    hooks={'response': check_reused}
+                )
+            self.stats.record(reused=reused, bytes_received=r.raw.tell(), bytes_decoded=len(r.content))
+
+            return r
+
+        r = request_with_retries(
+            send,
+            rate_limit=self._rate_limit,
+            token_pool=self._token_pool,
+            auth_scheme='bearer',
+            max_retries=self._max_retries,
+            backoff_factor=self._backoff_factor,
+            description='GraphQL request'
+        )
+
+        if not r.ok:
+            logger.error('GraphQL request failed with status %d', r.status_code)
+            raise ResponseError(f'GraphQL request failed with status {r.status_code}')
+
+        return parse_json(r.content)
+
+    def _fetch_batch(
+        self, repos: typing.Sequence[str]
+    ) -> typing.Dict[str, typing.Union[None, JSONType, ResponseError]]:
+        """Fetch data for a batch of repos.
+
+        :return: Data for each repo - None if it could not be found, or an error if it could not be fetched
+            for another reason, such as access being forbidden or a resource limit being exceeded
+        """
+        logger.info('Fetching %s for %d repos using GraphQL', self._resource, len(repos))
+        query, variables = self._build_query(repos)
+        content = self._post(query, variables)
+
+        data = content.get('data')
+        if data is None:
+            raise ResponseError(f'GraphQL query failed: {content.get("errors")}')
+
+        # Repos which could not be fetched are reported as errors alongside the data for the others
+        errors = {}
+        for error in content.get('errors', []):
+            alias = (error.get('path') or [None])[0]
+            errors.setdefault(alias, error)
+
+            if error.get('type') == 'NOT_FOUND':
+                logger.debug('GraphQL error: %s', error.get('message'))
+
+            else:
+                logger.warning('GraphQL error: %s', error.get('message'))
+
+        convert = _GRAPHQL_CONVERTERS[self._resource]
+        results = {}
+
+        for i, repo_name in enumerate(repos):
+            node = data.get(f'r{i}')
+            error = errors.get(f'r{i}')
+
+            if node is not None:
+                results[repo_name] = convert(node)
+
+            elif error is None or error.get('type') == 'NOT_FOUND':
+                results[repo_name] = None
+
+            else:
+                results[repo_name] = ResponseError(
+                    f'GraphQL query for {repo_name} failed: {error.get("type")} {error.get("message")}'
+                )
+
+        return results
+
+    def _get(self, *, owner: str, repo: str, **kwargs) -> ConnectorResponseType:
+        repo_name = f'{owner}/{repo}'
+        batch = None
+
+        with self._lock:
+            future = self._batches.get(repo_name)
+
+            if future is None:
+                self._evict(repo_name)
+                batch = self._next_batch(repo_name)
+                future = Future()
+
+                for name in batch:
+                    self._batches[name] = future
+
+        if batch is not None:
+            try:
+                future.set_result(self._fetch_batch(batch))
+
+            except Exception as exc:
+                future.set_exception(exc)
+
+        try:
+            result = future.result()[repo_name]
+
+        finally:
+            with self._lock:
+                self._batches.pop(repo_name, None)
+
+        if isinstance(result, ResponseError):
+            raise result
+
+        if result is None:
+            logger.debug('GraphQL connector found no %s for %s', self._resource, repo_name)
+            raise ResponseNotFoundError(status_code=404)
+
+        return result
@@ -1,7 +1,18 @@
+import collections
+from concurrent.futures import Future
+import logging
+import threading
 import typing
 
 from decouple import config
 import pymongo
+import pymongo.collection
+import pymongo.database
+from pymongo.errors import BulkWriteError, DocumentTooLarge, PyMongoError
+
+from github_analysis import metrics
+
+logger = logging.getLogger(__name__)
 
 db_user = config('MONGO_ROOT_USER', default=None)
 db_pass = config('MONGO_ROOT_PASSWORD', default=None)
@@ -11,18 +22,241 @@ if db_user and db_pass:
 else:
     database_url = config('DATABASE_URL', default='mongodb://localhost:27017/')
 
-client = pymongo.MongoClient(database_url)
-db = client['github']
+database_name = config('DATABASE_NAME', default='github')
+
+# The client is created on first use, so commands which don't need the database start quickly
+_client: typing.Optional[pymongo.MongoClient] = None
+_client_lock = threading.Lock()
+
+# An index is either a single field name or a tuple of field names for a compound index
+IndexType = typing.Union[str, typing.Tuple[str, ...]]
+
+# Indexes which have already been created by this process
+_created_indexes: typing.Set[typing.Tuple[str, IndexType]] = set()
+_created_indexes_lock = threading.Lock()
+
+
+def get_client() -> pymongo.MongoClient:
+    global _client
+
+    with _client_lock:
+        if _client is None:
+            _client = pymongo.MongoClient(database_url)
+
+    return _client
+
+
+def use_client(client: pymongo.MongoClient) -> None:
+    """Use a given client for all further database access - e.g. one with event listeners or an in-memory one."""
+    global _client
+
+    with _client_lock:
+        _client = client
+
+    with _created_indexes_lock:
+        _created_indexes.clear()
+
+
+def get_database(name: typing.Optional[str] = None) -> pymongo.database.Database:
+    """Get a database - by default the one named by `DATABASE_NAME`."""
+    return get_client()[database_name if name is None else name]
+
+
+def __getattr__(name: str):
+    # Module-level `client` and `db` are created lazily
+    if name == 'client':
+        return get_client()
 
+    if name == 'db':
+        return get_database()
 
-def collection(name: str, indexes: typing.Optional[typing.Iterable[str]] = None):
-    collection = db[name]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def collection(name: str, indexes: typing.Optional[typing.Iterable[IndexType]] = None):
+    """Get a collection, creating indexes on it if this process has not already done so."""
+    collection = get_database()[name]
 
     if indexes is None:
         indexes = set()
 
     indexes = {'_repo_name', 'node_id'}.union(indexes)
+
+    with _created_indexes_lock:
+        indexes = {index for index in indexes if (name, index) not in _created_indexes}
+
     for index in indexes:
-        collection.create_index(index)
+        if isinstance(index, str):
+            collection.create_index(index)
+
+        else:
+            collection.create_index([(field, pymongo.ASCENDING) for field in index])
+
+        with _created_indexes_lock:
+            _created_indexes.add((name, index))
 
     return collection
+
+
+class WriteBuffer:
+    """Buffer of write operations which are sent to MongoDB in batches.
+
+    Operations are grouped by collection and sent as unordered bulk writes once `max_ops` operations
+    have been buffered, or every `max_delay` seconds, whichever comes first.  Each call to `add` returns
+    a future which is resolved once its operations have been acknowledged by the database, or fail.
+
+    Use as a context manager to make sure that all buffered operations are written on shutdown.
+
+    :param max_ops: Number of buffered operations which triggers a flush
+    :param max_delay: Maximum time in seconds an operation may wait in the buffer
+    """
+    def __init__(self, max_ops: typing.Optional[int] = None, max_delay: typing.Optional[float] = None):
+        self.max_ops = config('WRITE_BUFFER_SIZE', default=1000, cast=int) if max_ops is None else max_ops
+        self.max_delay = config('WRITE_BUFFER_DELAY', default=5.0, cast=float) if max_delay is None else max_delay
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.RLock()
+        self._pending: typing.List[typing.Tuple[pymongo.collection.Collection, typing.List, Future]] = []
+        self._pending_ops = 0
+
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._flusher.start()
+
+    def __enter__(self) -> 'WriteBuffer':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def add(self, collection: pymongo.collection.Collection, requests: typing.List) -> Future:
+        """Buffer a group of write operations for a collection.
+
+        :param collection: Collection to write to
+        :param requests: Write operations, such as `pymongo.ReplaceOne`
+        :return: Future resolved once all of the operations have been written
+        """
+        future = Future()
+
+        with self._lock:
+            self._pending.append((collection, requests, future))
+            self._pending_ops += len(requests)
+            full = self._pending_ops >= self.max_ops
+
+        if full:
+            self.flush()
+
+        return future
+
+    def flush(self) -> None:
+        """Write all buffered operations to the database."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+                self._pending_ops = 0
+
+            groups = collections.defaultdict(list)
+            for collection, requests, future in pending:
+                groups[collection.full_name].append((collection, requests, future))
+
+            for group in groups.values():
+                self._write(group)
+
+    def drain(self) -> None:
+        """Write all buffered operations, including any added as earlier writes complete - e.g. status updates.
+
+        Unlike `close`, the buffer can still be used afterwards.
+        """
+        while True:
+            self.flush()
+
+            with self._lock:
+                if not self._pending:
+                    return
+
+    def close(self) -> None:
+        """Stop the periodic flush and write any remaining operations."""
+        self._closed.set()
+        self._flusher.join()
+        self.drain()
+
+    def _flush_periodically(self) -> None:
+        while not self._closed.wait(self.max_delay):
+            self.flush()
+
+    def _write(self, group: typing.List[typing.Tuple[pymongo.collection.Collection, typing.List, Future]]) -> None:
+        """Write a group of operations on a single collection, resolving the future for each."""
+        collection = group[0][0]
+        requests = [request for _, group_requests, _ in group for request in group_requests]
+
+        if not requests:
+            for _, _, future in group:
+                future.set_result(None)
+            return
+
+        try:
+            with metrics.db_write_seconds.time(collection=collection.name):
+                collection.bulk_write(requests, ordered=False)
+
+        except BulkWriteError as exc:
+            failed = {error['index'] for error in exc.details['writeErrors']}
+            start = 0
+
+            for _, group_requests, future in group:
+                end = start + len(group_requests)
+
+                if failed.intersection(range(start, end)):
+                    future.set_exception(exc)
+                else:
+                    future.set_result(None)
+
+                start = end
+
+            return
+
+        except DocumentTooLarge as exc:
+            if len(group) > 1:
+                # Write each group of operations separately so only the group containing the document fails
+                for item in group:
+                    self._write([item])
+
+            else:
+                group[0][2].set_exception(exc)
+
+            return
+
+        except PyMongoError as exc:
+            logger.error('Failed to write buffered operations to %s: %s', collection.full_name, exc)
+
+            for _, _, future in group:
+                future.set_exception(exc)
+
+            return
+
+        metrics.documents_written.inc(len(requests), collection=collection.name)
+
+        for _, _, future in group:
+            future.set_result(None)
+
+
+def when_all(futures: typing.Collection[Future], callback: typing.Callable[[typing.Collection[Future]], None]) -> None:
+    """Call a function once all of a collection of futures are done, passing the futures."""
+    remaining = len(futures)
+    lock = threading.Lock()
+
+    if remaining == 0:
+        callback(futures)
+        return
+
+    def done(_: Future) -> None:
+        nonlocal remaining
+
+        with lock:
+            remaining -= 1
+            finished = remaining == 0
+
+        if finished:
+            callback(futures)
+
+    for future in futures:
+        future.add_done_callback(done)
@@ -0,0 +1,156 @@
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import typing
+
+from github_analysis import db, overflow, sinks
+
+logger = logging.getLogger(__name__)
+
+PathLike = typing.Union[str, pathlib.Path]
+
+STATE_NAME = 'export.json'
+
+
+def export_repos(
+    repos: typing.Optional[typing.Iterable[str]] = None, set_name: typing.Optional[str] = None
+) -> typing.List[str]:
+    """Get the repos to export - those in a list and/or a set, or every repo with a status.
+
+    Set membership is taken from the `status` collection, since records fetched after a set was labelled
+    do not have the label themselves.
+    """
+    if set_name is not None:
+        status_collection = db.collection('status', indexes=['sets'])
+        in_set = {
+            status['_repo_name']
+            for status in status_collection.find({'sets': set_name}, projection={'_id': False, '_repo_name': True})
+        }  # yapf: disable
+
+        return sorted(in_set if repos is None else in_set.intersection(repos))
+
+    if repos is not None:
+        return sorted(set(repos))
+
+    return sorted(db.collection('status').distinct('_repo_name'))
+
+
+def export_chunk(
+    collection_name: str,
+    repos: typing.Sequence[str],
+    path: pathlib.Path,
+    shard_class: typing.Type,
+    batch_size: int = 1000
+) -> int:
+    """Export the records for a group of repos to a file, which only appears once it is complete.
+
+    :return: Number of records exported
+    """
+    collection = db.collection(collection_name)
+    partial_path = path.with_name(path.name + '.part')
+    shard = shard_class(partial_path)
+    count = 0
+
+    try:
+        cursor = collection.find({'_repo_name': {'$in': list(repos)}}, projection={'_id': False}, batch_size=batch_size)
+
+        batch = []
+        for record in cursor:
+            batch.append(overflow.restore_document(record, collection.database))
+
+            if len(batch) >= batch_size:
+                shard.write(batch)
+                count += len(batch)
+                batch = []
+
+        shard.write(batch)
+        count += len(batch)
+
+    finally:
+        shard.close()
+
+    os.replace(partial_path, path)
+    return count
+
+
+def export_collection(
+    collection_name: str,
+    output: PathLike,
+    *,
+    repos: typing.Optional[typing.Iterable[str]] = None,
+    set_name: typing.Optional[str] = None,
+    output_format: str = 'jsonl',
+    chunk_size: int = 100,
+    workers: int = 4
+) -> int:
+    """Export the records in a collection for a list and/or set of repos, resuming a previous export if possible.
+
+    The repos are split into chunks, each of which is read by its own cursor and written to its own gzip
+    compressed JSON lines or Parquet file by a pool of worker threads.  JSON lines files are streamed, so
+    memory use is bounded by the cursor batch size - Parquet files are written once each chunk is read.
+    A chunk whose file already exists is skipped, so an interrupted export can be run again to finish it.
+
+    :param collection_name: Collection to export
+    :param output: Directory to write to - files are written to a subdirectory for the collection
+    :param repos: Export only these repos
+    :param set_name: Export only repos in this set
+    :param output_format: Format of files - 'jsonl' or 'parquet'
+    :param chunk_size: Number of repos in each file
+    :param workers: Number of chunks to export at once
+    :return: Number of records exported by this run
+    """
+    if output_format not in sinks.FORMATS:
+        raise ValueError(f'Unknown output format: {output_format}')
+
+    shard_class = sinks.ParquetShard if output_format == 'parquet' else sinks.JsonLinesShard
+    directory = pathlib.Path(output).joinpath(collection_name)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    repos = export_repos(repos, set_name)
+    chunks = [repos[start:start + chunk_size] for start in range(0, len(repos), chunk_size)]
+
+    # The chunks must be the same to resume an export
+    state = {
+        'collection': collection_name,
+        'set': set_name,
+        'format': output_format,
+        'chunk_size': chunk_size,
+        'repos': hashlib.sha256('\n'.join(repos).encode()).hexdigest(),
+    }
+    state_path = directory.joinpath(STATE_NAME)
+
+    try:
+        with open(state_path) as fp:
+            previous = json.load(fp)
+
+        if previous != state:
+            raise FileExistsError(f'{directory} contains a different export - use a different output directory')
+
+    except FileNotFoundError:
+        with open(state_path, 'w') as fp:
+            json.dump(state, fp)
+
+    paths = [directory.joinpath(f'part-{index:05d}{shard_class.suffix}') for index in range(len(chunks))]
+    pending = [(chunk, path) for chunk, path in zip(chunks, paths) if not path.exists()]
+
+    logger.info(
+        'Exporting %s for %d repos - %d of %d chunks remaining', collection_name, len(repos), len(pending),
+        len(chunks)
+    )
+
+    exported = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(export_chunk, collection_name, chunk, path, shard_class)
+            for chunk, path in pending
+        ]  # yapf: disable
+
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            exported += future.result()
+            logger.info('Exported %d / %d chunks of %s', done, len(pending), collection_name)
+
+    logger.info('Exported %d records from %s to %s', exported, collection_name, directory)
+    return exported
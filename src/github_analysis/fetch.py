@@ -1,18 +1,24 @@
 import abc
 import base64
+from concurrent.futures import Future
+import datetime
+import functools
 import logging
 import pathlib
+import threading
 import typing
 
-import pymongo
+from decouple import config
 import pymongo.collection
-from pymongo.errors import DocumentTooLarge
 
-from github_analysis import connectors, db
+from github_analysis import connectors, db, metrics, resolve, sinks
+from github_analysis.cache import ResponseCache
+from github_analysis.projection import EmbeddedUsers, Projection
+from github_analysis.sinks import CouldNotStoreData  # noqa: F401 pylint: disable=unused-import
 
 logger = logging.getLogger(__name__)
 
-FetcherFunc = typing.Callable[[str, bool], connectors.ConnectorResponseType]
+FetcherFunc = typing.Callable[..., connectors.ConnectorResponseType]
 TransformerFunc = typing.Callable[[connectors.ConnectorResponseType], connectors.ConnectorResponseType]
 
 PathLike = typing.Union[str, pathlib.Path]
@@ -22,118 +28,367 @@ class DataExists(Exception):
     pass
 
 
-class CouldNotStoreData(Exception):
-    pass
+def fetched_repos(name: str) -> typing.Set[str]:
+    """Get the names of all repos which have been successfully fetched by a fetcher.
+
+    :param name: Name of the fetcher
+    """
+    status_collection = db.collection('status', indexes=[name])
+    cursor = status_collection.find({name: {'$exists': True}}, projection={'_id': False, '_repo_name': True})
+
+    return {status['_repo_name'] for status in cursor}
 
 
 def make_fetcher(
     name: str,
-    collection: pymongo.collection.Collection,
+    sink: typing.Union[sinks.Sink, pymongo.collection.Collection],
     connector: connectors.BaseConnector,
     *,
     transformer: TransformerFunc = lambda x: x,
-    key_name: str = 'node_id'
+    key_name: str = 'node_id',
+    since_param: typing.Optional[str] = None,
+    write_buffer: typing.Optional[db.WriteBuffer] = None,
+    dedup_key: typing.Optional[str] = None,
+    dedup_ttl: float = 0,
+    projection: typing.Optional[Projection] = None,
+    embedded_users: typing.Optional[EmbeddedUsers] = None,
+    resolve_repos: bool = False
 ) -> FetcherFunc:
     """Build a fetcher function for a specific content type.
 
     :param name: Name of the fetcher for logging purposes
-    :param collection: MongoDB collection to store responses
+    :param sink: Sink to store responses and fetch status in, or a MongoDB collection to store responses in
     :param connector: Data connector with which to fetch the data
     :param transformer: Function applied to the response before saving
     :param key_name: MonogDB field name to use for update query
+    :param since_param: Query parameter to request only records updated since a time - enables incremental fetch
+    :param write_buffer: Buffer to batch writes to a MongoDB collection with those of other fetches
+    :param dedup_key: Pattern of the `owner` and `repo` identifying the data - e.g. '{owner}' if it is per-owner.
+        Data is fetched once per key, then other repos with the same key are linked to it
+    :param dedup_ttl: Time in seconds for which data fetched for a key in a previous run is still fresh
+    :param projection: Projection applied to each page after the transformer, to remove redundant fields
+    :param embedded_users: Store for users removed from records by the projection
+    :param resolve_repos: This content type is the repo itself - record repos which are missing or renamed,
+        so later runs skip or redirect them
     """
-    status_collection = db.collection('status', indexes=[name])
+    if not isinstance(sink, sinks.Sink):
+        sink = sinks.MongoSink(name, sink, key_name=key_name, write_buffer=write_buffer)
+
+    # Keys fetched in this run, with the start of the fetch and the content returned, fetches of keys in progress,
+    # and repos to link to keys whose buffered writes have not yet been acknowledged
+    dedup_lock = threading.Lock()
+    dedup_fetched: typing.Dict[str, typing.Tuple[datetime.datetime,
+                                                 typing.Optional[connectors.ConnectorResponseType]]] = {}
+    dedup_claims: typing.Dict[str, threading.Event] = {}
+    dedup_links: typing.Dict[str, typing.List[str]] = {}
+
+    def claim(
+        key: str
+    ) -> typing.Tuple[typing.Optional[datetime.datetime], typing.Optional[connectors.ConnectorResponseType]]:
+        """Check whether a key has already been fetched, waiting if it is being fetched, otherwise claim it.
+
+        :return: Start of the fetch of the key, if it has been fetched, and the content returned if it was
+            fetched in this run
+        """
+        while True:
+            with dedup_lock:
+                if key in dedup_fetched:
+                    return dedup_fetched[key]
 
-    def update_mongo(response: connectors.ConnectorResponseType) -> None:
-        """Update a record or multiple records for a response in the MongoDB collection."""
-        if isinstance(response, dict):
-            try:
-                collection.replace_one({key_name: response[key_name]}, response, upsert=True)
+                in_progress = dedup_claims.get(key)
+                if in_progress is None:
+                    dedup_claims[key] = threading.Event()
+                    break
 
-            except KeyError:
-                logger.warning('Response did not contain expected key: %s', key_name)
+            in_progress.wait()
 
-            except DocumentTooLarge:
-                logger.error('Data did not fit within maximum record size')
+        if dedup_ttl > 0:
+            try:
+                last = sink.last_fetched_key(key)
+
+            except BaseException:
+                release(key, None)
                 raise
 
-        elif isinstance(response, list) and len(response) > 0:
-            try:
-                collection.bulk_write(
-                    [pymongo.ReplaceOne({key_name: item[key_name]}, item, upsert=True) for item in response],
-                    ordered=False
-                )
+            if last is not None and datetime.datetime.utcnow() - last < datetime.timedelta(seconds=dedup_ttl):
+                release(key, last)
+                return last, None
+
+        return None, None
+
+    def release(
+        key: str,
+        fetched: typing.Optional[datetime.datetime],
+        content: typing.Optional[connectors.ConnectorResponseType] = None,
+        stored: bool = True
+    ) -> None:
+        """Release a claimed key, recording when it was fetched so other repos with the key can be linked.
+
+        :param stored: The data has been stored - if not, other repos are linked by `link_stored` once it is
+        """
+        with dedup_lock:
+            if fetched is not None:
+                dedup_fetched[key] = fetched, content
+
+                if not stored:
+                    dedup_links[key] = []
+
+            in_progress = dedup_claims.pop(key, None)
+
+        if in_progress is not None:
+            in_progress.set()
+
+    def link(repo_name: str, key: str, fetched: datetime.datetime) -> None:
+        """Record that data for a repo has been fetched with another repo with the same key."""
+        with dedup_lock:
+            if key in dedup_links:
+                dedup_links[key].append(repo_name)
+                return
+
+        # Linked with the start of the fetch of the key, so the key still expires after `dedup_ttl`
+        sink.mark_fetched(repo_name, fetched, connector.name, key=key)
+        logger.info('Fetcher %s already fetched %s - linked to %s', name, key, repo_name)
+
+    def link_stored(key: str, fetched: datetime.datetime, succeeded: bool) -> None:
+        """Link repos waiting for the buffered writes of a key, or if they failed, let it be fetched again."""
+        with dedup_lock:
+            waiting = dedup_links.pop(key, [])
+
+            if not succeeded:
+                dedup_fetched.pop(key, None)
+
+        for repo_name in waiting:
+            if succeeded:
+                sink.mark_fetched(repo_name, fetched, connector.name, key=key)
+                logger.info('Fetcher %s already fetched %s - linked to %s', name, key, repo_name)
+
+            else:
+                logger.error('Data for %s could not be stored - it has not been linked to %s', key, repo_name)
+
+    def complete_buffered(
+        repo_name: str,
+        started: datetime.datetime,
+        key: typing.Optional[str],
+        connector_kwargs: typing.Mapping[str, typing.Any],
+        writes: typing.Collection[Future]
+    ) -> None:
+        """Record that data for a repo has been fetched once all of its buffered writes have succeeded.
+
+        The status must not be written before the data, or `--skip-existing` would skip incomplete repos.
+        """
+        if any(write.exception() is not None for write in writes):
+            connector.rollback(**connector_kwargs)
+            logger.error(
+                'Some data for repo %s could not be stored - it has not been logged as complete', repo_name
+            )
+
+            if key is not None:
+                link_stored(key, started, False)
+            return
 
-            except DocumentTooLarge:
-                raise CouldNotStoreData()
+        connector.commit(**connector_kwargs)
+        sink.mark_fetched(repo_name, started, connector.name, key=key)
 
-    def fetch(repo_name: str, skip_existing: bool = False) -> connectors.ConnectorResponseType:
+        if embedded_users is not None:
+            embedded_users.mark_fetched(repo_name, started)
+
+        if key is not None:
+            link_stored(key, started, True)
+
+        logger.info('Fetcher %s updated %s', name, repo_name)
+
+    @metrics.instrument(name)
+    def fetch(
+        repo_name: str,
+        skip_existing: bool = False,
+        *,
+        incremental: bool = False,
+        stream: bool = False,
+        pages: typing.Optional[typing.Iterable[connectors.ConnectorResponseType]] = None
+    ) -> typing.Optional[connectors.ConnectorResponseType]:
         """Function to fetch data for a specific repo.
 
         The content type and connectors used are set by closure.
+        Each page of the response is stored as soon as it arrives.
+        If the fetcher has a deduplication key, the data is fetched only for the first repo with each key,
+        and other repos with the same key are recorded as fetched without fetching it again.
 
         :param repo_name: Name of repository to fetch in 'username/reponame' format
         :param skip_existing: Skip if data already exists?
+        :param incremental: Fetch only records updated since the last successful fetch, if supported
+        :param stream: Discard each page once stored and return None, rather than returning the response
+        :param pages: Pages already fetched and transformed elsewhere, to be stored in place of using the connector
         """
         owner, repo = repo_name.split('/')
+        started = datetime.datetime.utcnow()
 
         if skip_existing:
-            exists = status_collection.count({
-                '_repo_name': repo_name,
-                name: {
-                    '$exists': True
-                },
-            })
-
-            if exists:
+            if sink.is_fetched(repo_name):
                 logger.info('Data exists for repo %s with fetcher %s', repo_name, name)
                 raise DataExists()
 
+        if dedup_key is None:
+            return fetch_pages(repo_name, started, incremental=incremental, stream=stream, pages=pages)
+
+        key = dedup_key.format(owner=owner, repo=repo)
+        fetched, content = claim(key)
+
+        if fetched is not None:
+            link(repo_name, key, fetched)
+            return None if stream else content
+
+        # `fetch_pages` releases the key once the data is fetched - so releasing it on a later failure does nothing
         try:
-            response = connector.get(owner=owner, repo=repo)
-            response = transformer(response)
-
-            update_mongo(response)
-            status_collection.update_one(
-                {'_repo_name': repo_name}, {
-                    '$currentDate': {
-                        f'{name}.timestamp': {
-                            '$type': 'timestamp'
-                        },
-                    },
-                    '$set': {
-                        f'{name}.connector': connector.name,
-                    }
-                },
-                upsert=True
-            )
+            return fetch_pages(repo_name, started, key, incremental=incremental, stream=stream, pages=pages)
 
-            logger.info('Fetcher %s updated %s', name, repo_name)
-            return response
+        except connectors.ResponseNotModified:
+            release(key, started)
+            raise
+
+        except BaseException:
+            release(key, None)
+            raise
 
-        except connectors.ResponseNotFoundError:
+    def fetch_pages(
+        repo_name: str,
+        started: datetime.datetime,
+        key: typing.Optional[str] = None,
+        *,
+        incremental: bool = False,
+        stream: bool = False,
+        pages: typing.Optional[typing.Iterable[connectors.ConnectorResponseType]] = None
+    ) -> typing.Optional[connectors.ConnectorResponseType]:
+        """Fetch and store the pages of data for a repo - see `fetch`.
+
+        :param key: Deduplication key of the data, recorded in the status of the repo - released once the data
+            is fetched
+        """
+        owner, repo = repo_name.split('/')
+        kwargs = {'owner': owner, 'repo': repo}
+
+        if incremental and since_param is not None:
+            since = sink.last_fetched(repo_name)
+
+            if since is not None:
+                logger.info('Fetcher %s fetching changes to %s since %s', name, repo_name, since)
+                kwargs['params'] = {since_param: since.strftime('%Y-%m-%dT%H:%M:%SZ')}
+
+        if pages is None:
+            pages = map(metrics.timed(transformer, 'transform'), connector.iter_pages(**kwargs))
+
+        stored = []
+        writes = []
+
+        try:
+            for page in pages:
+                if resolve_repos and isinstance(page, dict):
+                    resolve.record_found(repo_name, page.get('full_name'), write_buffer)
+
+                if projection is not None:
+                    with metrics.time_stage('project'):
+                        page, users = projection.apply(page)
+
+                    if users and embedded_users is not None:
+                        write = embedded_users.add(users, repo_name)
+
+                        if write is not None:
+                            writes.append(write)
+
+                with metrics.time_stage('store'):
+                    write = sink.write(page, repo_name)
+
+                if write is not None:
+                    writes.append(write)
+
+                if not stream:
+                    stored.append(page)
+
+        except connectors.ResponseNotModified:
+            # The stored data is still current, so this counts as a successful fetch
+            sink.mark_fetched(repo_name, started, connector.name, key=key)
+            logger.info('Fetcher %s found no changes for %s', name, repo_name)
+            raise
+
+        except connectors.ResponseNotFoundError as exc:
+            connector.rollback(**kwargs)
             logger.warning('Fetcher %s found no result for %s', name, repo_name)
+
+            if resolve_repos and exc.status_code in resolve.GONE_STATUS_CODES:
+                resolve.record_missing(repo_name, write_buffer)
+
             raise
 
         except CouldNotStoreData:
+            connector.rollback(**kwargs)
             logger.error(
                 'Some data for repo %s could not be stored - it has not been logged as complete', repo
             )
             raise
 
+        except connectors.ResponseError as exc:
+            connector.rollback(**kwargs)
+            logger.error('Fetcher %s failed for %s: %s', name, repo_name, exc)
+            raise
+
+        except Exception:
+            connector.rollback(**kwargs)
+            raise
+
+        content = None if stream else connectors.join_pages(stored)
+
+        if key is not None:
+            # Released before the writes can complete, so other repos with the key are linked once they have
+            release(key, started, content, stored=not writes)
+
+        if writes:
+            db.when_all(writes, functools.partial(complete_buffered, repo_name, started, key, kwargs))
+
+        else:
+            connector.commit(**kwargs)
+            sink.mark_fetched(repo_name, started, connector.name, key=key)
+
+            if embedded_users is not None:
+                embedded_users.mark_fetched(repo_name, started)
+
+            logger.info('Fetcher %s updated %s', name, repo_name)
+
+        return content
+
     return fetch
 
 
 class Fetcher(abc.ABC):
-    """Build fetchers for each content type."""
+    """Build fetchers for each content type.
+
+    :param connector_root: Location of the data, prepended to the path for each content type
+    :param store: Store to write records to as files - if None, they are stored in MongoDB
+    :param projection: Projection mode - 'none', 'drop-urls' to drop URL fields, or 'compact' to also store
+        each embedded user once in `embedded_users`
+    """
 
     connector_class: typing.Type[connectors.BaseConnector]
 
     fetcher_key_name = {
         'readmes': '_repo_name',
         'events': 'id',
+        'embedded_users': 'id',
+    }
+
+    # Query parameter used to fetch only records updated since a given time
+    fetcher_since_param: typing.Mapping[str, str] = {}
+
+    # Pattern of the owner and repo identifying the data, for content types which are not per-repo
+    fetcher_dedup_key: typing.Mapping[str, str] = {}
+
+    # Fields kept by projection, even though they would otherwise be dropped
+    fetcher_projection_keep = {
+        # Comments refer to their issue only by URL
+        'comments': {'issue_url'},
     }
 
+    # Content type which is the repo itself, used to record repos which are missing or renamed
+    fetcher_repo_type: typing.Optional[str] = None
+
     fetcher_paths: typing.Mapping
 
     @staticmethod
@@ -150,12 +405,31 @@ class Fetcher(abc.ABC):
 
         return response
 
-    def __init__(self, connector_root: typing.Optional[PathLike] = None):
+    def __init__(
+        self,
+        connector_root: typing.Optional[PathLike] = None,
+        *,
+        store: typing.Optional[sinks.ShardStore] = None,
+        projection: str = 'none'
+    ):
         self.connector_root = None
+        self.store = store
+        self.projection = projection
+
+        self._embedded_users: typing.Optional[EmbeddedUsers] = None
+        self._embedded_users_lock = threading.Lock()
 
         if connector_root is not None:
             self.connector_root = pathlib.Path(connector_root)
 
+    def __getstate__(self) -> typing.Dict[str, typing.Any]:
+        # Worker processes only load data, so don't need the store - which can't be pickled
+        state = self.__dict__.copy()
+        state['store'] = None
+        state['_embedded_users'] = None
+        state['_embedded_users_lock'] = None
+        return state
+
     def get_path(self, path: PathLike) -> str:
         try:
             return str(self.connector_root.joinpath(path))
@@ -163,37 +437,167 @@ class Fetcher(abc.ABC):
         except AttributeError:
             return str(path)
 
-    def make(self, fetch_type: str) -> FetcherFunc:
+    def connector_kwargs(self, fetch_type: str) -> typing.Dict[str, typing.Any]:
+        """Get additional arguments for the connector used by a fetcher."""
+        return {}
+
+    def make_connector(self, fetch_type: str) -> connectors.BaseConnector:
         path = self.fetcher_paths[fetch_type]
-        connector = self.connector_class(self.get_path(path))
+        return self.connector_class(self.get_path(path), **self.connector_kwargs(fetch_type))
 
-        collection = db.collection(
-            fetch_type, indexes=[self.fetcher_key_name.get(fetch_type, 'node_id')]
-        )
-        fetcher_kwargs = {}
+    def get_transformer(self, fetch_type: str) -> TransformerFunc:
+        return getattr(self, f'transformer_{fetch_type}', lambda x: x)
+
+    def load(self, fetch_type: str, repo_name: str) -> typing.List[connectors.ConnectorResponseType]:
+        """Fetch and transform the pages of data for a repo without storing them.
+
+        This does not use the database, so may be run in a worker process.
+        """
+        owner, repo = repo_name.split('/')
+        connector = self.make_connector(fetch_type)
+        transformer = self.get_transformer(fetch_type)
+
+        return [transformer(page) for page in connector.iter_pages(owner=owner, repo=repo)]
+
+    def make(
+        self,
+        fetch_type: str,
+        write_buffer: typing.Optional[db.WriteBuffer] = None,
+        repos: typing.Optional[typing.Sequence[str]] = None
+    ) -> FetcherFunc:
+        """Build a fetcher for a content type.
+
+        :param fetch_type: Content type to fetch
+        :param write_buffer: Buffer to batch writes with those of other fetches
+        :param repos: Repos which will be fetched, in order, if known - allows connectors to batch requests
+        """
+        connector = self.make_connector(fetch_type)
+        if repos is not None:
+            connector.plan(repos)
+
+        fetcher_kwargs = {
+            'transformer': self.get_transformer(fetch_type),
+            'write_buffer': write_buffer,
+        }
 
         try:
-            fetcher_kwargs['transformer'] = getattr(self, f'transformer_{fetch_type}')
+            fetcher_kwargs['key_name'] = self.fetcher_key_name[fetch_type]
 
-        except AttributeError:
+        except KeyError:
             pass
 
         try:
-            fetcher_kwargs['key_name'] = self.fetcher_key_name[fetch_type]
+            fetcher_kwargs['since_param'] = self.fetcher_since_param[fetch_type]
 
         except KeyError:
             pass
 
-        return make_fetcher(fetch_type, collection, connector, **fetcher_kwargs)
+        projection = Projection.from_mode(
+            fetch_type, self.projection, keep=self.fetcher_projection_keep.get(fetch_type, ())
+        )
+        if projection is not None:
+            fetcher_kwargs['projection'] = projection
+            fetcher_kwargs['embedded_users'] = self.embedded_users(write_buffer)
+
+        try:
+            fetcher_kwargs['dedup_key'] = self.fetcher_dedup_key[fetch_type]
+            fetcher_kwargs['dedup_ttl'] = config('DEDUP_TTL', default=24 * 60 * 60, cast=float)
+
+        except KeyError:
+            pass
+
+        if fetch_type == self.fetcher_repo_type and self.store is None:
+            fetcher_kwargs['resolve_repos'] = True
+
+        return make_fetcher(fetch_type, self.make_sink(fetch_type, write_buffer), connector, **fetcher_kwargs)
 
-    def make_all(self) -> typing.List[FetcherFunc]:
+    def make_sink(self, fetch_type: str, write_buffer: typing.Optional[db.WriteBuffer] = None) -> sinks.Sink:
+        """Get the sink to store a content type in - the store if there is one, otherwise its MongoDB collection.
+
+        If `SKIP_UNCHANGED` is True, unchanged records are not written to MongoDB again.
+        """
+        if self.store is not None:
+            return self.store.sink(fetch_type)
+
+        key_name = self.fetcher_key_name.get(fetch_type, 'node_id')
+        return sinks.MongoSink(
+            fetch_type,
+            db.collection(fetch_type, indexes=[key_name]),
+            key_name=key_name,
+            write_buffer=write_buffer,
+            skip_unchanged=config('SKIP_UNCHANGED', default=False, cast=bool)
+        )
+
+    def embedded_users(self, write_buffer: typing.Optional[db.WriteBuffer] = None) -> EmbeddedUsers:
+        """Get the store for users removed from records by projection, which is shared by all content types."""
+        with self._embedded_users_lock:
+            if self._embedded_users is None:
+                self._embedded_users = EmbeddedUsers(self.make_sink('embedded_users', write_buffer))
+
+            return self._embedded_users
+
+    def fetched_repos(self, fetch_type: str) -> typing.Set[str]:
+        """Get the names of all repos which have been successfully fetched for a content type."""
+        if self.store is not None:
+            return self.store.sink(fetch_type).fetched_repos()
+
+        return fetched_repos(fetch_type)
+
+    def resolve_repos(self, repos: typing.Iterable[str]) -> typing.List[str]:
+        """Skip repos recorded as missing, and fetch renamed repos by their new name, if this fetcher records them."""
+        if self.fetcher_repo_type is None or self.store is not None:
+            return list(repos)
+
+        return resolve.resolve_repos(repos)
+
+    def make_all(self, write_buffer: typing.Optional[db.WriteBuffer] = None) -> typing.List[FetcherFunc]:
         """Get a list of prepared fetchers for each content type."""
-        return [self.make(fetch_type) for fetch_type in self.fetcher_paths]
+        return [self.make(fetch_type, write_buffer) for fetch_type in self.fetcher_paths]
 
 
 class GitHubFetcher(Fetcher):
+    """Build fetchers which get data from the GitHub API.
+
+    :param connector_root: Unused - the GitHub API has a fixed location
+    :param conditional: Make conditional requests, so unchanged data does not count against the rate limit
+    :param graphql: Fetch repos, users and READMEs in batches using the GraphQL API
+    :param graphql_batch_size: Number of repos in each GraphQL request
+    :param recorder: Cache to record REST API responses in, so they can be replayed by a `ReplayFetcher`
+    :param store: Store to write records to as files - conditional requests are not made, since they use MongoDB
+    :param projection: Projection mode - see `Fetcher`
+    """
     connector_class = connectors.GitHubConnector
 
+    def __init__(
+        self,
+        connector_root: typing.Optional[PathLike] = None,
+        *,
+        conditional: bool = True,
+        graphql: bool = False,
+        graphql_batch_size: int = 50,
+        recorder: typing.Optional[ResponseCache] = None,
+        store: typing.Optional[sinks.ShardStore] = None,
+        projection: str = 'none'
+    ):
+        super().__init__(connector_root, store=store, projection=projection)
+        self.recorder = recorder
+
+        self.validator_cache = None
+        if conditional and store is None:
+            self.validator_cache = connectors.ValidatorCache(db.collection('etags', indexes=['url']))
+
+        self.graphql = graphql
+        self.graphql_batch_size = graphql_batch_size
+
+    def connector_kwargs(self, fetch_type: str) -> typing.Dict[str, typing.Any]:
+        return {'validator_cache': self.validator_cache, 'recorder': self.recorder}
+
+    def make_connector(self, fetch_type: str) -> connectors.BaseConnector:
+        if self.graphql and fetch_type in connectors.GitHubGraphQLConnector.resources:
+            return connectors.GitHubGraphQLConnector(fetch_type, batch_size=self.graphql_batch_size)
+
+        return super().make_connector(fetch_type)
+
     fetcher_paths = {
         'repos': '/repos/{owner}/{repo}',
         'users': '/users/{owner}',
@@ -204,6 +608,53 @@ class GitHubFetcher(Fetcher):
         'commits': '/repos/{owner}/{repo}/commits?per_page=1000',
     }
 
+    # Issues and comments are filtered by update time, but commits by commit time
+    # so commits pushed late with an old commit date will be missed by an incremental fetch
+    fetcher_since_param = {
+        'issues': 'since',
+        'comments': 'since',
+        'commits': 'since',
+    }
+
+    # Users are fetched once per owner, not once per repo
+    fetcher_dedup_key = {
+        'users': '{owner}',
+    }
+
+    # GitHub redirects requests for renamed repos, and reports deleted or private repos as not found
+    fetcher_repo_type = 'repos'
+
+
+class ReplayFetcher(Fetcher):
+    """Build fetchers which replay GitHub API responses recorded by a `GitHubFetcher`, without using the network.
+
+    :param connector_root: Directory of the response cache
+    :param cache: Response cache to use, instead of opening the one in `connector_root`
+    :param store: Store to write records to as files - if None, they are stored in MongoDB
+    :param projection: Projection mode - see `Fetcher`
+    """
+    connector_class = connectors.ReplayConnector
+
+    fetcher_paths = GitHubFetcher.fetcher_paths
+    fetcher_dedup_key = GitHubFetcher.fetcher_dedup_key
+
+    def __init__(
+        self,
+        connector_root: PathLike,
+        *,
+        cache: typing.Optional[ResponseCache] = None,
+        store: typing.Optional[sinks.ShardStore] = None,
+        projection: str = 'none'
+    ):
+        super().__init__(connector_root, store=store, projection=projection)
+        self.cache = ResponseCache(connector_root) if cache is None else cache
+
+    def get_path(self, path: PathLike) -> str:
+        return connectors.github_api_url + str(path).lstrip('/')
+
+    def connector_kwargs(self, fetch_type: str) -> typing.Dict[str, typing.Any]:
+        return {'cache': self.cache}
+
 
 class FileFetcher(Fetcher):
     connector_class = connectors.FileConnector
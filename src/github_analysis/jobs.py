@@ -0,0 +1,192 @@
+import datetime
+import logging
+import os
+import socket
+import typing
+import uuid
+
+import pymongo
+import pymongo.collection
+
+logger = logging.getLogger(__name__)
+
+JobType = typing.Dict[str, typing.Any]
+
+# Job states
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+DEAD = 'dead'
+
+
+def make_worker_id() -> str:
+    """Make an ID for this worker which is unique across machines."""
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+class JobQueue:
+    """Queue of fetch jobs stored in MongoDB, which can be shared by any number of workers.
+
+    Each job fetches one content type for one repo.  A worker leases a job before running it, and
+    must renew the lease with a heartbeat while it runs - if the worker dies, the lease expires and
+    the job can be leased by another worker.  Failed jobs are retried after a delay, until they have
+    been attempted `max_attempts` times, when they are moved to the dead state for inspection.
+
+    :param collection: MongoDB collection to store jobs in
+    :param max_attempts: Number of times a job is attempted before it is dead
+    :param retry_delay: Delay in seconds before the first retry of a failed job, doubling on each retry
+    """
+    indexes = [('state', 'available_at'), 'worker']
+
+    def __init__(
+        self, collection: pymongo.collection.Collection, *, max_attempts: int = 3, retry_delay: float = 60.0
+    ):
+        self._collection = collection
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+    @staticmethod
+    def job_id(repo_name: str, fetch_type: str) -> str:
+        return f'{fetch_type}:{repo_name}'
+
+    def enqueue(self, repos: typing.Iterable[str], fetch_types: typing.Sequence[str], requeue: bool = False) -> int:
+        """Add a job for each content type for each repo, unless it is already queued.
+
+        :param repos: Repos to fetch
+        :param fetch_types: Content types to fetch for each repo
+        :param requeue: Reset existing jobs to pending, including finished and dead jobs
+        :return: Number of jobs added or reset
+        """
+        now = datetime.datetime.utcnow()
+        requests = []
+
+        for repo_name in repos:
+            for fetch_type in fetch_types:
+                fields = {
+                    'state': PENDING,
+                    'attempts': 0,
+                    'available_at': now,
+                    'worker': None,
+                    'lease_expires': None,
+                    'error': None,
+                }
+                identity = {'_repo_name': repo_name, 'fetcher': fetch_type, 'created': now}
+
+                if requeue:
+                    update = {'$set': fields, '$setOnInsert': identity}
+
+                else:
+                    update = {'$setOnInsert': {**fields, **identity}}
+
+                requests.append(
+                    pymongo.UpdateOne({'_id': self.job_id(repo_name, fetch_type)}, update, upsert=True)
+                )
+
+        if not requests:
+            return 0
+
+        result = self._collection.bulk_write(requests, ordered=False)
+        return result.upserted_count + (result.modified_count if requeue else 0)
+
+    def lease(
+        self,
+        worker_id: str,
+        lease_seconds: float,
+        fetch_types: typing.Optional[typing.Collection[str]] = None
+    ) -> typing.Optional[JobType]:
+        """Lease the next available job, including any whose previous lease has expired.
+
+        :param worker_id: ID of the worker taking the job
+        :param lease_seconds: Time until the lease expires, unless renewed by a heartbeat
+        :param fetch_types: Only lease jobs for these content types
+        :return: Leased job, or None if no jobs are available
+        """
+        now = datetime.datetime.utcnow()
+        query = {
+            '$or': [
+                {'state': PENDING, 'available_at': {'$lte': now}},
+                {'state': LEASED, 'lease_expires': {'$lt': now}},
+            ],
+            'attempts': {'$lt': self.max_attempts},
+        }
+        if fetch_types:
+            query['fetcher'] = {'$in': list(fetch_types)}
+
+        return self._collection.find_one_and_update(
+            query,
+            {
+                '$set': {
+                    'state': LEASED,
+                    'worker': worker_id,
+                    'lease_expires': now + datetime.timedelta(seconds=lease_seconds),
+                },
+                '$inc': {'attempts': 1},
+            },
+            sort=[('available_at', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)],
+            return_document=pymongo.ReturnDocument.AFTER
+        )  # yapf: disable
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        """Renew the lease on a job.
+
+        :return: Whether the worker still holds the lease
+        """
+        result = self._collection.update_one(
+            {'_id': job_id, 'state': LEASED, 'worker': worker_id},
+            {'$set': {'lease_expires': datetime.datetime.utcnow() + datetime.timedelta(seconds=lease_seconds)}}
+        )
+        return result.matched_count > 0
+
+    def complete(self, job_id: str, worker_id: str, outcome: typing.Optional[str] = None) -> None:
+        """Mark a leased job as finished."""
+        self._collection.update_one(
+            {'_id': job_id, 'state': LEASED, 'worker': worker_id},
+            {
+                '$set': {
+                    'state': DONE,
+                    'lease_expires': None,
+                    'outcome': outcome,
+                    'finished': datetime.datetime.utcnow(),
+                }
+            }
+        )
+
+    def fail(self, job: JobType, worker_id: str, error: str) -> None:
+        """Record a failed attempt at a job, so it is retried later or is dead if it has no attempts left."""
+        now = datetime.datetime.utcnow()
+
+        if job['attempts'] >= self.max_attempts:
+            logger.error('Job %s failed %d times - marking dead: %s', job['_id'], job['attempts'], error)
+            update = {'state': DEAD, 'error': error, 'lease_expires': None, 'finished': now}
+
+        else:
+            delay = self.retry_delay * 2**(job['attempts'] - 1)
+            logger.warning('Job %s failed - retrying in %ds: %s', job['_id'], delay, error)
+            update = {
+                'state': PENDING,
+                'error': error,
+                'lease_expires': None,
+                'available_at': now + datetime.timedelta(seconds=delay),
+            }
+
+        self._collection.update_one({'_id': job['_id'], 'state': LEASED, 'worker': worker_id}, {'$set': update})
+
+    def reap(self) -> int:
+        """Mark jobs as dead if their lease expired on their last attempt - i.e. their worker died each time.
+
+        :return: Number of jobs marked dead
+        """
+        now = datetime.datetime.utcnow()
+        result = self._collection.update_many(
+            {'state': LEASED, 'lease_expires': {'$lt': now}, 'attempts': {'$gte': self.max_attempts}},
+            {'$set': {'state': DEAD, 'error': 'Lease expired', 'lease_expires': None, 'finished': now}}
+        )
+        return result.modified_count
+
+    def counts(self) -> typing.Dict[str, int]:
+        """Count the jobs in each state."""
+        counts = {state: 0 for state in (PENDING, LEASED, DONE, DEAD)}
+        for row in self._collection.aggregate([{'$group': {'_id': '$state', 'count': {'$sum': 1}}}]):
+            counts[row['_id']] = row['count']
+
+        return counts
@@ -0,0 +1,392 @@
+import bisect
+import contextlib
+import contextvars
+import cProfile
+import functools
+import http.server
+import json
+import logging
+import pathlib
+import pstats
+import threading
+import time
+import tracemalloc
+import typing
+
+logger = logging.getLogger(__name__)
+
+PathLike = typing.Union[str, pathlib.Path]
+LabelsType = typing.Tuple[typing.Tuple[str, str], ...]
+
+# Fetcher being run in the current thread, used to label metrics recorded by connectors
+current_fetcher = contextvars.ContextVar('current_fetcher', default='')
+
+
+def _labels(labels: typing.Mapping[str, typing.Any]) -> LabelsType:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: LabelsType, **extra: str) -> str:
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ''
+
+    return '{' + ','.join(f'{key}="{value}"' for key, value in items) + '}'
+
+
+class Metric:
+    """Base class for a metric with a value for each combination of labels."""
+    kind = 'untyped'
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._lock = threading.Lock()
+        self._values: typing.Dict[LabelsType, typing.Any] = {}
+
+    def render(self) -> typing.List[str]:
+        """Format the metric in the Prometheus text exposition format."""
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(labels)} {value}')
+
+        return lines
+
+    def snapshot(self) -> typing.List[typing.Dict[str, typing.Any]]:
+        with self._lock:
+            return [{'labels': dict(labels), 'value': value} for labels, value in sorted(self._values.items())]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _labels(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(_labels(labels), 0)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[_labels(labels)] = value
+
+
+class Histogram(Metric):
+    """Distribution of observed values, counted in cumulative buckets."""
+    kind = 'histogram'
+
+    default_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name: str, description: str, buckets: typing.Sequence[float] = default_buckets):
+        super().__init__(name, description)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = _labels(labels)
+
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextlib.contextmanager
+    def time(self, **labels) -> typing.Iterator[None]:
+        """Observe the time taken to run a block of code."""
+        start = time.perf_counter()
+        try:
+            yield
+
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> typing.List[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+
+        with self._lock:
+            for labels, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip([*self.buckets, '+Inf'], counts):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{_format_labels(labels, le=str(bound))} {cumulative}')
+
+                lines.append(f'{self.name}_sum{_format_labels(labels)} {total}')
+                lines.append(f'{self.name}_count{_format_labels(labels)} {cumulative}')
+
+        return lines
+
+    def snapshot(self) -> typing.List[typing.Dict[str, typing.Any]]:
+        with self._lock:
+            return [
+                {
+                    'labels': dict(labels),
+                    'count': sum(counts),
+                    'sum': total,
+                    'buckets': dict(zip([*map(str, self.buckets), '+Inf'], counts)),
+                }
+                for labels, (counts, total) in sorted(self._values.items())
+            ]  # yapf: disable
+
+
+class Registry:
+    """Collection of metrics which are exposed together."""
+    def __init__(self):
+        self._metrics: typing.Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(line for metric in self._metrics.values() for line in metric.render()) + '\n'
+
+    def snapshot(self) -> typing.Dict[str, typing.Any]:
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+
+registry = Registry()
+
+stage_seconds = registry.register(
+    Histogram('gha_stage_seconds', 'Time spent in each stage of fetching, by fetcher and stage')
+)
+bytes_parsed = registry.register(Counter('gha_bytes_parsed_total', 'Bytes of response content parsed, by fetcher'))
+documents_written = registry.register(
+    Counter('gha_documents_written_total', 'Documents written to the database, by collection')
+)
+document_changes = registry.register(
+    Counter('gha_document_changes_total', 'Documents fetched, by collection and whether they were new or changed')
+)
+projection_bytes = registry.register(
+    Counter('gha_projection_bytes_total', 'Size of records before and after projection, by collection and stage')
+)
+db_write_seconds = registry.register(
+    Histogram('gha_db_write_seconds', 'Time spent in each batched database write, by collection')
+)
+rate_limit_remaining = registry.register(
+    Gauge('gha_rate_limit_remaining', 'Rate limit budget remaining, by budget')
+)
+sleep_seconds = registry.register(Counter('gha_sleep_seconds_total', 'Time spent waiting, by reason'))
+
+
+def time_stage(stage: str) -> typing.ContextManager[None]:
+    """Time a stage of fetching for the fetcher running in this thread."""
+    return stage_seconds.time(fetcher=current_fetcher.get(), stage=stage)
+
+
+def sleep(seconds: float, reason: str) -> None:
+    """Sleep, recording the time spent waiting."""
+    if seconds > 0:
+        sleep_seconds.inc(seconds, reason=reason)
+        time.sleep(seconds)
+
+
+def instrument(fetcher: str) -> typing.Callable:
+    """Decorate a fetcher so metrics recorded while it runs are labelled with its name, and it is profiled."""
+    def decorator(func: typing.Callable) -> typing.Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            token = current_fetcher.set(fetcher)
+            try:
+                with profile(fetcher):
+                    return func(*args, **kwargs)
+
+            finally:
+                current_fetcher.reset(token)
+
+        return wrapper
+
+    return decorator
+
+
+def timed(func: typing.Callable, stage: str) -> typing.Callable:
+    """Wrap a function so each call is timed as a stage of fetching."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with time_stage(stage):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip('/') != '/metrics':
+            self.send_error(404)
+            return
+
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port: int, host: str = '127.0.0.1') -> http.server.ThreadingHTTPServer:
+    """Serve metrics for Prometheus at `/metrics` from a background thread."""
+    server = http.server.ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    logger.info('Serving metrics at http://%s:%d/metrics', host, server.server_port)
+    return server
+
+
+class SummaryWriter:
+    """Periodically append a snapshot of all metrics to a JSON lines file.
+
+    :param path: File to append to
+    :param interval: Time between snapshots in seconds
+    """
+    def __init__(self, path: PathLike, interval: float = 60.0):
+        self.path = pathlib.Path(path)
+        self.interval = interval
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self) -> None:
+        with open(self.path, 'a') as fp:
+            fp.write(json.dumps({'time': time.time(), 'metrics': registry.snapshot()}) + '\n')
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.write()
+
+
+class Profiler:
+    """Profile each fetcher using cProfile and tracemalloc, writing the results to a directory.
+
+    Only one profiler may be active at once in Python 3.12+, so one fetch at a time is profiled, in the thread
+    which runs it - fetches which start meanwhile in other threads are not profiled, so with several threads
+    the statistics for each fetcher are a sample of its fetches.  Each profile is merged into the statistics
+    for its fetcher as it finishes.
+
+    :param directory: Directory to write profiles to
+    """
+    def __init__(self, directory: PathLike):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._stats: typing.Dict[str, pstats.Stats] = {}
+
+        # Held while a block of code is being profiled
+        self._profiling = threading.Lock()
+
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def profile(self, stage: str) -> typing.Iterator[None]:
+        """Profile the CPU time of a block of code in this thread, unless another block is being profiled."""
+        if not self._profiling.acquire(blocking=False):
+            yield
+            return
+
+        profile = cProfile.Profile()
+
+        try:
+            profile.enable()
+
+        except ValueError:
+            # Another profiling tool is active
+            self._profiling.release()
+            yield
+            return
+
+        try:
+            yield
+
+        finally:
+            profile.disable()
+            self._profiling.release()
+
+            with self._lock:
+                if stage in self._stats:
+                    self._stats[stage].add(profile)
+
+                else:
+                    self._stats[stage] = pstats.Stats(profile)
+
+    @contextlib.contextmanager
+    def memory(self, stage: str) -> typing.Iterator[None]:
+        """Record the memory allocated by all threads while running a block of code."""
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+
+        try:
+            yield
+
+        finally:
+            after = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+
+            with open(self.directory.joinpath(f'{stage}.memory.txt'), 'w') as fp:
+                fp.write(f'Peak traced memory: {peak / 1024**2:.1f} MB\n\n')
+                for stat in after.compare_to(before, 'lineno')[:25]:
+                    fp.write(f'{stat}\n')
+
+    def write(self) -> None:
+        """Write the combined CPU profile of each stage, as a pstats file and a text summary."""
+        with self._lock:
+            for stage, stats in self._stats.items():
+                stats.dump_stats(self.directory.joinpath(f'{stage}.prof'))
+
+                with open(self.directory.joinpath(f'{stage}.txt'), 'w') as fp:
+                    stats.stream = fp
+                    stats.sort_stats('cumulative').print_stats(40)
+
+        logger.info('Wrote profiles to %s', self.directory)
+
+    def close(self) -> None:
+        """Write the profiles and stop tracing memory allocations."""
+        self.write()
+
+        if self._started_tracing:
+            tracemalloc.stop()
+
+
+_profiler: typing.Optional[Profiler] = None
+
+
+def enable_profiling(directory: PathLike) -> Profiler:
+    global _profiler
+
+    _profiler = Profiler(directory)
+    return _profiler
+
+
+def profile(stage: str) -> typing.ContextManager[None]:
+    """Profile the CPU time of a block of code, if profiling is enabled."""
+    if _profiler is None:
+        return contextlib.nullcontext()
+
+    return _profiler.profile(stage)
+
+
+def profile_memory(stage: str) -> typing.ContextManager[None]:
+    """Record the memory allocated while running a block of code, if profiling is enabled."""
+    if _profiler is None:
+        return contextlib.nullcontext()
+
+    return _profiler.memory(stage)
@@ -0,0 +1,134 @@
+"""Store documents which are larger than the MongoDB maximum document size.
+
+The largest fields of an oversized document are zlib compressed, one at a time, until it fits.  If it
+still does not fit, all of its fields other than those which identify it are moved into a compressed
+GridFS file.  Either way, the stored document has an `_overflow` field describing what was moved, and
+`restore_document` reverses this.  Files stored for previous versions of a document are only removed by
+`delete_superseded`, once the new version has been written, so the stored document always has its file.
+"""
+import logging
+import typing
+import zlib
+
+import bson
+from bson.binary import Binary
+import gridfs
+import pymongo.collection
+import pymongo.database
+
+logger = logging.getLogger(__name__)
+
+DocumentType = typing.Dict[str, typing.Any]
+
+MAX_DOCUMENT_SIZE = 16 * 1024**2
+
+# Leave room for the `_overflow` field and the rest of the write command
+MAX_INLINE_SIZE = MAX_DOCUMENT_SIZE - 64 * 1024
+
+OVERFLOW_FIELD = '_overflow'
+GRIDFS_BUCKET = 'overflow'
+
+# Fields which are never moved out of a document, since they are used to find it
+KEPT_FIELDS = {'_id', '_repo_name', '_content_hash', 'sets'}
+
+
+def _compress(value: typing.Any) -> Binary:
+    return Binary(zlib.compress(bson.encode({'v': value})))
+
+
+def _decompress(data: bytes) -> typing.Any:
+    return bson.decode(zlib.decompress(data))['v']
+
+
+def fit_document(
+    doc: DocumentType,
+    collection: pymongo.collection.Collection,
+    key_name: str,
+    size: typing.Optional[int] = None,
+    max_size: typing.Optional[int] = None
+) -> DocumentType:
+    """Get a version of a document which fits within the maximum document size.
+
+    :param doc: Document to store
+    :param collection: Collection the document will be stored in - GridFS files are stored alongside it
+    :param key_name: Field which identifies the document, which is kept in the stored document
+    :param size: Encoded size of the document, if already known
+    :param max_size: Maximum encoded size of the stored document - defaults to `MAX_INLINE_SIZE`
+    :return: The document if it fits, otherwise a copy with its largest fields moved
+    """
+    if size is None:
+        size = len(bson.encode(doc))
+
+    if max_size is None:
+        max_size = MAX_INLINE_SIZE
+
+    if size <= max_size:
+        return doc
+
+    kept = KEPT_FIELDS.union({key_name})
+    movable = [field for field in doc if field not in kept]
+    field_sizes = {field: len(bson.encode({'v': doc[field]})) for field in movable}
+
+    fitted = dict(doc)
+    compressed = {}
+
+    for field in sorted(movable, key=field_sizes.get, reverse=True):
+        value = _compress(fitted.pop(field))
+        compressed[field] = value
+        size += len(value) - field_sizes[field]
+
+        if size <= max_size:
+            logger.warning(
+                'Document %s in %s is too large - compressed fields: %s', doc.get(key_name), collection.name,
+                ', '.join(compressed)
+            )
+            fitted[OVERFLOW_FIELD] = {'compressed': compressed}
+            return fitted
+
+    # Even compressed the document does not fit, so move everything which can be into GridFS
+    bucket = gridfs.GridFSBucket(collection.database, bucket_name=GRIDFS_BUCKET)
+    filename = f'{collection.name}/{doc.get(key_name)}'
+    content = zlib.compress(bson.encode({field: doc[field] for field in movable}))
+
+    file_id = bucket.upload_from_stream(filename, content)
+    logger.warning('Document %s in %s is too large - stored in GridFS', doc.get(key_name), collection.name)
+
+    fitted = {field: doc[field] for field in doc if field in kept}
+    fitted[OVERFLOW_FIELD] = {'gridfs': file_id, 'fields': movable}
+    return fitted
+
+
+def delete_superseded(doc: DocumentType, collection: pymongo.collection.Collection, key_name: str) -> None:
+    """Remove the GridFS files stored for previous versions of a document, once it has been written.
+
+    :param doc: Document as stored, returned by `fit_document`
+    :param collection: Collection the document was stored in
+    :param key_name: Field which identifies the document
+    """
+    file_id = doc.get(OVERFLOW_FIELD, {}).get('gridfs')
+    if file_id is None:
+        return
+
+    bucket = gridfs.GridFSBucket(collection.database, bucket_name=GRIDFS_BUCKET)
+    filename = f'{collection.name}/{doc.get(key_name)}'
+
+    for old in bucket.find({'filename': filename, '_id': {'$ne': file_id}}):
+        bucket.delete(old._id)
+
+
+def restore_document(doc: DocumentType, database: pymongo.database.Database) -> DocumentType:
+    """Get the full version of a document stored by `fit_document`, reading moved fields back."""
+    overflow = doc.get(OVERFLOW_FIELD)
+    if overflow is None:
+        return doc
+
+    restored = {field: value for field, value in doc.items() if field != OVERFLOW_FIELD}
+
+    for field, value in overflow.get('compressed', {}).items():
+        restored[field] = _decompress(value)
+
+    if 'gridfs' in overflow:
+        bucket = gridfs.GridFSBucket(database, bucket_name=GRIDFS_BUCKET)
+        restored.update(bson.decode(zlib.decompress(bucket.open_download_stream(overflow['gridfs']).read())))
+
+    return restored
@@ -0,0 +1,164 @@
+from concurrent.futures import Future
+import datetime
+import logging
+import threading
+import typing
+
+import bson
+
+from github_analysis import connectors, metrics, sinks
+
+logger = logging.getLogger(__name__)
+
+RecordType = typing.Dict[str, typing.Any]
+
+# Projection modes which may be selected for a run
+MODES = ('none', 'drop-urls', 'compact')
+
+
+def is_user(value: typing.Any) -> bool:
+    """Is a value a GitHub user or organisation object?
+
+    Users embedded in events don't have all the fields of other users, so only check for those they do.
+    """
+    return isinstance(value, dict) and all(field in value for field in ('login', 'id', 'avatar_url'))
+
+
+class Projection:
+    """Remove redundant fields from records before they are stored.
+
+    Records from the GitHub REST API contain many hypermedia URLs, and a full copy of each user they refer to -
+    the owner of a repo, the author of a commit or comment, and so on.  URL fields (`url` and `*_url`) can be
+    dropped, and embedded users replaced by their ID, so each user can be stored once rather than in every record.
+
+    :param name: Name of the fetcher, used to report the space saved
+    :param drop_urls: Drop URL fields
+    :param reduce_users: Replace users embedded in records by their ID
+    :param keep: Fields to keep, even if they are URL fields
+    """
+    default_keep = {'html_url'}
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        drop_urls: bool = True,
+        reduce_users: bool = True,
+        keep: typing.Collection[str] = ()
+    ):
+        self.name = name
+        self.drop_urls = drop_urls
+        self.reduce_users = reduce_users
+        self.keep = self.default_keep.union(keep)
+
+    @classmethod
+    def from_mode(cls, name: str, mode: str, keep: typing.Collection[str] = ()) -> typing.Optional['Projection']:
+        """Get the projection for a mode selected for a run - or None if records are stored as they are."""
+        if mode not in MODES:
+            raise ValueError(f'Unknown projection mode: {mode}')
+
+        if mode == 'none':
+            return None
+
+        return cls(name, reduce_users=mode == 'compact', keep=keep)
+
+    def is_dropped(self, field: str) -> bool:
+        return self.drop_urls and (field == 'url' or field.endswith('_url')) and field not in self.keep
+
+    def _project(self, value: typing.Any, users: typing.Dict[int, RecordType], embedded: bool) -> typing.Any:
+        if isinstance(value, list):
+            return [self._project(item, users, embedded) for item in value]
+
+        if not isinstance(value, dict):
+            return value
+
+        if embedded and self.reduce_users and is_user(value):
+            users[value['id']] = self._project(value, users, False)
+            return value['id']
+
+        return {
+            field: self._project(item, users, True)
+            for field, item in value.items() if not self.is_dropped(field)
+        }  # yapf: disable
+
+    def apply(
+        self, response: connectors.ConnectorResponseType
+    ) -> typing.Tuple[connectors.ConnectorResponseType, typing.List[RecordType]]:
+        """Project a record, or each record in a list.
+
+        :return: Projected response, and the users which were embedded in it
+        """
+        users = {}
+        projected = self._project(response, users, False)
+
+        records = [response] if isinstance(response, dict) else response
+        projected_records = [projected] if isinstance(projected, dict) else projected
+
+        metrics.projection_bytes.inc(
+            sum(len(bson.encode(record)) for record in records), collection=self.name, stage='original'
+        )
+        metrics.projection_bytes.inc(
+            sum(len(bson.encode(record)) for record in projected_records), collection=self.name, stage='projected'
+        )
+
+        return projected, list(users.values())
+
+
+class EmbeddedUsers:
+    """Store each user removed from records by a `Projection` once per run.
+
+    Each user is stored with the repo it was first found in, which is recorded as fetched once the fetch of
+    the repo is complete, so the users are included when reading a `ShardStore`.
+
+    :param sink: Sink to store users in
+    """
+    def __init__(self, sink: sinks.Sink):
+        self.sink = sink
+
+        self._lock = threading.Lock()
+        self._stored: typing.Set[int] = set()
+
+        # Repos with users stored which have not yet been recorded as fetched
+        self._unmarked: typing.Set[str] = set()
+
+    def add(self, users: typing.Iterable[RecordType], repo_name: str) -> typing.Optional[Future]:
+        """Store the users which have not already been stored by this run.
+
+        :return: Future resolved once the users have been written, if writes are buffered
+        """
+        with self._lock:
+            new_users = [{**user, '_repo_name': repo_name} for user in users if user['id'] not in self._stored]
+            self._stored.update(user['id'] for user in new_users)
+
+            if new_users:
+                self._unmarked.add(repo_name)
+
+        if not new_users:
+            return None
+
+        metrics.projection_bytes.inc(
+            sum(len(bson.encode(user)) for user in new_users), collection='embedded_users', stage='projected'
+        )
+
+        write = self.sink.write(new_users, repo_name)
+
+        if write is not None:
+            # Users which could not be written may be stored with a later repo
+            def written(done: Future) -> None:
+                if done.exception() is not None:
+                    with self._lock:
+                        self._stored.difference_update(user['id'] for user in new_users)
+
+            write.add_done_callback(written)
+
+        return write
+
+    def mark_fetched(self, repo_name: str, started: datetime.datetime) -> None:
+        """Record that the users found in a repo have been stored, once its fetch is complete."""
+        with self._lock:
+            if repo_name not in self._unmarked:
+                return
+
+            self._unmarked.discard(repo_name)
+
+        self.sink.mark_fetched(repo_name, started, 'projection')
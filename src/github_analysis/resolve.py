@@ -0,0 +1,162 @@
+"""Track repos which no longer exist, or have been renamed, so later runs skip or redirect them.
+
+The outcome is recorded in the `resolution` field of each repo's status when the repo itself is fetched -
+either `missing`, if GitHub reports it gone, or `renamed` with the canonical name GitHub redirected to.
+Entries expire after a TTL, after which the repo is tried again under its original name.
+"""
+import datetime
+import logging
+import threading
+import typing
+
+from decouple import config
+import pymongo
+
+from github_analysis import db
+
+logger = logging.getLogger(__name__)
+
+ResolutionType = typing.Dict[str, typing.Any]
+
+STATUS_FIELD = 'resolution'
+MISSING = 'missing'
+RENAMED = 'renamed'
+
+# Statuses which show a repo is gone, rather than a failure of the request - deleted, made private, or blocked
+GONE_STATUS_CODES = {404, 410, 451}
+
+# Repos known to have an entry, which must be cleared when they are found under their original name - so
+# fetching repos without entries, as most are, needs no write
+_recorded: typing.Set[str] = set()
+_recorded_lock = threading.Lock()
+
+
+def default_ttl() -> datetime.timedelta:
+    return datetime.timedelta(seconds=config('MISSING_REPO_TTL', default=7 * 24 * 60 * 60, cast=float))
+
+
+def _update(request: pymongo.UpdateOne, write_buffer: typing.Optional[db.WriteBuffer] = None) -> None:
+    status_collection = db.collection('status')
+
+    if write_buffer is not None:
+        write_buffer.add(status_collection, [request])
+        return
+
+    status_collection.bulk_write([request])
+
+
+def _record(repo_name: str, resolution: ResolutionType, write_buffer: typing.Optional[db.WriteBuffer] = None) -> None:
+    with _recorded_lock:
+        _recorded.add(repo_name)
+
+    _update(
+        pymongo.UpdateOne({'_repo_name': repo_name}, {
+            '$set': {
+                STATUS_FIELD: {**resolution, 'checked': datetime.datetime.utcnow()},
+            },
+        }, upsert=True), write_buffer
+    )  # yapf: disable
+
+
+def record_missing(repo_name: str, write_buffer: typing.Optional[db.WriteBuffer] = None) -> None:
+    """Record that a repo no longer exists.
+
+    :param repo_name: Name the repo was fetched by
+    :param write_buffer: Buffer to batch the write with those of other fetches - if None, write immediately
+    """
+    logger.warning('Repo %s no longer exists - it will be skipped until the entry expires', repo_name)
+    _record(repo_name, {'state': MISSING}, write_buffer)
+
+
+def record_found(
+    repo_name: str, full_name: typing.Optional[str], write_buffer: typing.Optional[db.WriteBuffer] = None
+) -> None:
+    """Record the canonical name of a repo which was fetched, clearing any previous entry if it is unchanged.
+
+    Only entries found by `resolve_repos`, or recorded in this process, are cleared - so nothing is written
+    for repos without an entry.
+
+    :param repo_name: Name the repo was fetched by
+    :param full_name: Name of the repo in the fetched record
+    :param write_buffer: Buffer to batch the write with those of other fetches - if None, write immediately
+    """
+    if full_name is not None and full_name != repo_name:
+        logger.warning('Repo %s has been renamed to %s', repo_name, full_name)
+        _record(repo_name, {'state': RENAMED, 'full_name': full_name}, write_buffer)
+
+    elif repo_name in _recorded:
+        with _recorded_lock:
+            _recorded.discard(repo_name)
+
+        _update(pymongo.UpdateOne({'_repo_name': repo_name}, {'$unset': {STATUS_FIELD: True}}), write_buffer)
+
+
+def lookup(
+    repos: typing.Iterable[str],
+    ttl: typing.Optional[datetime.timedelta] = None,
+    chunk_size: int = 1000
+) -> typing.Dict[str, ResolutionType]:
+    """Get the entries recorded for repos which are missing or renamed.
+
+    :param repos: Repos to look up
+    :param ttl: Ignore entries older than this - if None, get all entries
+    :param chunk_size: Number of repos in each query
+    :return: Entry for each repo which has one
+    """
+    status_collection = db.collection('status')
+    repos = list(repos)
+    entries = {}
+
+    query = {STATUS_FIELD: {'$exists': True}}
+    if ttl is not None:
+        query = {f'{STATUS_FIELD}.checked': {'$gt': datetime.datetime.utcnow() - ttl}}
+
+    for start in range(0, len(repos), chunk_size):
+        chunk_query = {'_repo_name': {'$in': repos[start:start + chunk_size]}, **query}
+        projection = {'_id': False, '_repo_name': True, STATUS_FIELD: True}
+
+        for status in status_collection.find(chunk_query, projection=projection):
+            entries[status['_repo_name']] = status[STATUS_FIELD]
+
+    return entries
+
+
+def resolve_repos(
+    repos: typing.Iterable[str], ttl: typing.Optional[datetime.timedelta] = None
+) -> typing.List[str]:
+    """Remove missing repos from a list and replace renamed repos by their canonical name.
+
+    :param repos: Repos to resolve
+    :param ttl: Ignore entries older than this - defaults to `MISSING_REPO_TTL` seconds
+    :return: Resolved repos, in the same order, without duplicates
+    """
+    repos = list(repos)
+    entries = lookup(repos)
+
+    with _recorded_lock:
+        _recorded.update(entries)
+
+    # Expired entries are kept until the repo is fetched again, so they can be cleared if it is found
+    expires = datetime.datetime.utcnow() - (default_ttl() if ttl is None else ttl)
+    entries = {repo: entry for repo, entry in entries.items() if entry['checked'] > expires}
+
+    resolved = {}
+    missing = renamed = 0
+
+    for repo in repos:
+        entry = entries.get(repo, {})
+
+        if entry.get('state') == MISSING:
+            missing += 1
+            continue
+
+        if entry.get('state') == RENAMED:
+            renamed += 1
+            repo = entry['full_name']
+
+        resolved[repo] = None
+
+    if missing or renamed:
+        logger.info('Skipping %d missing repos and fetching %d renamed repos by their new name', missing, renamed)
+
+    return list(resolved)
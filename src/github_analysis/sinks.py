@@ -0,0 +1,608 @@
+import abc
+from concurrent.futures import Future
+import datetime
+import gzip
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import threading
+import typing
+import uuid
+
+import bson
+from decouple import config
+import pymongo
+import pymongo.collection
+from pymongo.errors import DocumentTooLarge
+
+from github_analysis import connectors, db, metrics, overflow
+
+logger = logging.getLogger(__name__)
+
+PathLike = typing.Union[str, pathlib.Path]
+RecordType = typing.Dict[str, typing.Any]
+
+FORMATS = ('jsonl', 'parquet')
+
+# Hash of the content of a record as fetched, used to skip rewriting records which have not changed
+CONTENT_HASH_FIELD = '_content_hash'
+
+
+class CouldNotStoreData(Exception):
+    pass
+
+
+class Sink(abc.ABC):
+    """Storage for the records fetched by one fetcher, and the status of each repo it has fetched."""
+    @abc.abstractmethod
+    def write(self, response: connectors.ConnectorResponseType, repo_name: str) -> typing.Optional[Future]:
+        """Store a record or multiple records for a response.
+
+        :return: Future resolved once the records have been written, if writes are buffered
+        """
+
+    @abc.abstractmethod
+    def mark_fetched(
+        self, repo_name: str, started: datetime.datetime, connector_name: str, key: typing.Optional[str] = None
+    ) -> None:
+        """Record that data for a repo has been successfully fetched and stored.
+
+        :param key: Deduplication key of the data, if it is shared by other repos - e.g. the owner
+        """
+
+    @abc.abstractmethod
+    def last_fetched(self, repo_name: str) -> typing.Optional[datetime.datetime]:
+        """Get the time at which the last successful fetch for a repo started, in UTC."""
+
+    @abc.abstractmethod
+    def last_fetched_key(self, key: str) -> typing.Optional[datetime.datetime]:
+        """Get the time at which the last successful fetch for any repo with a deduplication key started, in UTC."""
+
+    @abc.abstractmethod
+    def fetched_repos(self) -> typing.Set[str]:
+        """Get the names of all repos which have been successfully fetched."""
+
+    def is_fetched(self, repo_name: str) -> bool:
+        return self.last_fetched(repo_name) is not None
+
+
+class MongoSink(Sink):
+    """Store records in a MongoDB collection and the status of each repo in the `status` collection.
+
+    Each record is stored with a hash of its content, so that records which have not changed since they
+    were last fetched need not be written again.  Records which are too large to store as a single
+    document are stored using `overflow.fit_document`, so they don't prevent the rest being stored.
+
+    :param name: Name of the fetcher
+    :param collection: Collection to store records in
+    :param key_name: Field which identifies a record, used to replace existing records
+    :param write_buffer: Buffer to batch writes with those of other fetches - if None, write immediately
+    :param skip_unchanged: Only write records which are new or have changed - requires a query for each page
+    """
+    def __init__(
+        self,
+        name: str,
+        collection: pymongo.collection.Collection,
+        *,
+        key_name: str = 'node_id',
+        write_buffer: typing.Optional[db.WriteBuffer] = None,
+        skip_unchanged: bool = False
+    ):
+        self.name = name
+        self.collection = collection
+        self.key_name = key_name
+        self.write_buffer = write_buffer
+        self.skip_unchanged = skip_unchanged
+
+        self.status_collection = db.collection('status', indexes=[name])
+
+    def prepare(self, record: RecordType) -> typing.Tuple[RecordType, int]:
+        """Add a hash of the content of a record.
+
+        :return: Record with its hash, and its approximate encoded size
+        """
+        if CONTENT_HASH_FIELD in record:
+            record = {key: value for key, value in record.items() if key != CONTENT_HASH_FIELD}
+
+        content = bson.encode(record)
+        return {**record, CONTENT_HASH_FIELD: hashlib.sha1(content).hexdigest()}, len(content) + 64
+
+    def delete_superseded(self, records: typing.Sequence[RecordType]) -> None:
+        """Remove GridFS files for previous versions of records, once the new versions have been written."""
+        for record in records:
+            overflow.delete_superseded(record, self.collection, self.key_name)
+
+    def changed(self, records: typing.Sequence[RecordType]) -> typing.List[RecordType]:
+        """Get the records which are new or differ from those stored, counting each outcome."""
+        key_name = self.key_name
+        cursor = self.collection.find({key_name: {
+            '$in': [record[key_name] for record in records]
+        }}, projection={
+            '_id': False,
+            key_name: True,
+            CONTENT_HASH_FIELD: True
+        })
+        stored = {doc[key_name]: doc.get(CONTENT_HASH_FIELD) for doc in cursor}
+
+        changed = []
+        for record in records:
+            key = record[key_name]
+
+            if key not in stored:
+                change = 'inserted'
+
+            elif stored[key] != record[CONTENT_HASH_FIELD]:
+                change = 'changed'
+
+            else:
+                change = 'unchanged'
+
+            metrics.document_changes.inc(collection=self.collection.name, change=change)
+            if change != 'unchanged':
+                changed.append(record)
+
+        return changed
+
+    def write(self, response: connectors.ConnectorResponseType, repo_name: str) -> typing.Optional[Future]:
+        key_name = self.key_name
+        collection = self.collection
+
+        if isinstance(response, dict):
+            if key_name not in response:
+                logger.warning('Response did not contain expected key: %s', key_name)
+                return None
+
+            records = [response]
+
+        elif isinstance(response, list) and len(response) > 0:
+            records = response
+
+        else:
+            return None
+
+        prepared = [self.prepare(record) for record in records]
+        sizes = {record[key_name]: size for record, size in prepared}
+
+        # Unchanged records are skipped before any are moved to GridFS, which would replace their stored files
+        records = [record for record, _ in prepared]
+        if self.skip_unchanged:
+            records = self.changed(records)
+            if not records:
+                return None
+
+        records = [
+            overflow.fit_document(record, collection, key_name, size=sizes[record[key_name]]) for record in records
+        ]
+        overflowed = [record for record in records if overflow.OVERFLOW_FIELD in record]
+
+        requests = [pymongo.ReplaceOne({key_name: item[key_name]}, item, upsert=True) for item in records]
+        if self.write_buffer is not None:
+            future = self.write_buffer.add(collection, requests)
+
+            def written(done: Future) -> None:
+                if done.exception() is None:
+                    self.delete_superseded(overflowed)
+
+            if overflowed:
+                future.add_done_callback(written)
+
+            return future
+
+        try:
+            if isinstance(response, dict):
+                collection.replace_one({key_name: records[0][key_name]}, records[0], upsert=True)
+
+            else:
+                collection.bulk_write(requests, ordered=False)
+
+            metrics.documents_written.inc(len(requests), collection=collection.name)
+            self.delete_superseded(overflowed)
+
+        except DocumentTooLarge as exc:
+            logger.error('Data did not fit within maximum record size')
+            raise CouldNotStoreData() from exc
+
+        return None
+
+    def mark_fetched(
+        self, repo_name: str, started: datetime.datetime, connector_name: str, key: typing.Optional[str] = None
+    ) -> None:
+        query = {'_repo_name': repo_name}
+        update = {
+            '$currentDate': {
+                f'{self.name}.timestamp': {
+                    '$type': 'timestamp'
+                },
+            },
+            '$set': {
+                f'{self.name}.connector': connector_name,
+                f'{self.name}.started': started,
+            }
+        }
+
+        if key is not None:
+            update['$set'][f'{self.name}.key'] = key
+
+        if self.write_buffer is not None:
+            self.write_buffer.add(self.status_collection, [pymongo.UpdateOne(query, update, upsert=True)])
+            return
+
+        self.status_collection.update_one(query, update, upsert=True)
+
+    def last_fetched(self, repo_name: str) -> typing.Optional[datetime.datetime]:
+        name = self.name
+        status = self.status_collection.find_one({
+            '_repo_name': repo_name,
+            name: {
+                '$exists': True
+            },
+        }, projection={name: True})
+
+        if status is None:
+            return None
+
+        try:
+            return status[name]['started']
+
+        except KeyError:
+            # Status recorded before start times were - the end of the fetch is the best we have
+            return status[name]['timestamp'].as_datetime().replace(tzinfo=None)
+
+    def last_fetched_key(self, key: str) -> typing.Optional[datetime.datetime]:
+        key_field = f'{self.name}.key'
+        status_collection = db.collection('status', indexes=[key_field])
+
+        latest_first = [(f'{self.name}.started', pymongo.DESCENDING)]
+        status = status_collection.find_one({key_field: key}, projection={self.name: True}, sort=latest_first)
+
+        if status is None:
+            return None
+
+        return status[self.name]['started']
+
+    def is_fetched(self, repo_name: str) -> bool:
+        return self.status_collection.count_documents({
+            '_repo_name': repo_name,
+            self.name: {
+                '$exists': True
+            },
+        }, limit=1) > 0
+
+    def fetched_repos(self) -> typing.Set[str]:
+        cursor = self.status_collection.find({self.name: {
+            '$exists': True
+        }}, projection={
+            '_id': False,
+            '_repo_name': True
+        })
+
+        return {status['_repo_name'] for status in cursor}
+
+
+class JsonLinesShard:
+    """Shard of records written as gzip compressed JSON lines as they arrive."""
+    suffix = '.jsonl.gz'
+
+    def __init__(self, path: pathlib.Path):
+        self._fp = gzip.open(path, 'wt', encoding='utf-8')
+
+    def write(self, records: typing.Sequence[RecordType]) -> int:
+        lines = ''.join(json.dumps(record, default=str) + '\n' for record in records)
+        self._fp.write(lines)
+        return len(lines)
+
+    def close(self) -> None:
+        self._fp.close()
+
+
+class ParquetShard:
+    """Shard of records written as a zstd compressed Parquet file.
+
+    The schema of a Parquet file is fixed, so records are held in memory until the shard is closed and
+    written with a schema inferred from all of them.  If the records have incompatible types, each is
+    stored as a JSON string instead, alongside the repo it belongs to.
+    """
+    suffix = '.parquet'
+
+    def __init__(self, path: pathlib.Path):
+        try:
+            import pyarrow  # noqa: F401 pylint: disable=import-outside-toplevel,unused-import
+
+        except ImportError as exc:
+            raise RuntimeError('Writing Parquet shards requires pyarrow - install with `pip install pyarrow`') from exc
+
+        self.path = path
+        self._records: typing.List[RecordType] = []
+
+    def write(self, records: typing.Sequence[RecordType]) -> int:
+        self._records.extend(records)
+        return sum(len(json.dumps(record, default=str)) for record in records)
+
+    def close(self) -> None:
+        import pyarrow  # pylint: disable=import-outside-toplevel
+        import pyarrow.parquet  # pylint: disable=import-outside-toplevel
+
+        try:
+            table = pyarrow.Table.from_pylist(self._records)
+
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError) as exc:
+            logger.warning('Records in %s have inconsistent types, storing as JSON: %s', self.path, exc)
+            table = pyarrow.Table.from_pydict({
+                '_repo_name': [record.get('_repo_name') for record in self._records],
+                '_json': [json.dumps(record, default=str) for record in self._records],
+            })
+
+        pyarrow.parquet.write_table(table, self.path, compression='zstd')
+        self._records = []
+
+
+class ShardSink(Sink):
+    """Append the records fetched by one fetcher to rotating shards in a `ShardStore`.
+
+    A repo is only recorded as fetched in the manifest once every shard containing its records has
+    been closed, so a repo whose fetch failed or was interrupted is fetched again by `--skip-existing`.
+    """
+    def __init__(self, store: 'ShardStore', name: str):
+        self.store = store
+        self.name = name
+        self.directory = store.root.joinpath(f'fetcher={name}', f'set={store.set_name}')
+
+        self._lock = threading.Lock()
+        self._shard = None
+        self._shard_path: typing.Optional[pathlib.Path] = None
+        self._shard_records = 0
+        self._shard_bytes = 0
+        self._sequence = 0
+
+        # Shards containing records for each repo currently being fetched
+        self._repo_shards: typing.Dict[str, typing.Set[str]] = {}
+        # Repos fetched whose records are in the open shard - recorded once it is closed
+        self._pending: typing.List[RecordType] = []
+
+    def write(self, response: connectors.ConnectorResponseType, repo_name: str) -> typing.Optional[Future]:
+        records = [response] if isinstance(response, dict) else response
+        if not records:
+            return None
+
+        with self._lock:
+            if self._shard is None:
+                self._open_shard()
+
+            self._shard_bytes += self._shard.write(records)
+            self._shard_records += len(records)
+            self._repo_shards.setdefault(repo_name, set()).add(self.store.relative(self._shard_path))
+
+            metrics.documents_written.inc(len(records), collection=self.name)
+
+            if self._shard_records >= self.store.max_records or self._shard_bytes >= self.store.max_bytes:
+                self._close_shard()
+
+        return None
+
+    def mark_fetched(
+        self, repo_name: str, started: datetime.datetime, connector_name: str, key: typing.Optional[str] = None
+    ) -> None:
+        with self._lock:
+            entry = {
+                'type': 'repo',
+                'fetcher': self.name,
+                'set': self.store.set_name,
+                'repo': repo_name,
+                'started': started.isoformat(),
+                'connector': connector_name,
+                'key': key,
+                'shards': sorted(self._repo_shards.pop(repo_name, ())),
+            }
+
+            if self._shard_path is not None and self.store.relative(self._shard_path) in entry['shards']:
+                self._pending.append(entry)
+                return
+
+        self.store.append_manifest([entry])
+
+    def last_fetched(self, repo_name: str) -> typing.Optional[datetime.datetime]:
+        return self.store.fetched(self.name).get(repo_name)
+
+    def last_fetched_key(self, key: str) -> typing.Optional[datetime.datetime]:
+        return self.store.fetched(self.name, by_key=True).get(key)
+
+    def fetched_repos(self) -> typing.Set[str]:
+        return set(self.store.fetched(self.name))
+
+    def _open_shard(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._sequence += 1
+
+        shard_class = self.store.shard_class
+        self._shard_path = self.directory.joinpath(
+            f'part-{self.store.run_id}-{self._sequence:05d}{shard_class.suffix}'
+        )
+        self._shard = shard_class(self._partial_path(self._shard_path))
+        self._shard_records = 0
+        self._shard_bytes = 0
+
+    @staticmethod
+    def _partial_path(path: pathlib.Path) -> pathlib.Path:
+        return path.with_name(path.name + '.part')
+
+    def _close_shard(self) -> None:
+        """Close the open shard, then record it and the repos completed in it in the manifest."""
+        self._shard.close()
+        os.replace(self._partial_path(self._shard_path), self._shard_path)
+
+        shard_entry = {
+            'type': 'shard',
+            'fetcher': self.name,
+            'set': self.store.set_name,
+            'path': self.store.relative(self._shard_path),
+            'records': self._shard_records,
+            'bytes': self._shard_path.stat().st_size,
+        }
+        logger.info('Closed shard %s with %d records', shard_entry['path'], self._shard_records)
+
+        self.store.append_manifest([shard_entry, *self._pending])
+        self._pending = []
+        self._shard = None
+        self._shard_path = None
+
+    def close(self) -> None:
+        with self._lock:
+            if self._shard is not None:
+                self._close_shard()
+
+
+class ShardStore:
+    """Store fetched records as compressed JSON lines or Parquet shards, without a database.
+
+    Shards are partitioned by fetcher and set as `fetcher=<name>/set=<set>/part-<run>-<n>.<format>`,
+    and a new shard is started once the current one reaches `max_records` records or `max_bytes`
+    bytes of uncompressed JSON.  Shards are written to a `.part` file and renamed once complete.
+
+    The append-only `manifest.jsonl` records each complete shard, and each repo fetched along with the
+    shards which contain its records.  Records in a shard which belong to a repo not listed with that
+    shard are from an incomplete fetch and should be ignored - `iter_records` does this.
+
+    :param root: Directory to store shards in
+    :param set_name: Name of the set of repos being fetched
+    :param output_format: Format of shards - 'jsonl' or 'parquet'
+    :param max_records: Number of records in a shard before starting a new one
+    :param max_bytes: Size of the records in a shard, as JSON, before starting a new one
+    """
+    manifest_name = 'manifest.jsonl'
+
+    def __init__(
+        self,
+        root: PathLike,
+        set_name: str = 'default',
+        output_format: str = 'jsonl',
+        *,
+        max_records: typing.Optional[int] = None,
+        max_bytes: typing.Optional[int] = None
+    ):
+        if output_format not in FORMATS:
+            raise ValueError(f'Unknown output format: {output_format}')
+
+        self.root = pathlib.Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.set_name = set_name
+        self.shard_class = ParquetShard if output_format == 'parquet' else JsonLinesShard
+
+        if max_records is None:
+            max_records = config('SHARD_MAX_RECORDS', default=100000, cast=int)
+        if max_bytes is None:
+            max_bytes = config('SHARD_MAX_BYTES', default=256 * 1024**2, cast=int)
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+
+        # Unique for each run, so concurrent runs writing to the same directory never share a shard
+        self.run_id = f'{datetime.datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}'
+
+        self._lock = threading.Lock()
+        self._sinks: typing.Dict[str, ShardSink] = {}
+        # Fetcher -> repo -> start of last successful fetch, and the same by deduplication key
+        self._fetched: typing.Dict[str, typing.Dict[str, datetime.datetime]] = {}
+        self._fetched_keys: typing.Dict[str, typing.Dict[str, datetime.datetime]] = {}
+
+        for entry in self.read_manifest():
+            self._add_fetched(entry)
+
+    def relative(self, path: pathlib.Path) -> str:
+        return path.relative_to(self.root).as_posix()
+
+    def read_manifest(self) -> typing.Iterator[RecordType]:
+        """Read the entries in the manifest, ignoring any line left incomplete by a crash."""
+        try:
+            with open(self.root.joinpath(self.manifest_name), encoding='utf-8') as fp:
+                for line in fp:
+                    try:
+                        yield json.loads(line)
+
+                    except json.JSONDecodeError:
+                        logger.warning('Ignoring incomplete line in shard manifest')
+
+        except FileNotFoundError:
+            return
+
+    def append_manifest(self, entries: typing.Sequence[RecordType]) -> None:
+        if not entries:
+            return
+
+        content = ''.join(json.dumps(entry) + '\n' for entry in entries)
+
+        with self._lock:
+            with open(self.root.joinpath(self.manifest_name), 'a', encoding='utf-8') as fp:
+                fp.write(content)
+                fp.flush()
+                os.fsync(fp.fileno())
+
+            for entry in entries:
+                self._add_fetched(entry)
+
+    def _add_fetched(self, entry: RecordType) -> None:
+        if entry['type'] != 'repo' or entry['set'] != self.set_name:
+            return
+
+        started = datetime.datetime.fromisoformat(entry['started'])
+
+        for fetched, key in ((self._fetched, entry['repo']), (self._fetched_keys, entry.get('key'))):
+            if key is not None:
+                fetched = fetched.setdefault(entry['fetcher'], {})
+                fetched[key] = max(started, fetched.get(key, started))
+
+    def fetched(self, name: str, by_key: bool = False) -> typing.Dict[str, datetime.datetime]:
+        """Get the repos which have been successfully fetched by a fetcher, and when the last fetch started.
+
+        :param by_key: Get the deduplication keys fetched, rather than the repos
+        """
+        with self._lock:
+            return dict((self._fetched_keys if by_key else self._fetched).get(name, {}))
+
+    def sink(self, name: str) -> ShardSink:
+        """Get the sink for a fetcher."""
+        with self._lock:
+            if name not in self._sinks:
+                self._sinks[name] = ShardSink(self, name)
+
+            return self._sinks[name]
+
+    def iter_records(self, name: str) -> typing.Iterator[RecordType]:
+        """Read the records stored by a fetcher, from complete fetches only.
+
+        Parquet shards are read as JSON records, so require pyarrow.
+        """
+        shard_repos: typing.Dict[str, typing.Set[str]] = {}
+        for entry in self.read_manifest():
+            if entry['type'] == 'repo' and entry['fetcher'] == name and entry['set'] == self.set_name:
+                for shard in entry['shards']:
+                    shard_repos.setdefault(shard, set()).add(entry['repo'])
+
+        for shard, repos in sorted(shard_repos.items()):
+            for record in self._read_shard(self.root.joinpath(shard)):
+                if record.get('_repo_name') in repos:
+                    yield record
+
+    @staticmethod
+    def _read_shard(path: pathlib.Path) -> typing.Iterator[RecordType]:
+        if path.name.endswith(JsonLinesShard.suffix):
+            with gzip.open(path, 'rt', encoding='utf-8') as fp:
+                yield from map(json.loads, fp)
+
+            return
+
+        import pyarrow.parquet  # pylint: disable=import-outside-toplevel
+
+        for record in pyarrow.parquet.read_table(path).to_pylist():
+            yield json.loads(record['_json']) if '_json' in record else record
+
+    def close(self) -> None:
+        """Close the open shard of each fetcher, recording them in the manifest."""
+        for sink in list(self._sinks.values()):
+            sink.close()
+
+    def __enter__(self) -> 'ShardStore':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
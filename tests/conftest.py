@@ -0,0 +1,64 @@
+import http.server
+import json
+import threading
+import typing
+
+import pytest
+
+# Status, headers and body of a response - the body is sent as is if bytes, or else encoded as JSON
+ResponseType = typing.Tuple[int, typing.Dict[str, str], typing.Any]
+RouteType = typing.Callable[[http.server.BaseHTTPRequestHandler], ResponseType]
+
+
+def json_handler(route: RouteType) -> typing.Type[http.server.BaseHTTPRequestHandler]:
+    """Make a keep-alive request handler which responds to each request with the result of a routing function.
+
+    :param route: Function taking the request handler - with `command`, `path`, `headers` and the request
+        `body` - and returning the status, headers and body of the response
+    """
+    class JSONHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def handle_request(self):
+            self.body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            status, headers, body = route(self)
+
+            if body is None:
+                body = b''
+
+            elif not isinstance(body, bytes):
+                body = json.dumps(body).encode()
+                headers = {'Content-Type': 'application/json', **headers}
+
+            self.send_response(status)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = do_POST = handle_request
+
+        def log_message(self, *args):
+            pass
+
+    return JSONHandler
+
+
+@pytest.fixture
+def http_server() -> typing.Iterator[typing.Callable[[RouteType], str]]:
+    """Factory to start a local HTTP server with a given routing function, returning its base URL."""
+    servers = []
+
+    def serve(route: RouteType) -> str:
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), json_handler(route))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+
+        return f'http://127.0.0.1:{server.server_address[1]}'
+
+    yield serve
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,57 @@
+from github_analysis import aggregate, db
+
+REPOS = ['TEST_aggregate/repo1', 'TEST_aggregate/repo2']
+
+
+def mark_fetched(repo_name: str, fetcher: str) -> None:
+    db.collection('status').update_one({'_repo_name': repo_name}, {
+        '$currentDate': {f'{fetcher}.timestamp': {'$type': 'timestamp'}},
+        '$set': {'sets': ['TEST_set']},
+    }, upsert=True)  # yapf: disable
+
+
+def test_aggregate():
+    for name in ['commits', 'issues', *aggregate.SUMMARY_COLLECTIONS]:
+        db.collection(name).delete_many({'_repo_name': {'$in': REPOS}})
+
+    db.collection('commits').insert_many([
+        {'_repo_name': REPOS[0], 'author': {'login': 'a'}, 'commit': {'author': {'date': '2021-01-05T00:00:00Z'}}},
+        {'_repo_name': REPOS[0], 'author': {'login': 'b'}, 'commit': {'author': {'date': '2021-01-20T00:00:00Z'}}},
+        {'_repo_name': REPOS[0], 'author': {'login': 'a'}, 'commit': {'author': {'date': '2021-03-01T00:00:00Z'}}},
+    ])  # yapf: disable
+    db.collection('issues').insert_many([
+        {'_repo_name': REPOS[0], 'created_at': '2020-12-31T00:00:00Z'},
+        {'_repo_name': REPOS[0], 'created_at': '2021-03-02T00:00:00Z', 'pull_request': {'merged_at': None}},
+    ])  # yapf: disable
+    mark_fetched(REPOS[0], 'commits')
+    mark_fetched(REPOS[0], 'issues')
+
+    aggregate.aggregate(full=True)
+
+    summary = db.collection(aggregate.SUMMARY_REPOS).find_one({'_id': REPOS[0]})
+    assert summary['commits'] == 3
+    assert summary['issues'] == 1
+    assert summary['pull_requests'] == 1
+    assert summary['contributors'] == 2
+    assert summary['first_activity'] == '2020-12-31T00:00:00Z'
+    assert summary['last_activity'] == '2021-03-02T00:00:00Z'
+    assert summary['sets'] == ['TEST_set']
+
+    monthly = {
+        summary['month']: summary
+        for summary in db.collection(aggregate.SUMMARY_MONTHLY).find({'_repo_name': REPOS[0]})
+    }  # yapf: disable
+    assert sorted(monthly) == ['2020-12', '2021-01', '2021-03']
+    assert monthly['2021-01']['commits'] == 2
+    assert monthly['2021-01']['contributors'] == 2
+    assert monthly['2021-03']['pull_requests'] == 1
+
+    # Only repos fetched since the last aggregation are summarised again
+    db.collection('commits').insert_one({
+        '_repo_name': REPOS[1],
+        'commit': {'author': {'date': '2021-04-01T00:00:00Z'}},
+    })  # yapf: disable
+    mark_fetched(REPOS[1], 'commits')
+
+    assert aggregate.aggregate() == 1
+    assert db.collection(aggregate.SUMMARY_REPOS).find_one({'_id': REPOS[1]})['commits'] == 1
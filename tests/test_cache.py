@@ -0,0 +1,74 @@
+from github_analysis.cache import ResponseCache
+
+
+def test_response_cache(tmp_path):
+    cache = ResponseCache(tmp_path)
+    assert cache.get('https://example.com/a') is None
+
+    cache.put('https://example.com/a', b'[1, 2, 3]', {'Link': '<https://example.com/b>; rel="next"', 'Server': 'x'})
+    content, headers = cache.get('https://example.com/a')
+    assert content == b'[1, 2, 3]'
+    assert headers == {'Link': '<https://example.com/b>; rel="next"'}
+
+    # Identical content is stored once
+    cache.put('https://example.com/b', b'[1, 2, 3]', {})
+    assert len(cache) == 2
+    assert len(list(tmp_path.joinpath('objects').rglob('*.gz'))) == 1
+
+    # Responses are only read from the index once it has been written
+    assert len(ResponseCache(tmp_path)) == 0
+    cache.close()
+    assert ResponseCache(tmp_path).get('https://example.com/b')[0] == b'[1, 2, 3]'
+
+
+def test_response_cache_eviction(tmp_path):
+    cache = ResponseCache(tmp_path, max_bytes=100)
+
+    cache.put('https://example.com/a', b'a', {})
+    size = cache.size
+    cache.put('https://example.com/b', b'b', {})
+
+    # Least recently used response is evicted first
+    cache.get('https://example.com/a')
+    cache.max_bytes = 2 * size
+    cache.put('https://example.com/c', b'c', {})
+
+    assert 'https://example.com/a' in cache
+    assert 'https://example.com/b' not in cache
+    assert 'https://example.com/c' in cache
+    assert cache.size <= cache.max_bytes
+    assert len(list(tmp_path.joinpath('objects').rglob('*.gz'))) == 2
+
+
+def test_response_cache_journal(tmp_path):
+    cache = ResponseCache(tmp_path, max_bytes=100, flush_every=2)
+
+    for i in range(10):
+        cache.put(f'https://example.com/{i}', str(i).encode() * 100, {})
+
+    # Changes are appended to the journal as they are flushed, without rewriting the whole index
+    reopened = ResponseCache(tmp_path)
+    assert len(reopened) == len(cache)
+    assert reopened.size == cache.size == sum(reopened._sizes.values())
+    assert reopened.get('https://example.com/9')[0] == b'9' * 100
+
+    cache.close()
+    assert not tmp_path.joinpath(ResponseCache.journal_name).exists()
+    assert len(ResponseCache(tmp_path)) == len(cache)
+
+
+def test_response_cache_journal_reused_body(tmp_path):
+    cache = ResponseCache(tmp_path, flush_every=10)
+
+    # The first body is released then stored again under another URL
+    cache.put('https://example.com/a', b'first', {})
+    cache.put('https://example.com/a', b'second', {})
+    cache.put('https://example.com/b', b'first', {})
+    cache.flush()
+    assert tmp_path.joinpath(ResponseCache.journal_name).exists()
+
+    # Replaying the journal must not delete a body which a later change uses again
+    reopened = ResponseCache(tmp_path)
+    assert reopened.get('https://example.com/b')[0] == b'first'
+    assert reopened.get('https://example.com/a')[0] == b'second'
+    assert reopened.size == cache.size
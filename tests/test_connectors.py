@@ -1,8 +1,14 @@
+import collections
+import gzip
+import json
 import pathlib
+import time
 
 from decouple import config
+import pytest
 
-from github_analysis import connectors
+from github_analysis import connectors, db
+from github_analysis.cache import ResponseCache
 
 data_dir = pathlib.Path(__file__).parent.joinpath('data')
 
@@ -55,3 +61,354 @@ def test_join_curl_responses():
         response = connectors.join_curl_responses(fp.read())
 
     assert isinstance(response, list)
+
+
+def test_rate_limit_budget():
+    budget = connectors.RateLimitBudget()
+
+    # Unknown budget doesn't block
+    budget.acquire()
+    assert budget.remaining is None
+
+    reset = int(time.time()) + 60
+    budget.update({'x-ratelimit-remaining': '2', 'x-ratelimit-reset': str(reset)})
+    budget.acquire()
+    assert budget.remaining == 1
+
+    # Stale response from the same window doesn't increase the budget
+    budget.update({'x-ratelimit-remaining': '10', 'x-ratelimit-reset': str(reset)})
+    assert budget.remaining == 1
+
+    # Budget is refreshed by a response from the next window
+    budget.update({'x-ratelimit-remaining': '5', 'x-ratelimit-reset': str(reset + 3600)})
+    assert budget.remaining == 5
+
+
+def test_rate_limit_budget_paced():
+    budget = connectors.RateLimitBudget(paced=True)
+    budget.update({'x-ratelimit-remaining': '10', 'x-ratelimit-reset': str(int(time.time()) + 100)})
+
+    # Remaining budget is spread evenly over the rest of the window
+    assert budget.reserve() == 0
+    assert budget.reserve() == pytest.approx(10, abs=1)
+    assert budget.reserve() == pytest.approx(20, abs=1)
+
+    assert connectors.RateLimitBudget(paced=False).reserve() == 0
+
+
+def test_rate_limit_budget_not_modified():
+    budget = connectors.RateLimitBudget(paced=True)
+    headers = {'x-ratelimit-remaining': '10', 'x-ratelimit-reset': str(int(time.time()) + 100)}
+    budget.update(headers)
+
+    # Requests answered with a 304 don't use up the budget or delay the next request
+    for _ in range(20):
+        assert budget.reserve() == 0
+        budget.update(headers, not_modified=True)
+
+    assert budget.remaining == 10
+
+
+def test_token_pool():
+    pool = connectors.TokenPool(['token-a', 'token-b'], paced=False)
+    reset = str(int(time.time()) + 60)
+
+    # Tokens with unknown budget are tried first
+    first = pool.acquire()
+    pool.update(first, {'x-ratelimit-remaining': '1', 'x-ratelimit-reset': reset})
+    second = pool.acquire()
+    assert second != first
+    pool.update(second, {'x-ratelimit-remaining': '3', 'x-ratelimit-reset': reset})
+
+    # Token with the most budget remaining is used until it is no longer the best
+    assert pool.acquire() == second
+    assert pool.acquire() == second
+    assert pool.acquire() in {first, second}
+    assert pool.acquire() in {first, second}
+
+    # Both tokens are now exhausted
+    usage = pool.usage()
+    assert sum(u['requests'] for u in usage.values()) == 6
+    assert all(u['remaining'] == 0 for u in usage.values())
+
+    with pytest.raises(ValueError):
+        connectors.TokenPool([])
+
+
+flaky_attempts = collections.Counter()
+flaky_failures = [
+    (503, {}, None),
+    (403, {'Retry-After': '0'}, {'message': 'You have exceeded a secondary rate limit'}),
+]
+
+
+def flaky_route(request):
+    """Fail each request for a repo with a server error, then a secondary rate limit, before succeeding."""
+    owner, repo = request.path.strip('/').split('/')
+    attempt = flaky_attempts[request.path]
+    flaky_attempts[request.path] += 1
+
+    if repo == 'missing':
+        return 404, {}, {'message': 'Not Found'}
+
+    if repo == 'limited':
+        # Rate limit exhausted, but with a reset time which has already passed
+        headers = {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': str(int(time.time()) - 60)}
+        return 403, headers, {'message': 'API rate limit exceeded'}
+
+    if repo == 'broken' or attempt < len(flaky_failures):
+        return flaky_failures[min(attempt, len(flaky_failures) - 1)]
+
+    return 200, {}, {'name': repo}
+
+
+def test_requests_connector_retries(http_server):
+    base_url = http_server(flaky_route)
+    connector = connectors.RequestsConnector(
+        base_url + '/{owner}/{repo}', rate_limit=connectors.RateLimitBudget(), max_retries=2, backoff_factor=0.01
+    )
+
+    # Transient failures are retried
+    _test_repo(connector, 'jag1g13', 'pycgtool')
+    assert flaky_attempts['/jag1g13/pycgtool'] == 3
+
+    # Missing data is not retried
+    with pytest.raises(connectors.ResponseNotFoundError):
+        connector.get(owner='jag1g13', repo='missing')
+    assert flaky_attempts['/jag1g13/missing'] == 1
+
+    # Repeated failures are reported, rather than treated as missing data
+    with pytest.raises(connectors.ResponseError):
+        connector.get(owner='jag1g13', repo='broken')
+    assert flaky_attempts['/jag1g13/broken'] == 3
+
+    # An exhausted rate limit which never resets is retried with backoff, then reported
+    with pytest.raises(connectors.ResponseError):
+        connector.get(owner='jag1g13', repo='limited')
+    assert flaky_attempts['/jag1g13/limited'] == 3
+
+
+def gzip_route(request):
+    """Serve a repo record with gzip compression."""
+    owner, repo = request.path.strip('/').split('/')
+    body = gzip.compress(json.dumps({'name': repo, 'description': 'x' * 1000}).encode())
+
+    return 200, {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}, body
+
+
+def test_requests_connector_session(http_server):
+    base_url = http_server(gzip_route)
+    connector = connectors.RequestsConnector(base_url + '/{owner}/{repo}', session=connectors.make_session())
+
+    for _ in range(3):
+        _test_repo(connector, 'jag1g13', 'pycgtool')
+
+    stats = connector.stats.as_dict()
+    assert stats['requests'] == 3
+    assert stats['connections_reused'] == 2
+    assert stats['bytes_received'] < stats['bytes_decoded']
+
+    # Connection errors are only retried by the connector, not again by the session
+    assert connectors.make_session().get_adapter(base_url).max_retries.total == 0
+
+
+commit_pages = {
+    '/commits?page=1': [{'sha': 'a'}, {'sha': 'b'}],
+    '/commits?page=2': [{'sha': 'c'}],
+    '/commits?page=1&since=2021-01-01T00%3A00%3A00Z': [{'sha': 'c'}],
+}
+
+
+def paginated_etag_route(request):
+    """Serve a two page list of commits, supporting conditional requests."""
+    headers = {'ETag': f'"{request.path}"'}
+    if request.headers.get('If-None-Match') == headers['ETag']:
+        return 304, headers, None
+
+    if request.path.endswith('1'):
+        headers['Link'] = f'<http://{request.headers["Host"]}/commits?page=2>; rel="next"'
+
+    return 200, headers, commit_pages[request.path]
+
+
+def test_requests_connector_conditional(http_server):
+    base_url = http_server(paginated_etag_route)
+    collection = db.collection('test_etags', indexes=['url'])
+    collection.delete_many({})
+
+    connector = connectors.RequestsConnector(
+        base_url + '/commits?page=1', validator_cache=connectors.ValidatorCache(collection)
+    )
+
+    content = connector.get(owner='jag1g13', repo='pycgtool')
+    assert [item['sha'] for item in content] == ['a', 'b', 'c']
+
+    # Validators are not stored until the content has been
+    content = connector.get(owner='jag1g13', repo='pycgtool')
+    assert len(content) == 3
+    connector.commit(owner='jag1g13', repo='pycgtool')
+
+    with pytest.raises(connectors.ResponseNotModified):
+        connector.get(owner='jag1g13', repo='pycgtool')
+
+    assert connector.stats.requests == 6
+
+    # Incremental fetches have a different URL every time, so their validators are not stored
+    params = {'since': '2021-01-01T00:00:00Z'}
+    content = connector.get(owner='jag1g13', repo='pycgtool', params=params)
+    assert [item['sha'] for item in content] == ['c']
+    connector.commit(owner='jag1g13', repo='pycgtool', params=params)
+    assert collection.count_documents({}) == 2
+
+
+def test_record_replay(http_server, tmp_path):
+    base_url = http_server(paginated_etag_route)
+
+    with ResponseCache(tmp_path) as cache:
+        connector = connectors.RequestsConnector(base_url + '/commits?page=1', recorder=cache)
+        recorded = connector.get(owner='jag1g13', repo='pycgtool')
+
+    # Replay from a fresh cache, so only what was written to disk is used
+    connector = connectors.ReplayConnector(base_url + '/commits?page=1', ResponseCache(tmp_path))
+    assert connector.get(owner='jag1g13', repo='pycgtool') == recorded
+
+    connector = connectors.ReplayConnector(base_url + '/missing', ResponseCache(tmp_path))
+    with pytest.raises(connectors.ResponseNotFoundError):
+        connector.get(owner='jag1g13', repo='pycgtool')
+
+
+def test_file_connector_pages():
+    connector = connectors.FileConnector(str(data_dir.joinpath('COMMITS.d', '{owner}+{repo}.responses')))
+
+    pages = list(connector.iter_pages(owner='jag1g13', repo='pycgtool'))
+    assert len(pages) == 2
+
+    for page in pages:
+        assert isinstance(page, list)
+        assert all(item['_repo_name'] == 'jag1g13/pycgtool' for item in page)
+
+
+def test_file_connector_malformed(tmp_path):
+    with open(data_dir.joinpath('COMMITS.d', 'jag1g13+pycgtool.responses'), 'rb') as fp:
+        content = fp.read()
+
+    # Break the JSON in the second block
+    second_block = content.index(b'HTTP/', 1)
+    content = content[:second_block] + content[second_block:].replace(b'"sha"', b'sha', 1)
+    tmp_path.joinpath('jag1g13+pycgtool.responses').write_bytes(content)
+
+    connector = connectors.FileConnector(str(tmp_path.joinpath('{owner}+{repo}.responses')))
+    pages = connector.iter_pages(owner='jag1g13', repo='pycgtool')
+
+    # First block is still usable
+    assert len(next(pages)) == 100
+
+    with pytest.raises(connectors.MalformedResponseError) as exc_info:
+        next(pages)
+
+    assert exc_info.value.offset == second_block
+
+
+graphql_requests = []
+
+
+def graphql_route(request):
+    """Stub GitHub GraphQL API serving repository metadata for any repo except 'missing' and 'forbidden'."""
+    graphql_requests.append(request.path)
+    variables = json.loads(request.body)['variables']
+
+    data = {}
+    errors = []
+    for key, owner in variables.items():
+        if not key.startswith('owner'):
+            continue
+
+        i = key[len('owner'):]
+        name = variables[f'name{i}']
+
+        error_type = {'missing': 'NOT_FOUND', 'forbidden': 'FORBIDDEN'}.get(name)
+        if error_type is not None:
+            data[f'r{i}'] = None
+            errors.append({'type': error_type, 'path': [f'r{i}'], 'message': name})
+            continue
+
+        data[f'r{i}'] = {
+            'id': f'node-{owner}-{name}',
+            'databaseId': 1,
+            'name': name,
+            'nameWithOwner': f'{owner}/{name}',
+            'description': None,
+            'url': f'https://github.com/{owner}/{name}',
+            'homepageUrl': None,
+            'createdAt': '2021-01-01T00:00:00Z',
+            'updatedAt': '2021-01-01T00:00:00Z',
+            'pushedAt': '2021-01-01T00:00:00Z',
+            'isFork': False,
+            'isArchived': False,
+            'isPrivate': False,
+            'stargazerCount': 0,
+            'forkCount': 0,
+            'diskUsage': 0,
+            'primaryLanguage': {'name': 'Python'},
+            'licenseInfo': None,
+            'defaultBranchRef': {'name': 'main'},
+            'owner': {'login': owner, 'id': f'node-{owner}'},
+        }  # yapf: disable
+
+    return 200, {}, {'data': data, 'errors': errors}
+
+
+def test_graphql_connector(http_server):
+    base_url = http_server(graphql_route)
+    connector = connectors.GitHubGraphQLConnector(
+        'repos',
+        url=base_url + '/graphql',
+        rate_limit=connectors.RateLimitBudget(),
+        session=connectors.make_session(),
+        headers={'Authorization': 'bearer test'}
+    )
+
+    connector.plan(['jag1g13/pycgtool', 'pedasi/PEDASI', 'jag1g13/missing', 'jag1g13/forbidden'])
+
+    _test_repo(connector, 'jag1g13', 'pycgtool')
+    _test_repo(connector, 'pedasi', 'PEDASI')
+
+    with pytest.raises(connectors.ResponseNotFoundError) as exc_info:
+        connector.get(owner='jag1g13', repo='missing')
+    assert exc_info.value.status_code == 404
+
+    # Only repos which were not found are reported as missing - other errors may be retried
+    with pytest.raises(connectors.ResponseError):
+        connector.get(owner='jag1g13', repo='forbidden')
+
+    # All repos were fetched in a single request
+    assert len(graphql_requests) == 1
+
+    content = connector.get(owner='jag1g13', repo='pycgtool')
+    assert content['node_id'] == 'node-jag1g13-pycgtool'
+    assert content['full_name'] == 'jag1g13/pycgtool'
+
+
+def test_graphql_connector_skipped_repos(http_server):
+    base_url = http_server(graphql_route)
+    connector = connectors.GitHubGraphQLConnector(
+        'repos',
+        batch_size=2,
+        url=base_url + '/graphql',
+        rate_limit=connectors.RateLimitBudget(),
+        session=connectors.make_session(),
+        headers={'Authorization': 'bearer test'}
+    )
+
+    repos = [f'TEST_skipped/repo{i}' for i in range(8)]
+    connector.plan(repos)
+
+    # Repos which are planned but never requested are not kept once the requests have moved on
+    for repo_name in repos[::2]:
+        owner, repo = repo_name.split('/')
+        _test_repo(connector, owner, repo)
+
+    assert set(connector._batches) == {repos[5], repos[7]}
+
+    # A skipped repo may still be requested, though it must be fetched again
+    _test_repo(connector, 'TEST_skipped', 'repo1')
@@ -0,0 +1,69 @@
+import subprocess
+import sys
+from unittest import mock
+
+import pymongo
+import pymongo.collection
+
+from github_analysis import db
+
+
+def test_lazy_client():
+    """Check that importing the CLI does not connect to the database."""
+    subprocess.run([
+        sys.executable, '-c', 'import github_analysis.__main__, github_analysis.db as db; assert db._client is None'
+    ], check=True)  # yapf: disable
+
+
+def test_collection_indexes_created_once():
+    with mock.patch.object(pymongo.collection.Collection, 'create_index') as create_index:
+        db.collection('test_indexes', indexes=['sets', ('_repo_name', 'sets')])
+        assert create_index.call_count == 4
+
+        db.collection('test_indexes', indexes=['sets', ('_repo_name', 'sets')])
+        assert create_index.call_count == 4
+
+
+def test_write_buffer():
+    collection = db.collection('test_write_buffer')
+    collection.delete_many({})
+
+    with db.WriteBuffer(max_ops=3, max_delay=60) as write_buffer:
+        first = write_buffer.add(collection, [pymongo.InsertOne({'node_id': 1})])
+        assert not first.done()
+
+        # Reaching the batch size triggers a flush
+        second = write_buffer.add(collection, [pymongo.InsertOne({'node_id': 2}), pymongo.InsertOne({'node_id': 3})])
+        assert first.result(timeout=0) is None
+        assert second.result(timeout=0) is None
+
+        last = write_buffer.add(collection, [pymongo.InsertOne({'node_id': 4})])
+
+    # Remaining writes are flushed on close
+    assert last.result(timeout=0) is None
+    assert collection.count_documents({}) == 4
+
+
+def test_write_buffer_isolates_failures():
+    collection = db.collection('test_write_buffer')
+    collection.delete_many({})
+
+    with db.WriteBuffer(max_ops=100, max_delay=60) as write_buffer:
+        good = write_buffer.add(collection, [pymongo.InsertOne({'_id': 1})])
+        duplicate = write_buffer.add(collection, [pymongo.InsertOne({'_id': 2}), pymongo.InsertOne({'_id': 1})])
+
+    assert good.exception(timeout=0) is None
+    assert duplicate.exception(timeout=0) is not None
+
+
+def test_when_all():
+    collection = db.collection('test_write_buffer')
+    called = []
+
+    with db.WriteBuffer(max_ops=100, max_delay=60) as write_buffer:
+        writes = [write_buffer.add(collection, [pymongo.InsertOne({})]) for _ in range(3)]
+        db.when_all(writes, called.append)
+
+        assert not called
+
+    assert called == [writes]
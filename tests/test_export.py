@@ -0,0 +1,44 @@
+import gzip
+import json
+
+from github_analysis import db, export
+
+REPOS = ['TEST_export/repo1', 'TEST_export/repo2', 'TEST_export/repo3']
+
+
+def read_export(directory):
+    records = []
+    for path in sorted(directory.glob('part-*.jsonl.gz')):
+        with gzip.open(path, 'rt') as fp:
+            records.extend(json.loads(line) for line in fp)
+
+    return records
+
+
+def test_export_collection(tmp_path):
+    collection = db.collection('commits')
+    collection.delete_many({'_repo_name': {'$in': REPOS}})
+    collection.insert_many([{'_repo_name': repo, 'sha': f'{repo}-{i}'} for repo in REPOS for i in range(3)])
+
+    db.collection('status').delete_many({'_repo_name': {'$in': REPOS}})
+    db.collection('status').insert_many([
+        {'_repo_name': REPOS[0], 'sets': ['TEST_export']},
+        {'_repo_name': REPOS[1], 'sets': ['TEST_export']},
+        {'_repo_name': REPOS[2], 'sets': ['TEST_other']},
+    ])  # yapf: disable
+
+    exported = export.export_collection('commits', tmp_path, set_name='TEST_export', chunk_size=1, workers=2)
+    assert exported == 6
+
+    directory = tmp_path.joinpath('commits')
+    records = read_export(directory)
+    assert sorted(record['sha'] for record in records) == [f'{repo}-{i}' for repo in REPOS[:2] for i in range(3)]
+    assert all('_id' not in record for record in records)
+
+    # An interrupted export is resumed, exporting only the missing chunks
+    directory.joinpath('part-00001.jsonl.gz').unlink()
+    assert export.export_collection('commits', tmp_path, set_name='TEST_export', chunk_size=1) == 3
+    assert len(read_export(directory)) == 6
+
+    # Repo lists are combined with the set
+    assert export.export_repos(REPOS[1:], 'TEST_export') == [REPOS[1]]
@@ -1,8 +1,17 @@
+import collections
+import concurrent.futures
+import datetime
+import functools
 import pathlib
+import threading
 import typing
+import urllib.parse
 from unittest import mock
 
-from github_analysis import connectors, fetch
+import pytest
+
+from github_analysis import connectors, db, fetch, resolve
+from github_analysis.sinks import ShardStore, Sink
 
 data_dir = pathlib.Path(__file__).parent.joinpath('data')
 
@@ -27,6 +36,69 @@ def test_make_repo_fetcher():
     _test_repo(fetcher, 'jag1g13/pycgtool')
 
 
+def test_fetched_repos():
+    collection = mock.Mock()
+    connector = connectors.FileConnector(str(data_dir.joinpath('{owner}+{repo}.response')))
+
+    fetcher = fetch.make_fetcher('TEST_fetched', collection, connector)
+    fetcher('jag1g13/pycgtool')
+
+    assert 'jag1g13/pycgtool' in fetch.fetched_repos('TEST_fetched')
+    assert 'jag1g13/pycgtool' not in fetch.fetched_repos('TEST_not_fetched')
+
+
+issues_queries = []
+
+
+def issues_route(request):
+    """Serve a list of issues, recording the query parameters of each request."""
+    issues_queries.append(urllib.parse.parse_qs(urllib.parse.urlparse(request.path).query))
+    return 200, {}, [{'node_id': 'issue1', 'title': 'Test'}]
+
+
+def test_make_fetcher_incremental(http_server):
+    base_url = http_server(issues_route)
+    collection = mock.Mock()
+    connector = connectors.RequestsConnector(base_url + '/repos/{owner}/{repo}/issues?state=all')
+
+    db.collection('status').delete_many({'_repo_name': 'jag1g13/pycgtool', 'TEST_incremental': {'$exists': True}})
+    fetcher = fetch.make_fetcher('TEST_incremental', collection, connector, since_param='since')
+
+    # No previous fetch, so everything is fetched
+    fetcher('jag1g13/pycgtool', incremental=True)
+    assert 'since' not in issues_queries[-1]
+
+    fetcher('jag1g13/pycgtool', incremental=True)
+    assert 'since' in issues_queries[-1]
+    assert issues_queries[-1]['state'] == ['all']
+
+
+def paginated_route(request):
+    """Serve three pages of commits."""
+    page = int(urllib.parse.parse_qs(urllib.parse.urlparse(request.path).query)['page'][0])
+
+    headers = {}
+    if page < 3:
+        headers['Link'] = f'<http://{request.headers["Host"]}/commits?page={page + 1}>; rel="next"'
+
+    return 200, headers, [{'node_id': f'commit{page}'}]
+
+
+def test_make_fetcher_stream(http_server):
+    base_url = http_server(paginated_route)
+    collection = mock.Mock()
+    connector = connectors.RequestsConnector(base_url + '/commits?page=1')
+
+    fetcher = fetch.make_fetcher('TEST', collection, connector)
+
+    # Each page is written as it arrives
+    assert fetcher('jag1g13/pycgtool', stream=True) is None
+    assert collection.bulk_write.call_count == 3
+
+    content = fetcher('jag1g13/pycgtool')
+    assert [item['node_id'] for item in content] == ['commit1', 'commit2', 'commit3']
+
+
 def test_make_all_fetchers_github():
     fetchers = fetch.GitHubFetcher().make_all()
 
@@ -98,3 +170,143 @@ def test_fetch_commits_github():
     first_entry = content[0]
     assert 'author' in first_entry
     assert 'committer' in first_entry
+
+
+user_requests = collections.Counter()
+
+
+def users_route(request):
+    """Serve a user, counting the requests for each."""
+    login = request.path.split('/')[-1]
+    user_requests[login] += 1
+    return 200, {}, {'node_id': login, 'login': login}
+
+
+def test_make_fetcher_dedup(http_server, tmp_path):
+    base_url = http_server(users_route)
+    connector = connectors.RequestsConnector(base_url + '/users/{owner}')
+    repos = ['TEST_owner/repo1', 'TEST_owner/repo2', 'TEST_other/repo1']
+
+    with ShardStore(tmp_path) as store:
+        fetcher = fetch.make_fetcher('users', store.sink('users'), connector, dedup_key='{owner}')
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+            list(executor.map(functools.partial(fetcher, stream=True), repos))
+
+    # Each owner is fetched once and linked to all of its repos
+    assert user_requests == {'TEST_owner': 1, 'TEST_other': 1}
+    assert ShardStore(tmp_path).sink('users').fetched_repos() == set(repos)
+
+    # Owners fetched in a previous run are not fetched again until their data is stale
+    with ShardStore(tmp_path) as store:
+        fetcher = fetch.make_fetcher('users', store.sink('users'), connector, dedup_key='{owner}', dedup_ttl=3600)
+        fetcher('TEST_owner/repo3', stream=True)
+
+    assert user_requests['TEST_owner'] == 1
+
+    # Linked repos keep the start of the original fetch, so the owner's data still becomes stale
+    sink = ShardStore(tmp_path).sink('users')
+    assert sink.last_fetched('TEST_owner/repo3') == sink.last_fetched('TEST_owner/repo1')
+    assert sink.last_fetched_key('TEST_owner') == sink.last_fetched('TEST_owner/repo1')
+
+
+def test_make_fetcher_dedup_buffered(http_server):
+    base_url = http_server(users_route)
+    connector = connectors.RequestsConnector(base_url + '/users/{owner}')
+    sink = mock.Mock(spec=Sink)
+    repos = ['TEST_buffered/repo1', 'TEST_buffered/repo2', 'TEST_buffered/repo3']
+
+    fetcher = fetch.make_fetcher('users', sink, connector, dedup_key='{owner}')
+
+    # Other repos are linked only once the owner's buffered writes have been acknowledged
+    written = concurrent.futures.Future()
+    sink.write.return_value = written
+    fetcher(repos[0], stream=True)
+    fetcher(repos[1], stream=True)
+    assert sink.mark_fetched.call_count == 0
+
+    written.set_result(None)
+    assert [call.args[0] for call in sink.mark_fetched.call_args_list] == repos[:2]
+
+    fetcher(repos[2], stream=True)
+    assert sink.mark_fetched.call_args.args[0] == repos[2]
+
+    # If the writes fail, waiting repos are not linked and the owner is fetched again
+    sink.reset_mock()
+    failed = concurrent.futures.Future()
+    sink.write.return_value = failed
+    fetcher('TEST_failed/repo1', stream=True)
+    fetcher('TEST_failed/repo2', stream=True)
+
+    failed.set_exception(RuntimeError('write failed'))
+    assert sink.mark_fetched.call_count == 0
+
+    sink.write.return_value = None
+    fetcher('TEST_failed/repo3', stream=True)
+    assert user_requests['TEST_failed'] == 2
+
+
+def test_make_fetcher_dedup_lookup_fails(http_server):
+    base_url = http_server(users_route)
+    connector = connectors.RequestsConnector(base_url + '/users/{owner}')
+    sink = mock.Mock(spec=Sink)
+    sink.last_fetched_key.side_effect = RuntimeError('lookup failed')
+
+    fetcher = fetch.make_fetcher('users', sink, connector, dedup_key='{owner}', dedup_ttl=3600)
+
+    with pytest.raises(RuntimeError):
+        fetcher('TEST_lookup/repo1', stream=True)
+
+    # A failed check for data from a previous run releases the owner, so other repos don't wait for it forever
+    failed = threading.Event()
+
+    def fetch_other():
+        with pytest.raises(RuntimeError):
+            fetcher('TEST_lookup/repo2', stream=True)
+        failed.set()
+
+    threading.Thread(target=fetch_other, daemon=True).start()
+    assert failed.wait(timeout=10)
+
+
+def repos_route(request):
+    """Serve repos, redirecting one which has been renamed and reporting another as not found."""
+    if request.path == '/repos/TEST_resolve/old':
+        return 301, {'Location': '/repos/TEST_resolve/new'}, None
+
+    if request.path == '/repos/TEST_resolve/gone':
+        return 404, {}, None
+
+    full_name = request.path[len('/repos/'):]
+    return 200, {}, {'node_id': full_name, 'full_name': full_name}
+
+
+def test_make_fetcher_resolve_repos(http_server):
+    base_url = http_server(repos_route)
+    connector = connectors.RequestsConnector(base_url + '/repos/{owner}/{repo}')
+    repos = ['TEST_resolve/old', 'TEST_resolve/gone', 'TEST_resolve/live', 'TEST_resolve/new']
+
+    db.collection('status').delete_many({'_repo_name': {'$in': repos}})
+    fetcher = fetch.make_fetcher('repos', db.collection('repos'), connector, resolve_repos=True)
+
+    for repo in repos:
+        try:
+            fetcher(repo)
+
+        except connectors.ResponseNotFoundError:
+            pass
+
+    entries = resolve.lookup(repos)
+    assert entries['TEST_resolve/gone']['state'] == resolve.MISSING
+    assert entries['TEST_resolve/old']['full_name'] == 'TEST_resolve/new'
+    assert 'TEST_resolve/live' not in entries
+
+    # Later runs skip missing repos and fetch renamed repos once by their new name, until the entries expire
+    assert resolve.resolve_repos(repos) == ['TEST_resolve/new', 'TEST_resolve/live']
+    assert resolve.resolve_repos(repos, ttl=datetime.timedelta(0)) == repos
+
+    # An expired entry is cleared if the repo is found again under its original name
+    resolve.record_missing('TEST_resolve/live')
+    resolve.resolve_repos(repos, ttl=datetime.timedelta(0))
+    fetcher('TEST_resolve/live')
+    assert 'TEST_resolve/live' not in resolve.lookup(repos)
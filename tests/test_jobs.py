@@ -0,0 +1,75 @@
+import pytest
+
+from github_analysis import db, jobs
+
+
+@pytest.fixture
+def job_queue():
+    collection = db.collection('test_jobs', indexes=jobs.JobQueue.indexes)
+    collection.delete_many({})
+
+    return jobs.JobQueue(collection, max_attempts=2, retry_delay=0)
+
+
+def test_enqueue(job_queue):
+    assert job_queue.enqueue(['TEST/a', 'TEST/b'], ['repos', 'commits']) == 4
+
+    # Existing jobs are not added again
+    assert job_queue.enqueue(['TEST/a', 'TEST/c'], ['repos']) == 1
+    assert job_queue.counts()[jobs.PENDING] == 5
+
+
+def test_lease_and_complete(job_queue):
+    job_queue.enqueue(['TEST/a'], ['repos'])
+
+    job = job_queue.lease('worker-1', lease_seconds=60)
+    assert job['_repo_name'] == 'TEST/a'
+    assert job['fetcher'] == 'repos'
+    assert job['attempts'] == 1
+
+    # Leased jobs are not given to other workers
+    assert job_queue.lease('worker-2', lease_seconds=60) is None
+    assert job_queue.heartbeat(job['_id'], 'worker-1', lease_seconds=60)
+    assert not job_queue.heartbeat(job['_id'], 'worker-2', lease_seconds=60)
+
+    job_queue.complete(job['_id'], 'worker-1', 'fetched')
+    assert job_queue.counts()[jobs.DONE] == 1
+    assert job_queue.lease('worker-2', lease_seconds=60) is None
+
+
+def test_expired_lease(job_queue):
+    job_queue.enqueue(['TEST/a'], ['repos'])
+
+    # Worker dies without renewing its lease, so the job is given to another worker
+    job_queue.lease('worker-1', lease_seconds=-1)
+    job = job_queue.lease('worker-2', lease_seconds=-1)
+    assert job['worker'] == 'worker-2'
+
+    # Worker which lost the lease can't complete the job
+    job_queue.complete(job['_id'], 'worker-1')
+    assert job_queue.counts()[jobs.DONE] == 0
+
+    # Out of attempts
+    assert job_queue.lease('worker-3', lease_seconds=60) is None
+    assert job_queue.reap() == 1
+    assert job_queue.counts()[jobs.DEAD] == 1
+
+
+def test_fail_and_dead_letter(job_queue):
+    job_queue.enqueue(['TEST/a'], ['repos'])
+
+    job = job_queue.lease('worker-1', lease_seconds=60)
+    job_queue.fail(job, 'worker-1', 'ResponseError: failed')
+    assert job_queue.counts()[jobs.PENDING] == 1
+
+    job = job_queue.lease('worker-1', lease_seconds=60)
+    assert job['attempts'] == 2
+    job_queue.fail(job, 'worker-1', 'ResponseError: failed')
+
+    counts = job_queue.counts()
+    assert counts[jobs.PENDING] == 0
+    assert counts[jobs.DEAD] == 1
+
+    # Dead jobs can be requeued
+    assert job_queue.enqueue(['TEST/a'], ['repos'], requeue=True) == 1
+    assert job_queue.lease('worker-1', lease_seconds=60)['attempts'] == 1
@@ -1,7 +1,10 @@
+import pathlib
 import subprocess
 
 from github_analysis import __main__ as gha
-from github_analysis import fetch
+from github_analysis import connectors, db, fetch, jobs
+
+data_dir = pathlib.Path(__file__).parent.joinpath('data')
 
 
 def test_fetch_repo_cli():
@@ -12,3 +15,86 @@ def test_fetch_repo_cli():
 def test_fetch_for_repos():
     """Check that the main fetch command completes successfully."""
     gha.fetch_for_repos(['jag1g13/pycgtool'], fetcher_factory=fetch.GitHubFetcher())
+
+
+def test_fetch_for_repos_concurrent():
+    """Check that the main fetch command completes successfully with multiple workers."""
+    gha.fetch_for_repos(
+        ['jag1g13/pycgtool', 'pedasi/PEDASI'], fetcher_factory=fetch.GitHubFetcher(), concurrency=4
+    )
+
+
+def test_import_for_repos_workers():
+    """Check that importing from files completes successfully using worker processes."""
+    gha.fetch_for_repos(
+        ['jag1g13/pycgtool'], fetcher_factory=fetch.FileFetcher(data_dir), only='commits', workers=2
+    )
+
+
+def test_run_worker():
+    """Check that a worker runs each job in the queue and marks it as done."""
+    collection = db.collection('test_jobs', indexes=jobs.JobQueue.indexes)
+    collection.delete_many({})
+
+    job_queue = jobs.JobQueue(collection)
+    job_queue.enqueue(['jag1g13/pycgtool', 'TEST/missing'], ['commits'])
+
+    gha.run_worker(fetch.FileFetcher(data_dir), job_queue, concurrency=2, exit_when_empty=True)
+
+    assert job_queue.counts()[jobs.DONE] == 2
+    assert collection.find_one({'_repo_name': 'TEST/missing'})['outcome'] == 'not_found'
+
+
+def test_label_repo_set():
+    """Check that every repo is labelled, not just the first."""
+    repos = ['TEST/label1', 'TEST/label2', 'TEST/label3']
+    gha.label_repo_set(repos, 'TEST_set', chunk_size=2)
+
+    status = db.collection('status')
+    assert status.count_documents({'_repo_name': {'$in': repos}, 'sets': 'TEST_set'}) == 3
+
+
+class StubFetcher(fetch.Fetcher):
+    """Fetch repos and their issues from a local server."""
+    connector_class = connectors.RequestsConnector
+    fetcher_paths = {
+        'repos': '/repos/{owner}/{repo}',
+        'issues': '/repos/{owner}/{repo}/issues',
+    }
+    fetcher_repo_type = 'repos'
+
+    def __init__(self, base_url: str):
+        super().__init__()
+        self.base_url = base_url
+
+    def get_path(self, path: str) -> str:
+        return self.base_url + path
+
+
+def test_fetch_for_repos_resolved(http_server):
+    """Check that repos found to be missing or renamed are skipped or redirected by later fetchers in the same run."""
+    requested = []
+
+    def route(request):
+        requested.append(request.path)
+
+        if request.path.startswith('/repos/TEST_main/old'):
+            return 301, {'Location': request.path.replace('/old', '/new')}, None
+
+        if request.path.startswith('/repos/TEST_main/gone'):
+            return 404, {}, None
+
+        full_name = '/'.join(request.path.split('/')[2:4])
+        if request.path.endswith('/issues'):
+            return 200, {}, [{'node_id': f'{full_name}-issue'}]
+
+        return 200, {}, {'node_id': full_name, 'full_name': full_name}
+
+    repos = ['TEST_main/old', 'TEST_main/gone', 'TEST_main/live']
+    db.collection('status').delete_many({'_repo_name': {'$regex': '^TEST_main/'}})
+
+    gha.fetch_for_repos(repos, fetcher_factory=StubFetcher(http_server(route)))
+
+    issues = [path for path in requested if path.endswith('/issues')]
+    assert sorted(issues) == ['/repos/TEST_main/live/issues', '/repos/TEST_main/new/issues']
+    assert db.collection('issues').find_one({'node_id': 'TEST_main/new-issue'})['_repo_name'] == 'TEST_main/new'
@@ -0,0 +1,93 @@
+import concurrent.futures
+import json
+import threading
+import urllib.request
+
+from github_analysis import metrics
+
+
+def test_histogram():
+    histogram = metrics.Histogram('test_seconds', 'Test histogram', buckets=[0.1, 1])
+    histogram.observe(0.05, stage='a')
+    histogram.observe(0.5, stage='a')
+    histogram.observe(5, stage='a')
+
+    lines = histogram.render()
+    assert 'test_seconds_bucket{stage="a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{stage="a",le="1"} 2' in lines
+    assert 'test_seconds_bucket{stage="a",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{stage="a"} 3' in lines
+
+    snapshot, = histogram.snapshot()
+    assert snapshot['count'] == 3
+    assert snapshot['sum'] == 5.55
+
+
+def test_instrument():
+    @metrics.instrument('test_fetcher')
+    def fetcher():
+        with metrics.time_stage('parse'):
+            return metrics.current_fetcher.get()
+
+    assert fetcher() == 'test_fetcher'
+    assert metrics.current_fetcher.get() == ''
+
+    labels = [item['labels'] for item in metrics.stage_seconds.snapshot()]
+    assert {'fetcher': 'test_fetcher', 'stage': 'parse'} in labels
+
+
+def test_serve():
+    metrics.sleep_seconds.inc(2, reason='test')
+    server = metrics.serve(0)
+
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{server.server_port}/metrics') as response:
+            body = response.read().decode()
+
+    finally:
+        server.shutdown()
+
+    assert 'gha_sleep_seconds_total{reason="test"} 2' in body
+
+
+def test_summary_writer(tmp_path):
+    path = tmp_path.joinpath('metrics.jsonl')
+    metrics.SummaryWriter(path, interval=60).close()
+
+    summary = json.loads(path.read_text().splitlines()[-1])
+    assert 'gha_stage_seconds' in summary['metrics']
+
+
+def test_profiler(tmp_path):
+    profiler = metrics.Profiler(tmp_path)
+
+    with profiler.memory('test'):
+        with profiler.profile('test'):
+            sorted(range(1000), reverse=True)
+
+    # Each profile is merged into the stage's statistics as it finishes
+    with profiler.profile('test'):
+        sorted(range(1000), reverse=True)
+
+    calls = {func[2]: stat[1] for func, stat in profiler._stats['test'].stats.items()}
+    assert calls['<built-in method builtins.sorted>'] == 2
+
+    # Fetches running at the same time in other threads are not profiled, rather than failing
+    barrier = threading.Barrier(4)
+
+    def fetch():
+        with profiler.profile('concurrent'):
+            barrier.wait(timeout=10)
+            sorted(range(1000), reverse=True)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        for future in [executor.submit(fetch) for _ in range(4)]:
+            future.result()
+
+    assert 'concurrent' in profiler._stats
+
+    profiler.close()
+
+    assert tmp_path.joinpath('test.prof').exists()
+    assert tmp_path.joinpath('test.txt').exists()
+    assert tmp_path.joinpath('test.memory.txt').read_text().startswith('Peak traced memory')
@@ -0,0 +1,52 @@
+import os
+from unittest import mock
+
+import gridfs
+
+from github_analysis import db, overflow
+from github_analysis.sinks import MongoSink
+
+
+def test_fit_document_compressed():
+    doc = {'node_id': 'TEST', '_repo_name': 'TEST/repo', 'small': 1, 'large': 'a' * 10000}
+
+    fitted = overflow.fit_document(doc, mock.Mock(), 'node_id', max_size=1000)
+    assert fitted['small'] == 1
+    assert 'large' not in fitted
+    assert list(fitted['_overflow']['compressed']) == ['large']
+
+    assert overflow.restore_document(fitted, None) == doc
+
+    # Documents which fit are stored unchanged
+    assert overflow.fit_document(doc, mock.Mock(), 'node_id') is doc
+
+
+def test_fit_document_gridfs():
+    collection = db.collection('TEST_overflow')
+    doc = {'node_id': 'TEST', '_repo_name': 'TEST/repo', 'random': os.urandom(10000)}
+
+    fitted = overflow.fit_document(doc, collection, 'node_id', max_size=1000)
+    assert set(fitted) == {'node_id', '_repo_name', '_overflow'}
+
+    assert overflow.restore_document(fitted, collection.database) == doc
+
+
+def test_mongo_sink_overflow_unchanged():
+    collection = db.collection('TEST_overflow_sink')
+    collection.delete_many({})
+    sink = MongoSink('TEST_overflow_sink', collection, skip_unchanged=True)
+    record = {'node_id': 'TEST', '_repo_name': 'TEST/repo', 'random': os.urandom(10000)}
+
+    with mock.patch('github_analysis.overflow.MAX_INLINE_SIZE', 1000):
+        # Fetching the same record again must not remove the file the stored document refers to
+        sink.write(dict(record), 'TEST/repo')
+        sink.write(dict(record), 'TEST/repo')
+
+        stored = collection.find_one({'node_id': 'TEST'}, projection={'_id': False})
+        assert overflow.restore_document(stored, collection.database)['random'] == record['random']
+
+        # Files for previous versions are removed once a changed record has been written
+        sink.write({**record, 'random': os.urandom(10000)}, 'TEST/repo')
+
+    bucket = gridfs.GridFSBucket(collection.database, bucket_name=overflow.GRIDFS_BUCKET)
+    assert len(list(bucket.find({'filename': 'TEST_overflow_sink/TEST'}))) == 1
@@ -0,0 +1,86 @@
+import concurrent.futures
+import pathlib
+from unittest import mock
+
+from github_analysis import __main__ as gha
+from github_analysis import connectors, fetch, metrics
+from github_analysis.projection import EmbeddedUsers, Projection
+from github_analysis.sinks import ShardStore, Sink
+
+data_dir = pathlib.Path(__file__).parent.joinpath('data')
+
+USER = {'login': 'octocat', 'id': 1, 'node_id': 'U1', 'avatar_url': 'a', 'url': 'u', 'repos_url': 'r', 'type': 'User'}
+
+
+def test_projection():
+    record = {
+        'node_id': 'C1',
+        'url': 'https://api.github.com/repos/octocat/test/issues/comments/1',
+        'html_url': 'https://github.com/octocat/test/issues/1#issuecomment-1',
+        'issue_url': 'https://api.github.com/repos/octocat/test/issues/1',
+        'user': USER,
+        'reactions': {'url': 'x', 'total_count': 0},
+        'assignees': [USER],
+    }
+
+    projected, users = Projection('TEST_comments', keep={'issue_url'}).apply([record])
+    assert projected == [{
+        'node_id': 'C1',
+        'html_url': record['html_url'],
+        'issue_url': record['issue_url'],
+        'user': 1,
+        'reactions': {'total_count': 0},
+        'assignees': [1],
+    }]
+    assert users == [{'login': 'octocat', 'id': 1, 'node_id': 'U1', 'type': 'User'}]
+
+    original = metrics.projection_bytes.value(collection='TEST_comments', stage='original')
+    assert 0 < metrics.projection_bytes.value(collection='TEST_comments', stage='projected') < original
+
+    # Users are only reduced when embedded in another record
+    projected, users = Projection('TEST_users', reduce_users=False).apply(USER)
+    assert projected == {'login': 'octocat', 'id': 1, 'node_id': 'U1', 'type': 'User'}
+    assert users == []
+
+
+def test_import_for_repos_compact(tmp_path):
+    """Check that embedded users are stored once when importing with the compact projection."""
+    with ShardStore(tmp_path) as store:
+        fetcher_factory = fetch.FileFetcher(data_dir, store=store, projection='compact')
+        gha.fetch_for_repos(['jag1g13/pycgtool'], fetcher_factory, only='commits')
+
+    store = ShardStore(tmp_path)
+    commits = list(store.iter_records('commits'))
+    users = list(store.iter_records('embedded_users'))
+
+    assert all('url' not in commit for commit in commits)
+    assert len(users) == len({user['id'] for user in users}) > 0
+    assert {commit['author'] for commit in commits if commit['author'] is not None} <= {user['id'] for user in users}
+
+
+def test_embedded_users_buffered():
+    """Check that repos are recorded as having embedded users once, after the writes for their fetch succeed."""
+    users_sink = mock.Mock(spec=Sink)
+    commits_sink = mock.Mock(spec=Sink)
+    users_written = concurrent.futures.Future()
+    commits_written = concurrent.futures.Future()
+    users_sink.write.return_value = users_written
+    commits_sink.write.return_value = commits_written
+
+    connector = connectors.FileConnector(str(data_dir.joinpath('COMMITS.d', '{owner}+{repo}.responses')))
+    fetcher = fetch.make_fetcher(
+        'commits',
+        commits_sink,
+        connector,
+        projection=Projection('commits'),
+        embedded_users=EmbeddedUsers(users_sink)
+    )
+    fetcher('jag1g13/pycgtool', stream=True)
+
+    assert commits_sink.write.call_count == 2
+    assert users_sink.mark_fetched.call_count == 0
+
+    users_written.set_result(None)
+    commits_written.set_result(None)
+    users_sink.mark_fetched.assert_called_once()
+    assert users_sink.mark_fetched.call_args.args[0] == 'jag1g13/pycgtool'
@@ -0,0 +1,84 @@
+import datetime
+import pathlib
+
+from github_analysis import __main__ as gha
+from github_analysis import connectors, db, fetch, metrics
+from github_analysis.sinks import MongoSink, ShardStore
+
+data_dir = pathlib.Path(__file__).parent.joinpath('data')
+
+
+def test_shard_store(tmp_path):
+    with ShardStore(tmp_path, 'TEST_set', max_records=2) as store:
+        sink = store.sink('commits')
+        started = datetime.datetime(2021, 1, 1)
+
+        sink.write([{'node_id': 'a1', '_repo_name': 'TEST/a'}, {'node_id': 'a2', '_repo_name': 'TEST/a'}], 'TEST/a')
+        sink.write({'node_id': 'a3', '_repo_name': 'TEST/a'}, 'TEST/a')
+        sink.mark_fetched('TEST/a', started, 'test')
+
+        # The second shard is still open, so the repo is not yet complete
+        assert not sink.is_fetched('TEST/a')
+
+        # Records for a repo whose fetch did not complete - filling and closing the second shard
+        sink.write({'node_id': 'b1', '_repo_name': 'TEST/b'}, 'TEST/b')
+        assert sink.is_fetched('TEST/a')
+
+    shards = list(tmp_path.joinpath('fetcher=commits', 'set=TEST_set').glob('*.jsonl.gz'))
+    assert len(shards) == 2
+
+    store = ShardStore(tmp_path, 'TEST_set')
+    assert store.sink('commits').fetched_repos() == {'TEST/a'}
+    assert store.sink('commits').last_fetched('TEST/a') == started
+    assert [record['node_id'] for record in store.iter_records('commits')] == ['a1', 'a2', 'a3']
+
+    # Sets are stored separately
+    assert ShardStore(tmp_path, 'TEST_other').sink('commits').fetched_repos() == set()
+
+
+def test_make_fetcher_shard_store(tmp_path):
+    connector = connectors.FileConnector(str(data_dir.joinpath('{owner}+{repo}.response')))
+
+    with ShardStore(tmp_path) as store:
+        fetcher = fetch.make_fetcher('repos', store.sink('repos'), connector)
+        fetcher('jag1g13/pycgtool', stream=True)
+
+    with ShardStore(tmp_path) as store:
+        fetcher = fetch.make_fetcher('repos', store.sink('repos'), connector)
+
+        try:
+            fetcher('jag1g13/pycgtool', skip_existing=True)
+            assert False, 'Expected existing data to be skipped'
+
+        except fetch.DataExists:
+            pass
+
+    assert [record['name'] for record in ShardStore(tmp_path).iter_records('repos')] == ['pycgtool']
+
+
+def test_import_for_repos_shard_store(tmp_path):
+    """Check that importing to files with worker processes stores every record without using the database."""
+    with ShardStore(tmp_path) as store:
+        fetcher_factory = fetch.FileFetcher(data_dir, store=store)
+        gha.fetch_for_repos(['jag1g13/pycgtool'], fetcher_factory, only='commits', skip_existing=True, workers=2)
+
+    assert len(list(ShardStore(tmp_path).iter_records('commits'))) > 0
+
+
+def test_mongo_sink_skip_unchanged():
+    collection = db.collection('TEST_changes')
+    collection.delete_many({})
+    sink = MongoSink('TEST_changes', collection, skip_unchanged=True)
+
+    def count(change: str) -> float:
+        return metrics.document_changes.value(collection='TEST_changes', change=change)
+
+    sink.write([{'node_id': 'a', 'value': 1}, {'node_id': 'b', 'value': 1}], 'TEST/repo')
+    assert count('inserted') == 2
+
+    sink.write([{'node_id': 'a', 'value': 1}, {'node_id': 'b', 'value': 2}], 'TEST/repo')
+    assert count('unchanged') == 1
+    assert count('changed') == 1
+
+    assert collection.find_one({'node_id': 'b'})['value'] == 2
+    assert collection.count_documents({}) == 2